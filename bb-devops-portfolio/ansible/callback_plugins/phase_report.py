@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+BB IaC Pipeline - Per-role progress and phase timing for site.yml
+Prints a line as each phase (fact gathering, pre_tasks, every role,
+post_tasks, handlers) starts and finishes, and writes the wall-clock time
+of each phase as JSON when the run ends
+
+The report also estimates the time a single pass saves over one run per
+role (--tags security, --tags nginx, ...): every extra run pays fact
+gathering and the pre_tasks again, on a fresh SSH master connection
+
+Usage (ansible.cfg):
+    callbacks_enabled = phase_report
+    BB_PHASE_REPORT_JSON=../logs/ansible-phases.json ansible-playbook site.yml
+"""
+
+import json
+import os
+import time
+
+from ansible.plugins.callback import CallbackBase
+
+DOCUMENTATION = """
+    name: phase_report
+    type: aggregate
+    short_description: per-role progress and phase timing
+    description:
+      - Reports when each role of the play starts and ends, and writes phase durations as JSON.
+    options:
+      output:
+        description: JSON file the phase report is written to.
+        env:
+          - name: BB_PHASE_REPORT_JSON
+        ini:
+          - section: callback_phase_report
+            key: output
+      baseline_runs:
+        description: Runs the single pass replaces, for the saved-time estimate.
+        default: 3
+        type: int
+        env:
+          - name: BB_PHASE_REPORT_BASELINE_RUNS
+        ini:
+          - section: callback_phase_report
+            key: baseline_runs
+"""
+
+FACTS = "facts"
+PRE_TASKS = "pre_tasks"
+POST_TASKS = "post_tasks"
+HANDLERS = "handlers"
+# Phases every tag-limited run repeats (pre_tasks are tagged always)
+PER_RUN = (FACTS, PRE_TASKS)
+
+
+class PhaseClock:
+    """Wall-clock time and task outcomes per phase, in the order phases ran"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.phases = []
+        self.current = None
+        self.started = clock()
+
+    def enter(self, name):
+        """Switch to phase name; returns (finished phase, started phase) or None when unchanged"""
+        if self.current and self.current["name"] == name:
+            return None
+        finished = self.close()
+        self.current = {"name": name, "seconds": 0.0, "tasks": 0, "changed": 0, "failed": 0,
+                        "_since": self.clock()}
+        self.phases.append(self.current)
+        return finished, self.current
+
+    def close(self):
+        phase = self.current
+        if phase is not None:
+            phase["seconds"] = round(self.clock() - phase.pop("_since"), 3)
+            self.current = None
+        return phase
+
+    def record(self, changed=False, failed=False):
+        if self.current is not None:
+            self.current["tasks"] += 1
+            self.current["changed"] += bool(changed)
+            self.current["failed"] += bool(failed)
+
+    def seconds(self, name):
+        return sum(phase["seconds"] for phase in self.phases if phase["name"] == name)
+
+    def report(self, baseline_runs=3):
+        self.close()
+        per_run = sum(self.seconds(name) for name in PER_RUN)
+        return {
+            "total_seconds": round(self.clock() - self.started, 3),
+            "facts_cached": not any(phase["name"] == FACTS for phase in self.phases),
+            "phases": self.phases,
+            # Lower bound: the SSH master connection and playbook start-up
+            # of the extra runs are not counted
+            "baseline_runs": baseline_runs,
+            "saved_seconds": round(max(baseline_runs - 1, 0) * per_run, 3),
+        }
+
+
+def phase_of(task, section):
+    """Phase a task belongs to: its role, or the play section it is listed in"""
+    if task.action in ("gather_facts", "setup", "ansible.builtin.gather_facts", "ansible.builtin.setup") \
+            and task.get_name() == "Gathering Facts":
+        return FACTS
+    role = getattr(task, "_role", None)
+    if role is not None:
+        return role.get_name()
+    return section
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = "aggregate"
+    CALLBACK_NAME = "phase_report"
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self):
+        super().__init__()
+        self.clock = PhaseClock()
+        self.section = PRE_TASKS
+
+    def _enter(self, name):
+        switched = self.clock.enter(name)
+        if switched is None:
+            return
+        finished, started = switched
+        if finished is not None:
+            self._display.display(
+                f"   → {finished['name']}: {finished['seconds']:.1f}s "
+                f"({finished['tasks']} results, {finished['changed']} changed)"
+            )
+        self._display.display(f"   → {started['name']}: started")
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        phase = phase_of(task, self.section)
+        if getattr(task, "_role", None) is not None:
+            # Play-level tasks after the first role are post_tasks
+            self.section = POST_TASKS
+        self._enter(phase)
+
+    def v2_playbook_on_handler_task_start(self, task):
+        self._enter(HANDLERS)
+
+    def v2_runner_on_ok(self, result):
+        self.clock.record(changed=result._result.get("changed", False))
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self.clock.record(failed=not ignore_errors)
+
+    def v2_runner_on_unreachable(self, result):
+        self.clock.record(failed=True)
+
+    def v2_runner_on_skipped(self, result):
+        self.clock.record()
+
+    def v2_playbook_on_stats(self, stats):
+        report = self.clock.report(self.get_option("baseline_runs"))
+        for phase in report["phases"]:
+            self._display.display(f"   → {phase['name']}: {phase['seconds']:.1f}s")
+        facts = "from cache" if report["facts_cached"] else "gathered"
+        self._display.display(
+            f"   → Single pass: {report['total_seconds']:.1f}s, facts {facts}, "
+            f"~{report['saved_seconds']:.1f}s saved over {report['baseline_runs']} runs"
+        )
+        output = self.get_option("output")
+        if output:
+            os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+            with open(output, "w") as f:
+                json.dump(report, f, indent=2)
@@ -0,0 +1,60 @@
+// Polls the monitoring agent's JSON snapshot (a static file, usually
+// answered with 304) and only touches widgets whose value changed
+// Deferred, so the body and its data-* settings are already parsed
+const SNAPSHOT_URL = document.body.dataset.snapshotUrl;
+const POLL_MS = Number(document.body.dataset.pollSeconds) * 1000;
+const STATUS_CLASSES = ['status-healthy', 'status-warning', 'status-critical'];
+const FORMATS = {
+    duration: (s) => s == null ? 'N/A' : `${Math.floor(s / 3600)}h ${Math.floor(s % 3600 / 60)}m`,
+    percent: (v) => `${v}%`,
+    service: (up) => up ? '✅ Nginx: Active' : '❌ Nginx: Down',
+    alerts: (list) => list.length ? list.join('\n') : 'No active alerts',
+    time: (iso) => new Date(iso).toLocaleString(),
+};
+
+function lookup(snapshot, path) {
+    return path.split('.').reduce((value, key) => value == null ? value : value[key], snapshot);
+}
+
+function setStatus(el, status) {
+    const wanted = 'status-' + status;
+    if (!el.classList.contains(wanted)) {
+        el.classList.remove(...STATUS_CLASSES);
+        el.classList.add(wanted);
+    }
+}
+
+function render(snapshot) {
+    document.querySelectorAll('[data-field]').forEach((el) => {
+        const value = lookup(snapshot, el.dataset.field);
+        const format = FORMATS[el.dataset.format];
+        const text = format ? format(value) : String(value);
+        if (el.textContent !== text) {
+            el.textContent = text;
+        }
+    });
+    document.querySelectorAll('[data-status]').forEach((el) => {
+        setStatus(el, lookup(snapshot, el.dataset.status) === false ? 'critical' : snapshot.status);
+    });
+    document.getElementById('snapshot-state').textContent = 'Live';
+}
+
+async function poll() {
+    if (document.hidden) {
+        return;
+    }
+    try {
+        // no-cache revalidates with If-None-Match / If-Modified-Since
+        const response = await fetch(SNAPSHOT_URL, {cache: 'no-cache'});
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+        render(await response.json());
+    } catch (error) {
+        document.getElementById('snapshot-state').textContent = `Stale (${error.message})`;
+    }
+}
+
+poll();
+setInterval(poll, POLL_MS);
+document.addEventListener('visibilitychange', poll);
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+BB IaC Pipeline - Sliding-window authentication failure detector
+Counts sshd authentication failures per source IP over 1m, 5m and 1h
+sliding windows so bursts are seen within seconds instead of once a day
+
+Each source keeps two small ring buffers (10 s buckets covering five
+minutes, 1 min buckets covering the hour); sources are held in an LRU map
+capped at max_sources, so memory stays bounded under a spray from millions
+of distinct addresses. A source over any window limit is reported once as
+a BAN line, which the fail2ban bb-auth-detector jail acts on - auth.log is
+read once, by the monitoring agent
+
+Usage:
+    auth_detector.py [--limits 1m=5,5m=10,1h=30] /var/log/auth.log
+"""
+
+import argparse
+import re
+import sys
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+
+AUTH_LOG = "/var/log/auth.log"
+BAN_LOG = "/var/log/bb-iac-auth-bans.log"
+MAX_SOURCES = 20000
+
+# (name, seconds), shortest first
+WINDOWS = (("1m", 60), ("5m", 300), ("1h", 3600))
+DEFAULT_LIMITS = {"1m": 5, "5m": 10, "1h": 30}
+
+# sshd's own failure lines. An unknown user logs "Invalid user X from IP"
+# and then "Failed password for invalid user X from IP" for the same
+# attempt, so the pair is counted once per sshd PID; the pam_unix
+# "authentication failure" line repeats the attempt and is not matched
+_FAILURE = re.compile(
+    rb"(?:Failed \S+ for (invalid user )?.* from|(Invalid user) .* from)"
+    rb" ((?:\d{1,3}\.){3}\d{1,3}|[0-9a-fA-F:]*:[0-9a-fA-F:]+)"
+)
+_SSHD_PID = re.compile(rb"sshd\[(\d+)\]:")
+_SYSLOG_TIME = re.compile(rb"^([A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d) ")
+_ISO_TIME = re.compile(rb"^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(?:\.\d+)?(?:[+-]\d\d:\d\d|Z)?) ")
+
+
+class RingCounter:
+    """Event counts in fixed-width time buckets over a bounded span"""
+
+    __slots__ = ("width", "counts", "head")
+
+    def __init__(self, width, size):
+        self.width = width
+        self.counts = array("I", bytes(4 * size))
+        self.head = None
+
+    def add(self, stamp, n=1):
+        bucket = int(stamp // self.width)
+        size = len(self.counts)
+        if self.head is None or bucket - self.head >= size:
+            self.counts = array("I", bytes(4 * size))
+            self.head = bucket
+        elif bucket > self.head:
+            for skipped in range(self.head + 1, bucket + 1):
+                self.counts[skipped % size] = 0
+            self.head = bucket
+        elif bucket <= self.head - size:
+            # Older than the span (late or out-of-order line)
+            return
+        self.counts[bucket % size] += n
+
+    def total(self, now, seconds):
+        """Events in the `seconds` up to and including now's bucket"""
+        if self.head is None:
+            return 0
+        size = len(self.counts)
+        bucket = int(now // self.width)
+        first = max(bucket - seconds // self.width + 1, self.head - size + 1)
+        return sum(self.counts[b % size] for b in range(first, min(bucket, self.head) + 1))
+
+
+class SourceWindows:
+    """1m/5m windows at 10 s resolution and the 1h window at 1 min resolution"""
+
+    __slots__ = ("fine", "coarse")
+
+    def __init__(self):
+        self.fine = RingCounter(10, 30)
+        self.coarse = RingCounter(60, 60)
+
+    def add(self, stamp, n=1):
+        self.fine.add(stamp, n)
+        self.coarse.add(stamp, n)
+
+    def counts(self, now):
+        return {
+            name: (self.fine if seconds <= 300 else self.coarse).total(now, seconds)
+            for name, seconds in WINDOWS
+        }
+
+
+def failure_source(line):
+    """Source address of an authentication failure line, or None"""
+    match = _FAILURE.search(line)
+    return match.group(3).decode() if match else None
+
+
+def line_time(line, now):
+    """Epoch seconds of a syslog line (classic or RFC 3339), else now"""
+    match = _ISO_TIME.match(line)
+    if match:
+        try:
+            return datetime.fromisoformat(match.group(1).decode().replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            return now
+    match = _SYSLOG_TIME.match(line)
+    if match:
+        year = time.localtime(now).tm_year
+        try:
+            stamp = time.mktime(time.strptime(f"{year} {match.group(1).decode()}", "%Y %b %d %H:%M:%S"))
+        except ValueError:
+            return now
+        # Classic syslog has no year: a December line read in January
+        if stamp > now + 86400:
+            stamp = time.mktime(time.strptime(f"{year - 1} {match.group(1).decode()}", "%Y %b %d %H:%M:%S"))
+        return stamp
+    return now
+
+
+class AuthFailureDetector:
+    """Per-source sliding-window failure counts with LRU-bounded memory"""
+
+    def __init__(self, limits=None, max_sources=MAX_SOURCES):
+        self.limits = dict(DEFAULT_LIMITS if limits is None else limits)
+        self.max_sources = max_sources
+        self.sources = OrderedDict()
+        self.total = SourceWindows()
+        self.flagged = {}
+        # (source, window, count) for sources that crossed a limit, drained by the caller
+        self.breaches = []
+        self.evicted = 0
+        # (sshd pid, source) whose "Invalid user" line was counted, awaiting its "Failed" line
+        self.invalid_users = OrderedDict()
+
+    def record(self, source, stamp, now=None):
+        """Count one failure; returns (window, count) if the source just crossed a limit"""
+        windows = self.sources.get(source)
+        if windows is None:
+            windows = self.sources[source] = SourceWindows()
+            if len(self.sources) > self.max_sources:
+                evicted, _ = self.sources.popitem(last=False)
+                self.flagged.pop(evicted, None)
+                self.evicted += 1
+        else:
+            self.sources.move_to_end(source)
+        windows.add(stamp)
+        self.total.add(stamp)
+        if source in self.flagged:
+            return None
+        breach = self._breach(windows.counts(stamp if now is None else now))
+        if breach:
+            self.flagged[source] = breach
+        return breach
+
+    def _breach(self, counts):
+        for name, _ in WINDOWS:
+            limit = self.limits.get(name)
+            if limit is not None and counts[name] > limit:
+                return name, counts[name]
+        return None
+
+    def _new_attempt(self, line, match, source):
+        """False for the "Failed ... for invalid user" line of an already counted attempt"""
+        pid = _SSHD_PID.search(line)
+        key = (pid.group(1) if pid else None, source)
+        if match.group(2):
+            self.invalid_users[key] = True
+            if len(self.invalid_users) > self.max_sources:
+                self.invalid_users.popitem(last=False)
+            return True
+        return not (match.group(1) and self.invalid_users.pop(key, None))
+
+    def feed(self, lines, now):
+        """Pass lines through unchanged, recording one failure per authentication attempt"""
+        for line in lines:
+            match = _FAILURE.search(line)
+            if match:
+                source = match.group(3).decode()
+                if self._new_attempt(line, match, source):
+                    breach = self.record(source, line_time(line, now), now)
+                    if breach:
+                        self.breaches.append((source,) + breach)
+            yield line
+
+    def rates(self, source, now):
+        windows = self.sources.get(source)
+        return windows.counts(now) if windows else {name: 0 for name, _ in WINDOWS}
+
+    def totals(self, now):
+        """Failures from all sources in each window"""
+        return self.total.counts(now)
+
+    def offenders(self, now):
+        """[(source, window, count)] still over a limit; sources back under are unflagged"""
+        current = []
+        for source in list(self.flagged):
+            breach = self._breach(self.rates(source, now))
+            if breach:
+                current.append((source,) + breach)
+            else:
+                del self.flagged[source]
+        return sorted(current, key=lambda item: -item[2])
+
+
+def parse_limits(value):
+    """"1m=5,5m=10,1h=30" -> {"1m": 5, "5m": 10, "1h": 30}"""
+    limits = {}
+    names = {name for name, _ in WINDOWS}
+    for part in filter(None, value.split(",")):
+        name, _, limit = part.partition("=")
+        if name not in names or not limit.isdigit():
+            raise argparse.ArgumentTypeError(f"bad window limit {part!r}")
+        limits[name] = int(limit)
+    return limits
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sources over the auth failure window limits in a log")
+    parser.add_argument("log", nargs="?", default=AUTH_LOG)
+    parser.add_argument("--limits", type=parse_limits, default=DEFAULT_LIMITS)
+    parser.add_argument("--max-sources", type=int, default=MAX_SOURCES)
+    args = parser.parse_args(argv)
+
+    detector = AuthFailureDetector(args.limits, args.max_sources)
+    now = time.time()
+    with open(args.log, "rb") as f:
+        for _ in detector.feed((line.rstrip(b"\n") for line in f), now):
+            pass
+    totals = detector.totals(now)
+    print(" ".join(f"{name}={totals[name]}" for name, _ in WINDOWS))
+    for source, window, count in detector.offenders(now):
+        print(f"{source} {count} failures in {window}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+BB IaC Pipeline - Precomputed health status for /health
+Runs the deep checks (nginx master and workers, disk, memory; the
+CloudWatch agent is reported but does not change the status) every few
+seconds, off the request path, and atomically replaces
+the JSON status file nginx serves for /health
+
+Load balancer probes cost nginx a stat and a read however often they
+come. While any check fails the status file is removed and the document
+is written to <file>.unhealthy instead, which nginx returns with a 503
+
+Usage:
+    health_check.py [--interval 15] [--version 1.0.0] [--once] /var/www/html/health
+    health_check.py [--once] @health-check.args   # one argument per line
+"""
+
+import argparse
+import json
+import os
+import signal
+import socket
+import sys
+import time
+
+from monitor_agent import NGINX_PIDFILE, HostProbe, write_atomic
+
+HEALTH_FILE = "/var/www/html/health"
+# /proc/<pid>/comm is cut at 15 characters
+CLOUDWATCH_AGENT = "amazon-cloudwat"
+
+OK = "ok"
+WARN = "warn"
+FAIL = "fail"
+# Overall status by worst check result
+STATUS = {OK: "healthy", WARN: "degraded", FAIL: "unhealthy"}
+_RANK = {OK: 0, WARN: 1, FAIL: 2}
+
+
+class Limits:
+    """Warn/fail percentages for the resource checks"""
+
+    def __init__(self, disk_warn=85, disk_fail=95, memory_warn=90, memory_fail=98, min_workers=1):
+        self.disk_warn = disk_warn
+        self.disk_fail = disk_fail
+        self.memory_warn = memory_warn
+        self.memory_fail = memory_fail
+        self.min_workers = min_workers
+
+
+class HealthProbe(HostProbe):
+    """HostProbe plus a single /proc scan for nginx workers and the CloudWatch agent"""
+
+    def nginx_master(self):
+        try:
+            with open(self.nginx_pidfile) as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def processes(self):
+        """[(pid, ppid, comm)] for every process"""
+        found = []
+        for name in os.listdir(self.proc_root):
+            if not name.isdigit():
+                continue
+            try:
+                stat = self._read(os.path.join(name, "stat"))
+            except OSError:
+                # Exited between listdir and open
+                continue
+            # pid (comm) state ppid ...; comm may itself contain spaces or ")"
+            comm = stat[stat.index("(") + 1:stat.rindex(")")]
+            ppid = int(stat[stat.rindex(")") + 2:].split()[1])
+            found.append((int(name), ppid, comm))
+        return found
+
+
+def _level(value, warn, fail):
+    if value >= fail:
+        return FAIL
+    return WARN if value >= warn else OK
+
+
+def run_checks(probe, limits=None):
+    """{check: {"status": ok|warn|fail, ...details}}"""
+    limits = limits or Limits()
+    processes = probe.processes()
+    master = probe.nginx_master() if probe.nginx_running() else None
+    workers = sum(1 for _, ppid, comm in processes if master and ppid == master and comm.startswith("nginx"))
+    if master is None or workers == 0:
+        nginx = FAIL
+    else:
+        nginx = WARN if workers < limits.min_workers else OK
+    disk = probe.disk_pct()
+    memory = probe.memory_pct()
+    agent = any(comm == CLOUDWATCH_AGENT for _, _, comm in processes)
+    return {
+        "nginx": {"status": nginx, "master": master is not None, "workers": workers},
+        "disk": {"status": _level(disk, limits.disk_warn, limits.disk_fail), "used_pct": disk},
+        "memory": {"status": _level(memory, limits.memory_warn, limits.memory_fail), "used_pct": memory},
+        # Informational: the host serves the same without its telemetry agent
+        "cloudwatch_agent": {"status": OK, "running": agent},
+    }
+
+
+def status_document(checks, version, host, now):
+    worst = max((check["status"] for check in checks.values()), key=_RANK.__getitem__, default=OK)
+    return {
+        "status": STATUS[worst],
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now)),
+        "version": version,
+        "server": host,
+        "checks": checks,
+    }
+
+
+def publish(path, document):
+    """Write the document where nginx will answer 200 (healthy/degraded) or 503 (unhealthy)"""
+    text = json.dumps(document, sort_keys=True) + "\n"
+    down = path + ".unhealthy"
+    if document["status"] == STATUS[FAIL]:
+        # Error page first, so /health never 404s on its way to 503
+        write_atomic(down, text)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+    else:
+        write_atomic(path, text)
+        try:
+            os.unlink(down)
+        except FileNotFoundError:
+            pass
+
+
+class HealthChecker:
+    """Periodic deep checks publishing the /health document"""
+
+    def __init__(self, probe, path=HEALTH_FILE, version="unknown", limits=None, host=None, clock=time.time):
+        self.probe = probe
+        self.path = path
+        self.version = version
+        self.limits = limits or Limits()
+        self.host = host or socket.gethostname()
+        self.clock = clock
+
+    def check(self):
+        document = status_document(run_checks(self.probe, self.limits), self.version, self.host, self.clock())
+        publish(self.path, document)
+        return document
+
+    def run(self, interval):
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+        while not stopping:
+            started = time.monotonic()
+            self.check()
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write the precomputed /health status document",
+                                     fromfile_prefix_chars="@")
+    parser.add_argument("path", nargs="?", default=HEALTH_FILE)
+    parser.add_argument("--interval", type=float, default=15.0, help="seconds between checks")
+    parser.add_argument("--once", action="store_true", help="check and publish once, then exit")
+    parser.add_argument("--version", default="unknown", help="application version reported")
+    parser.add_argument("--nginx-pidfile", default=NGINX_PIDFILE)
+    parser.add_argument("--disk-warn", type=int, default=85)
+    parser.add_argument("--disk-fail", type=int, default=95)
+    parser.add_argument("--memory-warn", type=int, default=90)
+    parser.add_argument("--memory-fail", type=int, default=98)
+    parser.add_argument("--min-workers", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    checker = HealthChecker(
+        HealthProbe(nginx_pidfile=args.nginx_pidfile),
+        path=args.path,
+        version=args.version,
+        limits=Limits(args.disk_warn, args.disk_fail, args.memory_warn, args.memory_fail, args.min_workers),
+    )
+    if args.once:
+        document = checker.check()
+        print(document["status"])
+        return 1 if document["status"] == STATUS[FAIL] else 0
+    checker.run(args.interval)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+BB IaC Pipeline - Indexed search over rotated log archives
+`index` runs from the logrotate postrotate hooks (and a daily cron job)
+and records, for every rotated generation of a log, its time range, line
+count and a bloom filter of client IPs, paths and status codes
+
+`query` then skips every archive whose time range or bloom filter rules
+it out and scans the remaining ones in parallel, one process per core
+
+Archives are identified by a hash of their first bytes, so an entry stays
+valid when logrotate renames access.log.1 to access.log.2; it is rebuilt
+when the file's size or mtime changes (nginx still appending to .1 after
+the rotate hook indexed it, or compression to .2.gz)
+
+Usage:
+    log_archive.py index /var/log/nginx/access.log [...]
+    log_archive.py query /var/log/nginx/access.log --since "2025-01-31 10:00" \\
+        --until "2025-01-31 11:00" [--ip 203.0.113.7] [--path /login] [--status 401]
+"""
+
+import argparse
+import base64
+import glob
+import gzip
+import hashlib
+import json
+import math
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+INDEX_FILE = "/var/lib/bb-iac-monitor/archive-index.json"
+FINGERPRINT_BYTES = 256
+FALSE_POSITIVE_RATE = 0.01
+
+_MONITOR_TIME = re.compile(rb"^\[(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)\]")
+_ERROR_TIME = re.compile(rb"^(\d{4}/\d\d/\d\d \d\d:\d\d:\d\d)")
+_IPV4 = re.compile(rb"\b(?:\d{1,3}\.){3}\d{1,3}\b")
+
+
+class BloomFilter:
+    """Fixed-size bloom filter using double hashing over blake2b"""
+
+    def __init__(self, bits, hashes, data=None):
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray(data) if data is not None else bytearray((bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, items, rate=FALSE_POSITIVE_RATE):
+        items = max(items, 1)
+        bits = max(64, int(-items * math.log(rate) / (math.log(2) ** 2)))
+        return cls(bits, max(1, round(bits / items * math.log(2))))
+
+    def _positions(self, token):
+        digest = hashlib.blake2b(token, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def add(self, token):
+        for pos in self._positions(token):
+            self.data[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, token):
+        return all(self.data[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(token))
+
+    def as_dict(self):
+        return {"bits": self.bits, "hashes": self.hashes, "data": base64.b64encode(bytes(self.data)).decode()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["bits"], data["hashes"], base64.b64decode(data["data"]))
+
+
+def parse_line(line):
+    """(epoch seconds or None, tokens) for access, error and monitor log lines"""
+    fields = line.split(b"\t", 5)
+    if len(fields) > 4:
+        # bb_timing: msec addr method uri status ...
+        try:
+            stamp = float(fields[0])
+        except ValueError:
+            stamp = None
+        return stamp, (b"ip:" + fields[1], b"path:" + fields[3], b"status:" + fields[4])
+    stamp = None
+    for pattern, fmt in ((_MONITOR_TIME, "%Y-%m-%d %H:%M:%S"), (_ERROR_TIME, "%Y/%m/%d %H:%M:%S")):
+        match = pattern.match(line)
+        if match:
+            stamp = time.mktime(time.strptime(match.group(1).decode(), fmt))
+            break
+    return stamp, tuple(b"ip:" + ip for ip in _IPV4.findall(line))
+
+
+def _open(path):
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def fingerprint(path):
+    with _open(path) as f:
+        return hashlib.blake2b(f.read(FINGERPRINT_BYTES), digest_size=16).hexdigest()
+
+
+def archives(log_path):
+    """Rotated generations of a log: path.N, path.N.gz and dateext names"""
+    found = set(glob.glob(glob.escape(log_path) + ".[0-9]*")) | set(glob.glob(glob.escape(log_path) + "-[0-9]*"))
+    return sorted(found)
+
+
+def _current(entry, stat):
+    """Whether an entry was built from the file as it is now"""
+    return (entry.get("size"), entry.get("mtime_ns")) == (stat.st_size, stat.st_mtime_ns)
+
+
+def index_archive(path):
+    """Index entry for one archive: time range, line count and bloom filter"""
+    stat = os.stat(path)
+    tokens = set()
+    first = last = None
+    lines = 0
+    with _open(path) as f:
+        for line in f:
+            lines += 1
+            stamp, line_tokens = parse_line(line.rstrip(b"\n"))
+            tokens.update(line_tokens)
+            if stamp is not None:
+                first = stamp if first is None else min(first, stamp)
+                last = stamp if last is None else max(last, stamp)
+    bloom = BloomFilter.for_capacity(len(tokens))
+    for token in tokens:
+        bloom.add(token)
+    return {"path": path, "first": first, "last": last, "lines": lines, "bloom": bloom.as_dict(),
+            "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+class ArchiveIndex:
+    """{fingerprint: entry} persisted as one JSON file"""
+
+    def __init__(self, path=INDEX_FILE):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.path)
+
+    def update(self, log_paths):
+        """Index archives not seen before or changed since; drop entries for deleted ones"""
+        indexed = 0
+        live = set()
+        prefixes = tuple(log_paths)
+        for log_path in log_paths:
+            for path in archives(log_path):
+                try:
+                    key = fingerprint(path)
+                    stat = os.stat(path)
+                except (OSError, EOFError):
+                    continue
+                live.add(key)
+                if key in self.entries and _current(self.entries[key], stat):
+                    self.entries[key]["path"] = path
+                    continue
+                self.entries[key] = index_archive(path)
+                indexed += 1
+        for key in [k for k, e in self.entries.items() if e["path"].startswith(prefixes) and k not in live]:
+            del self.entries[key]
+        return indexed
+
+
+class Query:
+    """Time window plus optional ip/path/status equality predicates"""
+
+    def __init__(self, since=None, until=None, ip=None, path=None, status=None):
+        self.since = since
+        self.until = until
+        self.tokens = []
+        for name, value in (("ip", ip), ("path", path), ("status", status)):
+            if value is not None:
+                self.tokens.append(f"{name}:{value}".encode())
+
+    def may_match(self, entry):
+        """False only when the index proves the archive has no match"""
+        if entry["first"] is not None:
+            if self.until is not None and entry["first"] >= self.until:
+                return False
+            if self.since is not None and entry["last"] < self.since:
+                return False
+        bloom = BloomFilter.from_dict(entry["bloom"])
+        return all(token in bloom for token in self.tokens)
+
+    def matches(self, line):
+        stamp, tokens = parse_line(line)
+        if stamp is not None:
+            if self.since is not None and stamp < self.since:
+                return False
+            if self.until is not None and stamp >= self.until:
+                return False
+        return all(token in tokens for token in self.tokens)
+
+
+def scan(path, query):
+    """Matching lines of one archive (runs in a worker process)"""
+    matched = []
+    with _open(path) as f:
+        for line in f:
+            line = line.rstrip(b"\n")
+            if query.matches(line):
+                matched.append(line)
+    return path, matched
+
+
+def search(index, log_paths, query, workers=None):
+    """(candidates, matching lines) for a query; candidates are the scanned files"""
+    candidates = []
+    for log_path in log_paths:
+        for path in archives(log_path):
+            try:
+                entry = index.entries.get(fingerprint(path))
+                stat = os.stat(path)
+            except (OSError, EOFError):
+                continue
+            # Unindexed or since-changed archives cannot be ruled out
+            if entry is None or not _current(entry, stat) or query.may_match(entry):
+                candidates.append(path)
+        if os.path.exists(log_path):
+            candidates.append(log_path)
+    results = {}
+    if candidates:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            for path, lines in pool.map(scan, candidates, [query] * len(candidates)):
+                results[path] = lines
+    return candidates, [line for path in candidates for line in results.get(path, [])]
+
+
+def _parse_time(value):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(time.strptime(value, fmt))
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError(f"unrecognised time {value!r}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index and search rotated log archives")
+    parser.add_argument("--index", default=INDEX_FILE)
+    commands = parser.add_subparsers(dest="command", required=True)
+    index_cmd = commands.add_parser("index", help="index newly rotated archives")
+    index_cmd.add_argument("logs", nargs="+")
+    query_cmd = commands.add_parser("query", help="search archives for matching lines")
+    query_cmd.add_argument("logs", nargs="+")
+    query_cmd.add_argument("--since", type=_parse_time)
+    query_cmd.add_argument("--until", type=_parse_time)
+    query_cmd.add_argument("--ip")
+    query_cmd.add_argument("--path")
+    query_cmd.add_argument("--status")
+    query_cmd.add_argument("--workers", type=int)
+    query_cmd.add_argument("--count", action="store_true", help="print only the number of matches")
+    args = parser.parse_args(argv)
+
+    index = ArchiveIndex(args.index)
+    if args.command == "index":
+        indexed = index.update(args.logs)
+        index.save()
+        print(f"indexed {indexed} new archive(s), {len(index.entries)} in index")
+        return 0
+
+    query = Query(args.since, args.until, args.ip, args.path, args.status)
+    candidates, lines = search(index, args.logs, query, args.workers)
+    if args.count:
+        print(len(lines))
+    else:
+        out = sys.stdout.buffer
+        for line in lines:
+            out.write(line + b"\n")
+    print(f"scanned {len(candidates)} file(s)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+BB IaC Pipeline - Incremental log tailer
+Reads only the bytes appended to a log since the last run, using a
+persisted (device, inode, offset) checkpoint per file, and follows
+logrotate renames (path -> path.1, or path.1.gz without delaycompress)
+so no lines are lost or counted twice across a rotation
+
+As a command it keeps today's authentication-failure and security-event
+counters for log-monitor.sh and prints them as shell assignments
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+STATE_FILE = "/var/lib/bb-iac-monitor/logtail.json"
+READ_SIZE = 1 << 20
+# Leading bytes kept with a checkpoint to notice a recycled inode
+HEAD_SIZE = 64
+
+
+class CheckpointStore:
+    """JSON file of {path: checkpoint} replaced atomically on save"""
+
+    def __init__(self, path):
+        self.path = path
+        self._saved = None
+        try:
+            with open(path) as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+    def save(self):
+        text = json.dumps(self.data)
+        if text == self._saved:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, self.path)
+        self._saved = text
+
+
+def _rotated_candidates(path):
+    return [path + ".1", path + ".1.gz"]
+
+
+def _same_file(stat, head, checkpoint):
+    """Same inode, and the bytes seen at the checkpoint are still its head"""
+    return ((stat.st_dev, stat.st_ino) == (checkpoint["dev"], checkpoint["inode"])
+            and head.startswith(checkpoint.get("head", "")))
+
+
+def _iter_lines(f, offset, position):
+    """Complete lines after offset; position[0] ends past the last newline"""
+    f.seek(offset)
+    position[0] = offset
+    pending = b""
+    while True:
+        chunk = f.read(READ_SIZE)
+        if not chunk:
+            return
+        chunk = pending + chunk
+        end = chunk.rfind(b"\n")
+        if end < 0:
+            pending = chunk
+            continue
+        pending = chunk[end + 1:]
+        position[0] += len(chunk) - len(pending)
+        yield from chunk[:end].split(b"\n")
+
+
+class LogTailer:
+    """New complete lines of one log file since its checkpoint"""
+
+    def __init__(self, path, store):
+        self.path = path
+        self.store = store
+        self.lost_rotations = 0
+
+    def _rotated_tail(self, checkpoint):
+        """Unread lines of the previous generation (path.1, or path.1.gz)"""
+        for candidate in _rotated_candidates(self.path):
+            try:
+                if candidate.endswith(".gz"):
+                    # Compressed right away (no delaycompress): no inode to match
+                    f = gzip.open(candidate, "rb")
+                    if not f.read(HEAD_SIZE).hex().startswith(checkpoint.get("head", "")):
+                        f.close()
+                        continue
+                else:
+                    f = open(candidate, "rb")
+                    stat = os.fstat(f.fileno())
+                    if not _same_file(stat, f.read(HEAD_SIZE).hex(), checkpoint):
+                        f.close()
+                        continue
+            except OSError:
+                continue
+            with f:
+                try:
+                    yield from _iter_lines(f, checkpoint["offset"], [0])
+                except (OSError, EOFError):
+                    pass
+            return
+        self.lost_rotations += 1
+
+    def lines(self):
+        """Yield new lines (bytes, no newline); the checkpoint moves once exhausted"""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            stat = os.fstat(f.fileno())
+            head = f.read(HEAD_SIZE).hex()
+            checkpoint = self.store.get(self.path)
+            offset = 0
+            if checkpoint is None:
+                pass
+            elif not _same_file(stat, head, checkpoint):
+                yield from self._rotated_tail(checkpoint)
+            elif stat.st_size >= checkpoint["offset"]:
+                offset = checkpoint["offset"]
+            # else: truncated in place (copytruncate), start over
+            position = [offset]
+            yield from _iter_lines(f, offset, position)
+            self.store.set(self.path, {
+                "dev": stat.st_dev, "inode": stat.st_ino, "offset": position[0], "head": head,
+            })
+
+
+def syslog_day_keys(now=None):
+    """Prefixes a syslog line written today can start with"""
+    now = time.localtime(now)
+    month_day = time.strftime("%b ", now) + f"{now.tm_mday:>2}"
+    # Classic "Oct  7" plus RFC 3339 timestamps used by newer rsyslog defaults
+    return (month_day, time.strftime("%b %d", now), time.strftime("%Y-%m-%d", now))
+
+
+def is_security_event(lowered):
+    return b"failed" in lowered or b"error" in lowered or b"denied" in lowered
+
+
+class DailyCounters:
+    """Today's auth.log counters, carried across runs in the checkpoint store"""
+
+    KEY = "counters:auth"
+
+    def __init__(self, store, now=None):
+        self.store = store
+        self.day_keys = syslog_day_keys(now)
+        day = self.day_keys[2]
+        saved = store.get(self.KEY) or {}
+        if saved.get("day") != day:
+            saved = {"day": day, "auth_failures": 0, "security_events": 0}
+        self.values = saved
+        self._prefixes = tuple(key.encode() for key in self.day_keys)
+
+    def update(self, lines):
+        for line in lines:
+            if not line.startswith(self._prefixes):
+                continue
+            if b"authentication failure" in line:
+                self.values["auth_failures"] += 1
+            if is_security_event(line.lower()):
+                self.values["security_events"] += 1
+        self.store.set(self.KEY, self.values)
+        return self.values
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count today's auth events from new log lines only")
+    parser.add_argument("log", nargs="?", default="/var/log/auth.log")
+    parser.add_argument("--state", default=STATE_FILE)
+    args = parser.parse_args(argv)
+
+    store = CheckpointStore(args.state)
+    counters = DailyCounters(store)
+    values = counters.update(LogTailer(args.log, store).lines())
+    store.save()
+    print(f"auth_failures={values['auth_failures']}")
+    print(f"security_events={values['security_events']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
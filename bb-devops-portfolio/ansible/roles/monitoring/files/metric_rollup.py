@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+BB IaC Pipeline - Local metric pre-aggregation for CloudWatch
+Samples the host (/proc) and nginx (new bb_timing access log lines) every
+few seconds, rolls each metric into a per-minute statistic set - or, for
+request latency, a value/count histogram - and publishes the finished
+minutes with batched PutMetricData calls
+
+One call carries every metric for several minutes, so the API volume no
+longer grows with the sampling rate while percentiles and min/max within
+each minute come from 5 s samples instead of one 60 s reading
+
+Usage:
+    metric_rollup.py [--interval 5] [--publish-every 60] [--namespace BB-IaC-Pipeline]
+"""
+
+import argparse
+import math
+import signal
+import socket
+import sys
+import time
+from datetime import datetime, timezone
+
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+
+from logtail import CheckpointStore, LogTailer
+from monitor_agent import NGINX_PIDFILE, HostProbe
+from nginx_log_stats import ACCESS_LOG, F_MSEC, F_REQUEST_TIME, F_STATUS
+
+NAMESPACE = "BB-IaC-Pipeline"
+STATE_FILE = "/var/lib/bb-iac-monitor/metric-rollup.json"
+# PutMetricData limits: datums per request, distinct values per histogram datum
+MAX_DATUMS = 1000
+MAX_VALUES = 150
+# Unpublished minutes kept while CloudWatch is unreachable
+MAX_PENDING_MINUTES = 120
+# 4xx codes worth retrying; any other 4xx rejects the batch itself
+RETRYABLE_CODES = {"Throttling", "ThrottlingException", "RequestLimitExceeded", "RequestTimeout",
+                   "RequestTimeoutException", "ServiceUnavailable", "InternalFailure"}
+# Histogram bucket growth (~5% relative error)
+GROWTH = 1.1
+_LOG_GROWTH = math.log(GROWTH)
+
+# /proc/net/tcp st column
+TCP_ESTABLISHED = "01"
+TCP_TIME_WAIT = "06"
+
+
+class StatisticSet:
+    """SampleCount/Sum/Minimum/Maximum of one metric within a minute"""
+
+    __slots__ = ("count", "sum", "min", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def as_datum(self):
+        return {"StatisticValues": {
+            "SampleCount": self.count, "Sum": self.sum, "Minimum": self.min, "Maximum": self.max,
+        }}
+
+
+class Histogram:
+    """Log-bucketed values of one metric within a minute, published as Values/Counts"""
+
+    __slots__ = ("buckets",)
+
+    def __init__(self):
+        self.buckets = {}
+
+    def add(self, value):
+        index = math.floor(math.log(value) / _LOG_GROWTH) if value > 0 else None
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def as_datums(self):
+        """Representative value of each bucket, split to respect MAX_VALUES"""
+        items = sorted(self.buckets.items(), key=lambda item: -math.inf if item[0] is None else item[0])
+        values = [(0.0 if index is None else round(GROWTH ** (index + 0.5), 6), count) for index, count in items]
+        return [
+            {"Values": [v for v, _ in chunk], "Counts": [c for _, c in chunk]}
+            for chunk in (values[i:i + MAX_VALUES] for i in range(0, len(values), MAX_VALUES))
+        ]
+
+
+class MinuteAggregator:
+    """{minute: {(name, unit): StatisticSet | Histogram}}"""
+
+    def __init__(self, dimensions):
+        self.dimensions = [{"Name": name, "Value": value} for name, value in dimensions.items()]
+        self.minutes = {}
+
+    def _series(self, stamp, name, unit, kind):
+        minute = int(stamp // 60) * 60
+        series = self.minutes.setdefault(minute, {})
+        key = (name, unit)
+        if key not in series:
+            series[key] = kind()
+        return series[key]
+
+    def add(self, name, value, unit, stamp):
+        self._series(stamp, name, unit, StatisticSet).add(value)
+
+    def observe(self, name, value, unit, stamp):
+        self._series(stamp, name, unit, Histogram).add(value)
+
+    def count(self, name, n, stamp):
+        """Add n events to a per-minute Count total"""
+        stats = self._series(stamp, name, "Count", StatisticSet)
+        stats.add(n)
+
+    def flush(self, now):
+        """MetricData entries for every minute that has ended"""
+        current = int(now // 60) * 60
+        datums = []
+        for minute in sorted(m for m in self.minutes if m < current):
+            stamp = datetime.fromtimestamp(minute, timezone.utc)
+            for (name, unit), series in sorted(self.minutes.pop(minute).items()):
+                parts = series.as_datums() if isinstance(series, Histogram) else [series.as_datum()]
+                for part in parts:
+                    part.update(MetricName=name, Unit=unit, Timestamp=stamp, Dimensions=self.dimensions)
+                    datums.append(part)
+        return datums
+
+
+def retryable(error):
+    """Whether a failed call may succeed unchanged later (throttling, 5xx, connection errors)"""
+    if not isinstance(error, ClientError):
+        return True
+    status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 500)
+    return status >= 500 or error.response.get("Error", {}).get("Code") in RETRYABLE_CODES
+
+
+class CloudWatchPublisher:
+    """Batches datums into as few PutMetricData calls as the limits allow"""
+
+    def __init__(self, cloudwatch, namespace=NAMESPACE, max_datums=MAX_DATUMS):
+        self.cloudwatch = cloudwatch
+        self.namespace = namespace
+        self.max_datums = max_datums
+        self.pending = []
+        self.calls = 0
+        self.dropped = 0
+
+    def publish(self, datums):
+        """Send pending plus new datums
+
+        A transient failure keeps them for the next attempt; a batch rejected
+        outright (InvalidParameterValue, ...) is dropped, so it cannot hold
+        back every later minute
+        """
+        self.pending.extend(datums)
+        sent = 0
+        while self.pending:
+            batch = self.pending[:self.max_datums]
+            try:
+                self.cloudwatch.put_metric_data(Namespace=self.namespace, MetricData=batch)
+            except (BotoCoreError, ClientError) as error:
+                if retryable(error):
+                    break
+                self.dropped += len(batch)
+                del self.pending[:len(batch)]
+                continue
+            self.calls += 1
+            sent += len(batch)
+            del self.pending[:len(batch)]
+        oldest = time.time() - MAX_PENDING_MINUTES * 60
+        self.pending = [d for d in self.pending if d["Timestamp"].timestamp() >= oldest]
+        return sent
+
+
+class MetricProbe(HostProbe):
+    """HostProbe plus CPU time split, swap and TCP connection states"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cpu = None
+
+    def cpu_pct(self):
+        """{user, system, iowait, idle} % since the previous call (None on the first)"""
+        fields = [int(v) for v in self._read("stat").splitlines()[0].split()[1:]]
+        # user nice system idle iowait irq softirq steal
+        user, nice, system, idle, iowait = fields[:5]
+        busy_other = sum(fields[5:8])
+        current = (user + nice, system + busy_other, iowait, idle)
+        previous, self._cpu = self._cpu, current
+        if previous is None:
+            return None
+        deltas = [c - p for c, p in zip(current, previous)]
+        total = sum(deltas)
+        if total <= 0:
+            return None
+        return dict(zip(("user", "system", "iowait", "idle"), (d * 100 / total for d in deltas)))
+
+    def swap_pct(self):
+        meminfo = {}
+        for line in self._read("meminfo").splitlines():
+            name, _, rest = line.partition(":")
+            meminfo[name] = int(rest.split()[0])
+        total = meminfo.get("SwapTotal", 0)
+        return (total - meminfo.get("SwapFree", 0)) * 100 / total if total else 0.0
+
+    def tcp_states(self):
+        established = time_wait = 0
+        for name in ("net/tcp", "net/tcp6"):
+            try:
+                lines = self._read(name).splitlines()[1:]
+            except OSError:
+                continue
+            for line in lines:
+                state = line.split(None, 4)[3]
+                if state == TCP_ESTABLISHED:
+                    established += 1
+                elif state == TCP_TIME_WAIT:
+                    time_wait += 1
+        return established, time_wait
+
+
+class MetricRollup:
+    """Sampling loop feeding the per-minute aggregator"""
+
+    def __init__(self, probe, aggregator, publisher, access_log=ACCESS_LOG, state_file=STATE_FILE, clock=time.time):
+        self.probe = probe
+        self.aggregator = aggregator
+        self.publisher = publisher
+        self.access_log = access_log
+        self.store = CheckpointStore(state_file)
+        self.clock = clock
+
+    def sample_host(self, now):
+        add = self.aggregator.add
+        cpu = self.probe.cpu_pct()
+        if cpu:
+            for name, value in cpu.items():
+                add(f"cpu_usage_{name}", value, "Percent", now)
+        add("mem_used_percent", self.probe.memory_pct(), "Percent", now)
+        add("disk_used_percent", self.probe.disk_pct(), "Percent", now)
+        add("swap_used_percent", self.probe.swap_pct(), "Percent", now)
+        add("load_1m", float(self.probe.load()), "None", now)
+        established, time_wait = self.probe.tcp_states()
+        add("tcp_established", established, "Count", now)
+        add("tcp_time_wait", time_wait, "Count", now)
+        add("nginx_running", 1.0 if self.probe.nginx_running() else 0.0, "None", now)
+
+    def sample_nginx(self, now):
+        """Requests, 5xx and latency from access log lines written since the last sample"""
+        requests = {}
+        errors = {}
+        for line in LogTailer(self.access_log, self.store).lines():
+            fields = line.split(b"\t", 9)
+            try:
+                stamp = float(fields[F_MSEC])
+                status = int(fields[F_STATUS])
+                latency = float(fields[F_REQUEST_TIME])
+            except (IndexError, ValueError):
+                continue
+            minute = int(stamp // 60) * 60
+            requests[minute] = requests.get(minute, 0) + 1
+            if status >= 500:
+                errors[minute] = errors.get(minute, 0) + 1
+            self.aggregator.observe("nginx_request_time", latency, "Seconds", stamp)
+        self.store.save()
+        # Minutes with no traffic still publish a zero rather than a gap
+        requests.setdefault(int(now // 60) * 60, 0)
+        for minute, n in requests.items():
+            self.aggregator.count("nginx_requests", n, minute)
+            self.aggregator.count("nginx_5xx", errors.get(minute, 0), minute)
+
+    def tick(self):
+        now = self.clock()
+        self.sample_host(now)
+        self.sample_nginx(now)
+
+    def publish(self):
+        return self.publisher.publish(self.aggregator.flush(self.clock()))
+
+    def run(self, interval, publish_every):
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+        next_publish = time.monotonic() + publish_every
+        while not stopping:
+            started = time.monotonic()
+            self.tick()
+            if started >= next_publish:
+                self.publish()
+                next_publish = started + publish_every
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+        self.publish()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-aggregate host and nginx metrics for CloudWatch")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between samples")
+    parser.add_argument("--publish-every", type=float, default=60.0, help="seconds between PutMetricData batches")
+    parser.add_argument("--namespace", default=NAMESPACE)
+    parser.add_argument("--host", default=socket.gethostname().split(".")[0])
+    parser.add_argument("--region", help="CloudWatch region (default: AWS_DEFAULT_REGION)")
+    parser.add_argument("--access-log", default=ACCESS_LOG)
+    parser.add_argument("--state", default=STATE_FILE)
+    parser.add_argument("--nginx-pidfile", default=NGINX_PIDFILE)
+    args = parser.parse_args(argv)
+
+    rollup = MetricRollup(
+        MetricProbe(nginx_pidfile=args.nginx_pidfile),
+        MinuteAggregator({"host": args.host}),
+        CloudWatchPublisher(boto3.client("cloudwatch", region_name=args.region), args.namespace),
+        access_log=args.access_log,
+        state_file=args.state,
+    )
+    rollup.run(args.interval, args.publish_every)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+BB IaC Pipeline - Resident host monitoring agent
+Samples load, memory, disk and nginx liveness straight from /proc,
+statvfs and the nginx pidfile every few seconds without forking, and
+writes the same ALERT/INFO/HEALTH lines as log-monitor.sh to
+/var/log/bb-iac-monitor.log
+
+Alerts fire as soon as a sample crosses a threshold (so short spikes are
+seen) and are repeated on every report tick while the condition lasts,
+which is when the HEALTH summary is written
+
+auth.log is read once per tick and feeds both today's counters and the
+sliding-window detector; sources over a window limit are written to the
+ban log watched by fail2ban
+
+With --snapshot, every tick also replaces a small JSON file under the web
+root that monitoring.html polls, so dashboards cost nginx a static file
+(usually a 304) instead of a full page reload
+"""
+
+import argparse
+import json
+import math
+import os
+import signal
+import socket
+import sys
+import time
+
+from auth_detector import BAN_LOG, MAX_SOURCES, AuthFailureDetector, parse_limits
+from logtail import STATE_FILE, CheckpointStore, DailyCounters, LogTailer
+
+LOG_FILE = "/var/log/bb-iac-monitor.log"
+AUTH_LOG = "/var/log/auth.log"
+NGINX_PIDFILE = "/run/nginx.pid"
+# Per-source burst alerts written per tick, worst first
+MAX_SOURCE_ALERTS = 5
+
+
+class Thresholds:
+    """Alert limits, matching log-monitor.sh"""
+
+    def __init__(self, auth_failures=10, disk_pct=80, memory_pct=85, load=2.0, security_events=5):
+        self.auth_failures = auth_failures
+        self.disk_pct = disk_pct
+        self.memory_pct = memory_pct
+        self.load = load
+        self.security_events = security_events
+
+
+class Sample:
+    """One reading of the host"""
+
+    def __init__(self, load, memory_pct, disk_pct, nginx_running):
+        self.load = load
+        self.memory_pct = memory_pct
+        self.disk_pct = disk_pct
+        self.nginx_running = nginx_running
+
+
+class HostProbe:
+    """Reads host state from /proc, statvfs and the nginx pidfile"""
+
+    def __init__(self, proc_root="/proc", disk_path="/", nginx_pidfile=NGINX_PIDFILE, statvfs=os.statvfs):
+        self.proc_root = proc_root
+        self.disk_path = disk_path
+        self.nginx_pidfile = nginx_pidfile
+        self.statvfs = statvfs
+
+    def _read(self, name):
+        with open(os.path.join(self.proc_root, name)) as f:
+            return f.read()
+
+    def uptime(self):
+        """Seconds since boot, or None when /proc/uptime is unavailable"""
+        try:
+            return int(float(self._read("uptime").split()[0]))
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def load(self):
+        """1-minute load average as printed by uptime"""
+        return self._read("loadavg").split()[0]
+
+    def memory_pct(self):
+        """Used memory percentage as reported by free (total - available)"""
+        meminfo = {}
+        for line in self._read("meminfo").splitlines():
+            name, _, rest = line.partition(":")
+            meminfo[name] = int(rest.split()[0])
+        total = meminfo["MemTotal"]
+        available = meminfo.get("MemAvailable")
+        if available is None:
+            available = meminfo["MemFree"] + meminfo.get("Buffers", 0) + meminfo.get("Cached", 0)
+        return round((total - available) * 100 / total)
+
+    def disk_pct(self):
+        """Use% of the filesystem as df computes it (rounded up)"""
+        st = self.statvfs(self.disk_path)
+        used = st.f_blocks - st.f_bfree
+        usable = used + st.f_bavail
+        return math.ceil(used * 100 / usable) if usable else 0
+
+    def nginx_running(self):
+        """nginx master from the pidfile is alive"""
+        try:
+            with open(self.nginx_pidfile) as f:
+                pid = int(f.read().strip())
+            with open(os.path.join(self.proc_root, str(pid), "comm")) as f:
+                return f.read().startswith("nginx")
+        except (OSError, ValueError):
+            return False
+
+    def sample(self):
+        return Sample(self.load(), self.memory_pct(), self.disk_pct(), self.nginx_running())
+
+
+def write_atomic(path, text):
+    """Replace path with text so readers (nginx) never see a partial file"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    tmp = os.path.join(directory, f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, path)
+
+
+def _alerts(sample, thresholds, recent_failures, offenders):
+    """{condition: message} for every breached threshold"""
+    alerts = {}
+    if recent_failures > thresholds.auth_failures:
+        alerts["auth"] = f"ALERT: High number of authentication failures detected: {recent_failures} in the last hour"
+    for source, window, count in offenders[:MAX_SOURCE_ALERTS]:
+        alerts[f"auth:{source}"] = f"ALERT: Authentication failure burst from {source}: {count} in {window}"
+    if sample.disk_pct > thresholds.disk_pct:
+        alerts["disk"] = f"ALERT: Disk usage is above {thresholds.disk_pct}%: {sample.disk_pct}%"
+    if sample.memory_pct > thresholds.memory_pct:
+        alerts["memory"] = f"ALERT: Memory usage is above {thresholds.memory_pct}%: {sample.memory_pct}%"
+    if float(sample.load) > thresholds.load:
+        alerts["load"] = f"ALERT: High load average detected: {sample.load}"
+    if not sample.nginx_running:
+        alerts["nginx"] = "ALERT: Nginx service is not running"
+    return alerts
+
+
+class MonitorAgent:
+    """Sampling loop that keeps the log-monitor.sh output format"""
+
+    def __init__(self, probe, thresholds=None, log_file=LOG_FILE, auth_log=AUTH_LOG,
+                 state_file=STATE_FILE, clock=time.time, detector=None, ban_log=BAN_LOG, snapshot=None):
+        self.probe = probe
+        self.thresholds = thresholds or Thresholds()
+        self.log_file = log_file
+        self.auth_log = auth_log
+        self.store = CheckpointStore(state_file)
+        self.clock = clock
+        self.detector = detector or AuthFailureDetector()
+        self.ban_log = ban_log
+        self.snapshot = snapshot
+        self.host = socket.gethostname()
+        self.active = {}
+
+    def _write(self, *messages, path=None):
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.clock()))
+        # Reopened per write so logrotate's `create` needs no signal
+        with open(path or self.log_file, "a") as f:
+            for message in messages:
+                f.write(f"[{stamp}] {message}\n")
+
+    def _auth_counters(self, now):
+        counters = DailyCounters(self.store, now)
+        values = counters.update(self.detector.feed(LogTailer(self.auth_log, self.store).lines(), now))
+        self.store.save()
+        if self.detector.breaches:
+            # fail2ban's bb-auth-detector jail bans on each of these lines
+            self._write(*(f"BAN {source} failures={count} window={window}"
+                          for source, window, count in self.detector.breaches), path=self.ban_log)
+            self.detector.breaches.clear()
+        return values
+
+    def tick(self, report=False):
+        """Take one sample; write new alerts, or everything on a report tick"""
+        sample = self.probe.sample()
+        now = self.clock()
+        auth = self._auth_counters(now)
+        alerts = _alerts(sample, self.thresholds, self.detector.totals(now)["1h"], self.detector.offenders(now))
+        if report:
+            lines = list(alerts.values())
+            if auth["security_events"] > self.thresholds.security_events:
+                lines.append(f"INFO: Security events detected today: {auth['security_events']}")
+            lines.append(f"HEALTH: CPU Load: {sample.load}, Memory: {sample.memory_pct}%, Disk: {sample.disk_pct}%")
+        else:
+            lines = [message for key, message in alerts.items() if key not in self.active]
+        if lines:
+            self._write(*lines)
+        self.active = alerts
+        if self.snapshot:
+            write_atomic(self.snapshot, json.dumps(self.dashboard(sample, alerts, now), sort_keys=True))
+        return sample
+
+    def dashboard(self, sample, alerts, now):
+        """Snapshot rendered by monitoring.html"""
+        if not sample.nginx_running:
+            status = "critical"
+        elif alerts:
+            status = "warning"
+        else:
+            status = "healthy"
+        totals = self.detector.totals(now)
+        return {
+            "generated": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now)),
+            "host": self.host,
+            "status": status,
+            "uptime_seconds": self.probe.uptime(),
+            "load": sample.load,
+            "memory_pct": sample.memory_pct,
+            "disk_pct": sample.disk_pct,
+            "services": {"nginx": sample.nginx_running},
+            "auth": {
+                "failures_1m": totals["1m"],
+                "failures_5m": totals["5m"],
+                "failures_1h": totals["1h"],
+                "sources_tracked": len(self.detector.sources),
+                "sources_flagged": len(self.detector.flagged),
+            },
+            "alerts": sorted(alerts.values()),
+        }
+
+    def run(self, interval, report_interval):
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+        next_report = time.monotonic()
+        while not stopping:
+            now = time.monotonic()
+            report = now >= next_report
+            if report:
+                next_report = now + report_interval
+            self.tick(report)
+            time.sleep(max(0.0, interval - (time.monotonic() - now)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resident host monitoring agent")
+    parser.add_argument("--interval", type=float, default=10.0, help="seconds between samples")
+    parser.add_argument("--report-interval", type=float, default=300.0, help="seconds between HEALTH lines")
+    parser.add_argument("--log-file", default=LOG_FILE)
+    parser.add_argument("--auth-log", default=AUTH_LOG)
+    parser.add_argument("--state", default=STATE_FILE)
+    parser.add_argument("--nginx-pidfile", default=NGINX_PIDFILE)
+    parser.add_argument("--auth-threshold", type=int, default=10)
+    parser.add_argument("--disk-threshold", type=int, default=80)
+    parser.add_argument("--memory-threshold", type=int, default=85)
+    parser.add_argument("--load-threshold", type=float, default=2.0)
+    parser.add_argument("--auth-limits", type=parse_limits, default=None,
+                        help="per-source failure limits, e.g. 1m=5,5m=10,1h=30")
+    parser.add_argument("--max-sources", type=int, default=MAX_SOURCES)
+    parser.add_argument("--ban-log", default=BAN_LOG)
+    parser.add_argument("--snapshot", help="JSON file for the monitoring dashboard, rewritten every tick")
+    args = parser.parse_args(argv)
+
+    agent = MonitorAgent(
+        HostProbe(nginx_pidfile=args.nginx_pidfile),
+        Thresholds(args.auth_threshold, args.disk_threshold, args.memory_threshold, args.load_threshold),
+        log_file=args.log_file,
+        auth_log=args.auth_log,
+        state_file=args.state,
+        detector=AuthFailureDetector(args.auth_limits, args.max_sources),
+        ban_log=args.ban_log,
+        snapshot=args.snapshot,
+    )
+    agent.run(args.interval, args.report_interval)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+BB IaC Pipeline - nginx access log analytics
+Streams access logs written in the bb_timing format (see default.conf.j2)
+through mmap and reports per-route request rate, status distribution and
+latency percentiles in constant memory
+
+bb_timing fields, tab separated:
+    msec remote_addr method uri status body_bytes_sent bytes_sent
+    request_time upstream_response_time "user_agent"
+
+Usage:
+    nginx_log_stats.py [--since SECONDS] [--json] /var/log/nginx/access.log
+"""
+
+import argparse
+import json
+import math
+import mmap
+import os
+import sys
+import time
+
+ACCESS_LOG = "/var/log/nginx/access.log"
+MAX_ROUTES = 200
+OTHER_ROUTE = "<other>"
+
+F_MSEC, F_ADDR, F_METHOD, F_URI, F_STATUS, F_BODY_BYTES, F_BYTES, F_REQUEST_TIME, F_UPSTREAM_TIME = range(9)
+
+
+class LatencyHistogram:
+    """Log-bucketed latency histogram (~1% relative error, constant memory)"""
+
+    GROWTH = 1.02
+    _LOG_GROWTH = math.log(GROWTH)
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        micros = max(seconds * 1e6, 1.0)
+        index = int(math.log(micros) / self._LOG_GROWTH)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, pct):
+        """Latency in seconds at the given percentile (0-100)"""
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * pct / 100.0)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                # Upper edge of the bucket, capped by the exact maximum
+                return min(self.GROWTH ** (index + 1) / 1e6, self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class RouteStats:
+    """Counters for one route"""
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes_sent = 0
+        self.statuses = {}
+        self.latency = LatencyHistogram()
+        self.upstream = LatencyHistogram()
+
+    def as_dict(self, elapsed):
+        server_errors = sum(n for status, n in self.statuses.items() if status >= 500)
+        return {
+            "requests": self.requests,
+            "rate_rps": round(self.requests / elapsed, 3) if elapsed else 0.0,
+            "bytes_sent": self.bytes_sent,
+            "statuses": {str(s): n for s, n in sorted(self.statuses.items())},
+            "error_rate_5xx": round(server_errors / self.requests, 6) if self.requests else 0.0,
+            "latency_ms": {
+                "p50": round(self.latency.percentile(50) * 1000, 3),
+                "p90": round(self.latency.percentile(90) * 1000, 3),
+                "p99": round(self.latency.percentile(99) * 1000, 3),
+                "max": round(self.latency.max * 1000, 3),
+            },
+            "upstream_p99_ms": round(self.upstream.percentile(99) * 1000, 3) if self.upstream.count else None,
+        }
+
+
+def _seek_time(mm, since):
+    """Offset of the first line with msec >= since (lines are time ordered)"""
+    low, high = 0, len(mm)
+    while low < high:
+        mid = (low + high) // 2
+        start = mm.rfind(b"\n", 0, mid) + 1
+        end = mm.find(b"\t", start)
+        try:
+            stamp = float(mm[start:end]) if end > 0 else 0.0
+        except ValueError:
+            stamp = 0.0
+        if stamp < since:
+            next_line = mm.find(b"\n", mid)
+            if next_line < 0:
+                return len(mm)
+            low = next_line + 1
+        else:
+            high = start
+    return low
+
+
+class AccessLogStats:
+    """Aggregates bb_timing lines into per-route statistics"""
+
+    def __init__(self, max_routes=MAX_ROUTES):
+        self.max_routes = max_routes
+        self.routes = {}
+        self.total = RouteStats()
+        self.first = None
+        self.last = None
+        self.malformed = 0
+
+    def _route(self, uri):
+        stats = self.routes.get(uri)
+        if stats is None:
+            # Cap distinct routes so scanners cannot grow memory without bound
+            if len(self.routes) >= self.max_routes:
+                uri = OTHER_ROUTE
+                stats = self.routes.get(uri)
+            if stats is None:
+                stats = self.routes[uri] = RouteStats()
+        return stats
+
+    def add_line(self, line, since=0.0, until=None):
+        fields = line.split(b"\t", 9)
+        try:
+            stamp = float(fields[F_MSEC])
+            status = int(fields[F_STATUS])
+            request_time = float(fields[F_REQUEST_TIME])
+            sent = int(fields[F_BYTES])
+        except (IndexError, ValueError):
+            self.malformed += 1
+            return
+        if stamp < since or (until is not None and stamp >= until):
+            return
+        if self.first is None or stamp < self.first:
+            self.first = stamp
+        if self.last is None or stamp > self.last:
+            self.last = stamp
+        upstream = fields[F_UPSTREAM_TIME]
+        for stats in (self.total, self._route(fields[F_URI].decode("utf-8", "replace"))):
+            stats.requests += 1
+            stats.bytes_sent += sent
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            stats.latency.record(request_time)
+            if upstream != b"-":
+                try:
+                    # "0.010, 0.004" when several upstreams were tried
+                    stats.upstream.record(sum(float(t) for t in upstream.split(b",")))
+                except ValueError:
+                    pass
+
+    def add_file(self, path, since=0.0, until=None):
+        """Scan one log file; only the part after `since` is read"""
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                start = _seek_time(mm, since) if since else 0
+                while start < len(mm):
+                    end = mm.find(b"\n", start)
+                    if end < 0:
+                        # Line still being written
+                        break
+                    self.add_line(mm[start:end], since, until)
+                    start = end + 1
+
+    @property
+    def elapsed(self):
+        if self.first is None:
+            return 0.0
+        return max(self.last - self.first, 1.0)
+
+    def as_dict(self, window=None):
+        elapsed = window or self.elapsed
+        return {
+            "window_seconds": round(elapsed, 3),
+            "total": self.total.as_dict(elapsed),
+            "routes": {
+                route: stats.as_dict(elapsed)
+                for route, stats in sorted(self.routes.items(), key=lambda item: -item[1].requests)
+            },
+            "malformed_lines": self.malformed,
+        }
+
+    def summary_lines(self, window=None, limit=20):
+        data = self.as_dict(window)
+        total = data["total"]
+        lines = [
+            f"{total['requests']} requests in {data['window_seconds']:.0f}s "
+            f"({total['rate_rps']} rps), 5xx {total['error_rate_5xx']:.2%}, "
+            f"p50 {total['latency_ms']['p50']}ms p99 {total['latency_ms']['p99']}ms"
+        ]
+        for route, stats in list(data["routes"].items())[:limit]:
+            lines.append(
+                f"  {route:<40} {stats['requests']:>8} {stats['rate_rps']:>8} rps "
+                f"5xx {stats['error_rate_5xx']:.2%} p99 {stats['latency_ms']['p99']}ms"
+            )
+        return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-route rate, status and latency from nginx access logs")
+    parser.add_argument("logs", nargs="*", default=[ACCESS_LOG])
+    parser.add_argument("--since", type=float, help="only the last SECONDS (e.g. 600 for 10 minutes)")
+    parser.add_argument("--max-routes", type=int, default=MAX_ROUTES)
+    parser.add_argument("--json", action="store_true", help="print JSON instead of a table")
+    args = parser.parse_args(argv)
+
+    stats = AccessLogStats(args.max_routes)
+    since = time.time() - args.since if args.since else 0.0
+    for path in args.logs:
+        stats.add_file(path, since)
+    window = args.since
+    if args.json:
+        json.dump(stats.as_dict(window), sys.stdout, indent=2)
+        print()
+    else:
+        for line in stats.summary_lines(window):
+            print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+BB IaC Pipeline - Rotated log archival to the config S3 bucket
+Uploads every compressed rotated generation (access.log.2.gz, ...) of the
+given logs to s3://<bucket>/logs/<source>/dt=YYYY-MM-DD/hour=HH/, with the
+hour taken from the first timestamped line (UTC), else the file mtime
+
+Large archives go up as multipart uploads whose parts share one bounded
+thread pool with the small single-request uploads. Upload ids and finished
+parts are checkpointed after every part, so an interrupted run resumes
+where it stopped. Object keys embed the content hash: an archive renamed
+by logrotate, or shipped twice, is never uploaded again
+
+Usage:
+    s3_log_archive.py --bucket bb-iac-config-... /var/log/nginx/access.log /var/log/auth.log
+"""
+
+import argparse
+import gzip
+import hashlib
+import os
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+
+from log_archive import archives, parse_line
+from logtail import CheckpointStore
+
+STATE_FILE = "/var/lib/bb-iac-monitor/s3-archive.json"
+# S3 rejects non-final multipart parts smaller than 5 MiB
+MIN_PART_SIZE = 5 * 1024 * 1024
+PART_SIZE = 8 * 1024 * 1024
+WORKERS = 4
+# Lines read looking for the first timestamp of an archive
+STAMP_LINES = 50
+HASH_READ = 1 << 20
+
+
+def source_name(log_path):
+    """/var/log/nginx/access.log -> nginx-access, /var/log/auth.log -> auth"""
+    name = os.path.basename(log_path)
+    if name.endswith(".log"):
+        name = name[:-4]
+    parent = os.path.basename(os.path.dirname(log_path))
+    return name if parent in ("log", "") else f"{parent}-{name}"
+
+
+def archive_time(path):
+    """Epoch seconds of the first timestamped line, else the file mtime"""
+    try:
+        with gzip.open(path, "rb") as f:
+            for _, line in zip(range(STAMP_LINES), f):
+                stamp, _ = parse_line(line.rstrip(b"\n"))
+                if stamp is not None:
+                    return stamp
+    except (OSError, EOFError):
+        pass
+    return os.stat(path).st_mtime
+
+
+def object_key(source, stamp, host, log_path, digest, prefix="logs"):
+    moment = time.gmtime(stamp)
+    name = os.path.basename(log_path)
+    return (f"{prefix}/{source}/dt={time.strftime('%Y-%m-%d', moment)}/hour={moment.tm_hour:02d}/"
+            f"{host}-{name}-{digest[:16]}.gz")
+
+
+class Archive:
+    """One rotated generation waiting to be shipped"""
+
+    __slots__ = ("path", "size", "digest", "key")
+
+    def __init__(self, path, size, digest, key):
+        self.path = path
+        self.size = size
+        self.digest = digest
+        self.key = key
+
+
+class S3LogArchiver:
+    """Ships rotated archives with checkpointed multipart uploads"""
+
+    def __init__(self, s3, bucket, store, host=None, part_size=PART_SIZE, workers=WORKERS, prefix="logs"):
+        if part_size < MIN_PART_SIZE:
+            raise ValueError(f"part size must be at least {MIN_PART_SIZE} bytes")
+        self.s3 = s3
+        self.bucket = bucket
+        self.store = store
+        self.host = host or socket.gethostname().split(".")[0]
+        self.part_size = part_size
+        self.workers = workers
+        self.prefix = prefix
+
+    def _digest(self, path, stat, seen):
+        """sha256 of a file, cached per (device, inode) so renames are free"""
+        cache_key = f"s3:hash:{stat.st_dev}:{stat.st_ino}"
+        seen.add(cache_key)
+        cached = self.store.get(cache_key)
+        if cached and (cached["size"], cached["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+            return cached["sha256"]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_READ), b""):
+                digest.update(block)
+        self.store.set(cache_key, {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest.hexdigest()})
+        return digest.hexdigest()
+
+    def pending(self, log_paths):
+        """Compressed archives of log_paths not shipped yet"""
+        found = {}
+        seen = set()
+        for log_path in log_paths:
+            source = source_name(log_path)
+            for path in archives(log_path):
+                if not path.endswith(".gz"):
+                    # path.1 is compressed on the next rotation (delaycompress)
+                    continue
+                try:
+                    stat = os.stat(path)
+                    digest = self._digest(path, stat, seen)
+                except OSError:
+                    continue
+                seen.add(f"s3:done:{digest}")
+                if digest in found or self.store.get(f"s3:done:{digest}"):
+                    continue
+                key = object_key(source, archive_time(path), self.host, log_path, digest, self.prefix)
+                found[digest] = Archive(path, stat.st_size, digest, key)
+        # Hash cache and shipped markers of archives logrotate has since deleted
+        for stale in [k for k in self.store.data if k.startswith(("s3:hash:", "s3:done:")) and k not in seen]:
+            del self.store.data[stale]
+        return list(found.values())
+
+    def _already_stored(self, archive):
+        """The object exists with our content hash (state lost, or another run)"""
+        try:
+            head = self.s3.head_object(Bucket=self.bucket, Key=archive.key)
+        except ClientError:
+            return False
+        return head.get("Metadata", {}).get("sha256") == archive.digest
+
+    def _put(self, archive):
+        with open(archive.path, "rb") as f:
+            self.s3.put_object(
+                Bucket=self.bucket, Key=archive.key, Body=f,
+                ContentType="application/gzip", Metadata={"sha256": archive.digest},
+            )
+
+    def _upload_part(self, archive, upload_id, number):
+        with open(archive.path, "rb") as f:
+            f.seek((number - 1) * self.part_size)
+            body = f.read(self.part_size)
+        response = self.s3.upload_part(
+            Bucket=self.bucket, Key=archive.key, UploadId=upload_id, PartNumber=number, Body=body,
+        )
+        return response["ETag"]
+
+    def _multipart(self, archive):
+        """Upload state for an archive, resuming a checkpointed upload when S3 still has it"""
+        state = self.store.get(f"s3:upload:{archive.digest}")
+        if state and state["key"] == archive.key:
+            try:
+                parts = {}
+                pages = self.s3.get_paginator("list_parts").paginate(
+                    Bucket=self.bucket, Key=archive.key, UploadId=state["upload_id"])
+                for page in pages:
+                    for part in page.get("Parts", []):
+                        parts[str(part["PartNumber"])] = part["ETag"]
+                state["parts"] = parts
+                state["resumed"] = True
+                return state
+            except ClientError:
+                # Aborted or expired upload: start again
+                pass
+        upload = self.s3.create_multipart_upload(
+            Bucket=self.bucket, Key=archive.key,
+            ContentType="application/gzip", Metadata={"sha256": archive.digest},
+        )
+        state = {"key": archive.key, "upload_id": upload["UploadId"], "parts": {}}
+        self.store.set(f"s3:upload:{archive.digest}", state)
+        self.store.save()
+        return state
+
+    def _complete(self, archive, state):
+        self.s3.complete_multipart_upload(
+            Bucket=self.bucket, Key=archive.key, UploadId=state["upload_id"],
+            MultipartUpload={"Parts": [
+                {"PartNumber": int(n), "ETag": etag}
+                for n, etag in sorted(state["parts"].items(), key=lambda item: int(item[0]))
+            ]},
+        )
+
+    def _done(self, archive, counts, outcome):
+        self.store.set(f"s3:done:{archive.digest}", archive.key)
+        self.store.data.pop(f"s3:upload:{archive.digest}", None)
+        counts[outcome] += 1
+
+    def run(self, log_paths):
+        """Ship every pending archive; returns counts by outcome"""
+        counts = {"uploaded": 0, "deduplicated": 0, "resumed": 0, "failed": 0, "bytes": 0}
+        jobs = {}
+        uploads = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for archive in self.pending(log_paths):
+                try:
+                    if self._already_stored(archive):
+                        self._done(archive, counts, "deduplicated")
+                        continue
+                    if archive.size <= self.part_size:
+                        jobs[pool.submit(self._put, archive)] = (archive, None)
+                        continue
+                    state = self._multipart(archive)
+                except (BotoCoreError, ClientError, OSError):
+                    counts["failed"] += 1
+                    continue
+                if state.pop("resumed", False):
+                    counts["resumed"] += 1
+                total = -(-archive.size // self.part_size)
+                uploads[archive.digest] = [archive, state, total]
+                for number in range(1, total + 1):
+                    if str(number) not in state["parts"]:
+                        jobs[pool.submit(self._upload_part, archive, state["upload_id"], number)] = (archive, number)
+                if len(state["parts"]) == total:
+                    jobs[pool.submit(self._complete, archive, state)] = (archive, 0)
+
+            failed = set()
+            for future in as_completed(jobs):
+                archive, number = jobs[future]
+                try:
+                    result = future.result()
+                except (BotoCoreError, ClientError, OSError):
+                    if archive.digest not in failed:
+                        failed.add(archive.digest)
+                        counts["failed"] += 1
+                    continue
+                if number is None:
+                    counts["bytes"] += archive.size
+                if not number:
+                    # Single-request upload, or completion of an upload whose parts were all there
+                    self._done(archive, counts, "uploaded")
+                    self.store.save()
+                    continue
+                _, state, total = uploads[archive.digest]
+                state["parts"][str(number)] = result
+                counts["bytes"] += min(self.part_size, archive.size - (number - 1) * self.part_size)
+                # Checkpoint after every part so a crash loses at most the parts in flight
+                self.store.save()
+                if len(state["parts"]) == total and archive.digest not in failed:
+                    try:
+                        self._complete(archive, state)
+                    except (BotoCoreError, ClientError):
+                        failed.add(archive.digest)
+                        counts["failed"] += 1
+                        continue
+                    self._done(archive, counts, "uploaded")
+                    self.store.save()
+        self.store.save()
+        return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Upload rotated log archives to S3")
+    parser.add_argument("logs", nargs="+")
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--state", default=STATE_FILE)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--part-size-mb", type=int, default=PART_SIZE // (1024 * 1024))
+    parser.add_argument("--host", help="host name used in object keys")
+    args = parser.parse_args(argv)
+
+    archiver = S3LogArchiver(
+        boto3.client("s3"), args.bucket, CheckpointStore(args.state), host=args.host,
+        part_size=args.part_size_mb * 1024 * 1024, workers=args.workers,
+    )
+    counts = archiver.run(args.logs)
+    print(" ".join(f"{name}={value}" for name, value in counts.items()))
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
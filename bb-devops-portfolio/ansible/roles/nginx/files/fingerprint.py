@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+BB IaC Pipeline - Content-hashed static asset publishing
+Copies a role's asset sources into the web root as <name>.<hash>.<ext> and
+prints {"name.ext": "/assets/name.<hash>.ext"} for the templates that
+reference them, so a changed file always gets a new URL and every URL can
+be cached as immutable for a year
+
+Each role publishes its own bundle; the manifest (kept outside the web root)
+records the last generations of every bundle. Files no kept generation
+references are deleted, so pages still cached from the previous release
+keep resolving their assets while older generations are collected
+
+--dry-run prints the same URLs without writing anything (ansible --check)
+
+Usage:
+    fingerprint.py --bundle nginx --manifest /usr/local/lib/bb-iac-nginx/assets.json SRC_DIR /var/www/html/assets
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+MANIFEST = "/usr/local/lib/bb-iac-nginx/assets.json"
+URL_PREFIX = "/assets"
+# Generations kept per bundle: the current release and the one before it
+KEEP = 2
+HASH_LENGTH = 12
+
+
+def hashed_name(name, data):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}"
+
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"bundles": {}}
+
+
+def _write(path, data, mode):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.chmod(tmp, mode)
+    os.replace(tmp, path)
+
+
+def sources(source_dir):
+    """[(source name, hashed name, bytes)] of a bundle, in name order"""
+    found = []
+    for name in sorted(os.listdir(source_dir)):
+        path = os.path.join(source_dir, name)
+        if not os.path.isfile(path):
+            continue
+        with open(path, "rb") as f:
+            data = f.read()
+        found.append((name, hashed_name(name, data), data))
+    return found
+
+
+def urls_for(source_dir, url_prefix=URL_PREFIX):
+    """{source name: URL} a publish would return, without writing anything"""
+    return {name: f"{url_prefix.rstrip('/')}/{target}" for name, target, _ in sources(source_dir)}
+
+
+def publish(source_dir, assets_dir, bundle, manifest_path=MANIFEST, keep=KEEP, url_prefix=URL_PREFIX):
+    """Publish a bundle's sources; returns {source name: URL}"""
+    os.makedirs(assets_dir, exist_ok=True)
+    urls = {}
+    files = []
+    for name, target, data in sources(source_dir):
+        if not os.path.exists(os.path.join(assets_dir, target)):
+            # Content-addressed: an existing file already holds these bytes
+            _write(os.path.join(assets_dir, target), data, 0o644)
+        urls[name] = f"{url_prefix.rstrip('/')}/{target}"
+        files.append(target)
+
+    manifest = load_manifest(manifest_path)
+    generations = manifest["bundles"].setdefault(bundle, [])
+    if not generations or generations[0] != files:
+        generations.insert(0, files)
+    del generations[keep:]
+    collect(assets_dir, manifest)
+    manifest_dir = os.path.dirname(manifest_path) or "."
+    os.makedirs(manifest_dir, exist_ok=True)
+    _write(manifest_path, json.dumps(manifest, indent=2, sort_keys=True).encode(), 0o644)
+    return urls
+
+
+def collect(assets_dir, manifest):
+    """Delete published files (and their .gz/.br variants) no kept generation references"""
+    live = {name for generations in manifest["bundles"].values() for files in generations for name in files}
+    removed = []
+    for name in os.listdir(assets_dir):
+        base = name[:-3] if name.endswith((".gz", ".br")) else name
+        if base not in live:
+            os.unlink(os.path.join(assets_dir, name))
+            removed.append(name)
+    return sorted(removed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Publish content-hashed static assets")
+    parser.add_argument("source_dir")
+    parser.add_argument("assets_dir")
+    parser.add_argument("--bundle", required=True, help="name of the role's asset set")
+    parser.add_argument("--manifest", default=MANIFEST)
+    parser.add_argument("--keep", type=int, default=KEEP, help="generations kept per bundle")
+    parser.add_argument("--url-prefix", default=URL_PREFIX)
+    parser.add_argument("--dry-run", action="store_true", help="print the URLs without publishing")
+    args = parser.parse_args(argv)
+
+    if args.dry_run:
+        urls = urls_for(args.source_dir, args.url_prefix)
+    else:
+        urls = publish(args.source_dir, args.assets_dir, args.bundle, args.manifest, args.keep, args.url_prefix)
+    print(json.dumps(urls, sort_keys=True))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
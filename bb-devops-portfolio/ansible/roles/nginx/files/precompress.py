@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+BB IaC Pipeline - Deploy-time precompression for gzip_static
+Writes <file>.gz (and, with --brotli, <file>.br) at maximum compression next
+to every compressible static asset under the web root, so nginx sends the
+stored variant instead of compressing the same page on every request
+
+A variant carries its source's mtime and is rebuilt only when that differs;
+Ansible rewrites a template only when its output changes, so unchanged pages
+cost one stat per deploy. Variants that would not be smaller than their
+source, and variants whose source is gone, are removed
+
+Usage:
+    precompress.py [--exclude status] [--brotli] /var/www/html
+    precompress.py --benchmark /var/www/html
+"""
+
+import argparse
+import gzip
+import os
+import sys
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+WEB_ROOT = "/var/www/html"
+EXTENSIONS = (".html", ".htm", ".css", ".js", ".json", ".svg", ".txt", ".xml")
+# Matches gzip_min_length: smaller responses are sent uncompressed anyway
+MIN_SIZE = 1024
+# nginx's on-the-fly gzip_comp_level when the config does not set one
+NGINX_GZIP_LEVEL = 1
+
+
+def _gzip(data, mtime):
+    return gzip.compress(data, compresslevel=9, mtime=mtime)
+
+
+def _brotli(data, mtime):
+    return brotli.compress(data, quality=11)
+
+
+VARIANTS = {".gz": _gzip, ".br": _brotli}
+
+
+def compressible(name):
+    return name.endswith(EXTENSIONS)
+
+
+def _write_variant(path, data, source_stat):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.chmod(tmp, source_stat.st_mode & 0o777)
+    os.utime(tmp, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+    os.replace(tmp, path)
+
+
+def _remove(path):
+    try:
+        os.unlink(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def precompress(root, exclude=(), suffixes=(".gz",)):
+    """Bring every variant under root up to date; returns counts by outcome"""
+    counts = {"compressed": 0, "unchanged": 0, "skipped": 0, "removed": 0}
+    for directory, dirs, files in os.walk(root):
+        if directory == root:
+            dirs[:] = [d for d in dirs if d not in exclude]
+        present = set(files)
+        for name in files:
+            path = os.path.join(directory, name)
+            suffix = os.path.splitext(name)[1]
+            if suffix in VARIANTS:
+                source = name[:-len(suffix)]
+                # Only variants this tool writes: a standalone archive.tar.gz is left alone
+                if compressible(source) and (source not in present or suffix not in suffixes):
+                    counts["removed"] += _remove(path)
+                continue
+            if not compressible(name):
+                continue
+            stat = os.stat(path)
+            data = None
+            for variant_suffix in suffixes:
+                variant = path + variant_suffix
+                try:
+                    if os.stat(variant).st_mtime_ns == stat.st_mtime_ns:
+                        counts["unchanged"] += 1
+                        continue
+                except FileNotFoundError:
+                    pass
+                if data is None:
+                    with open(path, "rb") as f:
+                        data = f.read()
+                compressed = VARIANTS[variant_suffix](data, int(stat.st_mtime)) if len(data) >= MIN_SIZE else None
+                if compressed is None or len(compressed) >= len(data):
+                    _remove(variant)
+                    counts["skipped"] += 1
+                    continue
+                _write_variant(variant, compressed, stat)
+                counts["compressed"] += 1
+    return counts
+
+
+def benchmark(root, level=NGINX_GZIP_LEVEL, rounds=200):
+    """[(path, bytes, gzip_bytes, dynamic_us, static_us)] per precompressed asset
+
+    dynamic_us is the CPU time of compressing the asset per response at
+    nginx's on-the-fly level; static_us is reading the stored .gz, which is
+    all gzip_static does
+    """
+    rows = []
+    for directory, _, files in os.walk(root):
+        for name in sorted(files):
+            path = os.path.join(directory, name)
+            if not compressible(name) or not os.path.exists(path + ".gz"):
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            started = time.process_time()
+            for _ in range(rounds):
+                gzip.compress(data, compresslevel=level)
+            dynamic = (time.process_time() - started) / rounds
+            started = time.process_time()
+            for _ in range(rounds):
+                with open(path + ".gz", "rb") as f:
+                    stored = f.read()
+            static = (time.process_time() - started) / rounds
+            rows.append((os.path.relpath(path, root), len(data), len(stored), dynamic * 1e6, static * 1e6))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompress static assets for gzip_static")
+    parser.add_argument("root", nargs="?", default=WEB_ROOT)
+    parser.add_argument("--exclude", action="append", default=[],
+                        help="top-level directory rewritten at run time (repeatable)")
+    parser.add_argument("--brotli", action="store_true", help="also write .br variants (brotli_static)")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="report CPU per response of on-the-fly gzip against the stored variants")
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        rows = benchmark(args.root, rounds=args.rounds)
+        for path, size, gz_size, dynamic, static in rows:
+            print(f"{path}: {size} -> {gz_size} bytes, gzip {dynamic:.1f} us, gzip_static {static:.1f} us, "
+                  f"saved {dynamic - static:.1f} us/request")
+        if rows:
+            saved = sum(dynamic - static for *_, dynamic, static in rows) / len(rows)
+            print(f"mean CPU saved per request: {saved:.1f} us")
+        return 0
+
+    if args.brotli and brotli is None:
+        parser.error("--brotli needs the brotli module (python3-brotli)")
+    suffixes = (".gz", ".br") if args.brotli else (".gz",)
+    counts = precompress(args.root, set(args.exclude), suffixes)
+    print(" ".join(f"{name}={value}" for name, value in counts.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Plan-diff engine for `terraform show -json` plans
+Streams resource_changes through the tfstate reader, classifies each
+resource as create/update/replace/delete/read/no-op (or other, for action
+lists this version does not know, e.g. forget) with the attributes
+that changed, and flags attributes built from functions that return a
+new value on every plan (timestamp(), uuid(), ...)
+
+Usage:
+    terraform show -json tfplan > plan.json
+    plandiff.py plan.json [--terraform-dir terraform] [--json plan-diff.json]
+"""
+
+import argparse
+import json
+import re
+import sys
+from collections import Counter
+from pathlib import Path
+
+from tfstate import events
+
+ACTIONS = ("create", "update", "replace", "delete", "read", "no-op", "other")
+
+# Functions whose result differs between plans even with no config change
+UNSTABLE_FUNCTIONS = ("timestamp", "plantimestamp", "uuid", "bcrypt")
+
+_RESOURCE = re.compile(r'^resource\s+"(\w+)"\s+"([\w-]+)"\s*\{', re.MULTILINE)
+_ATTRIBUTE = re.compile(r"^\s*(\w+)\s*=\s*(.+)$", re.MULTILINE)
+_UNSTABLE_CALL = re.compile(r"\b(" + "|".join(UNSTABLE_FUNCTIONS) + r")\s*\(")
+_INDEX = re.compile(r"\[[^\]]*\]$")
+
+
+def classify(actions):
+    """Single action name for a change.actions list; "other" for lists added by later Terraform versions"""
+    actions = list(actions)
+    if actions in (["delete", "create"], ["create", "delete"]):
+        return "replace"
+    if len(actions) == 1 and actions[0] in ACTIONS:
+        return actions[0]
+    return "other"
+
+
+def _block_body(text, start):
+    depth, pos = 1, start
+    while depth and pos < len(text):
+        if text[pos] == "{":
+            depth += 1
+        elif text[pos] == "}":
+            depth -= 1
+        pos += 1
+    return text[start:pos - 1]
+
+
+def unstable_attributes(terraform_dir):
+    """{"type.name": {attribute: function}} for non-deterministic expressions"""
+    found = {}
+    for tf_file in sorted(Path(terraform_dir).glob("*.tf")):
+        text = tf_file.read_text()
+        for resource in _RESOURCE.finditer(text):
+            body = _block_body(text, resource.end())
+            for attribute in _ATTRIBUTE.finditer(body):
+                call = _UNSTABLE_CALL.search(attribute.group(2))
+                if call:
+                    address = f"{resource.group(1)}.{resource.group(2)}"
+                    found.setdefault(address, {})[attribute.group(1)] = f"{call.group(1)}()"
+    return found
+
+
+def _config_address(address):
+    """aws_s3_bucket.config[0] -> aws_s3_bucket.config (root module only)"""
+    return _INDEX.sub("", address)
+
+
+def _path(parts):
+    return ".".join(str(p) for p in parts)
+
+
+class ResourceDiff:
+    """Classified change for one resource instance"""
+
+    __slots__ = ("address", "type", "action", "changed", "replace_paths", "unstable")
+
+    def __init__(self, address, type, action, changed=(), replace_paths=(), unstable=None):
+        self.address = address
+        self.type = type
+        self.action = action
+        self.changed = list(changed)
+        self.replace_paths = list(replace_paths)
+        self.unstable = unstable or {}
+
+    @classmethod
+    def from_change(cls, raw, unstable=None):
+        change = raw["change"]
+        action = classify(change["actions"])
+        changed = []
+        if action in ("update", "replace"):
+            before = change.get("before") or {}
+            after = change.get("after") or {}
+            unknown = change.get("after_unknown") or {}
+            changed = sorted(
+                key for key in set(before) | set(after) | set(unknown)
+                if unknown.get(key) or before.get(key) != after.get(key)
+            )
+        replace_paths = [_path(p) for p in change.get("replace_paths", [])]
+        return cls(raw["address"], raw["type"], action, changed, replace_paths,
+                   (unstable or {}).get(_config_address(raw["address"])))
+
+    @property
+    def perpetual(self):
+        """Replacement forced by an attribute that changes on every plan"""
+        return self.action == "replace" and any(p.split(".")[0] in self.unstable for p in self.replace_paths)
+
+    def as_dict(self):
+        return {
+            "address": self.address,
+            "type": self.type,
+            "action": self.action,
+            "changed": self.changed,
+            "replace_paths": self.replace_paths,
+            "unstable": self.unstable,
+        }
+
+
+class PlanDiff:
+    """Per-resource classification and counts for one plan"""
+
+    def __init__(self, diffs, unstable):
+        self.diffs = diffs
+        self.unstable = unstable
+        self.counts = Counter(d.action for d in diffs)
+
+    @classmethod
+    def from_file(cls, plan_file, terraform_dir=None):
+        unstable = unstable_attributes(terraform_dir) if terraform_dir else {}
+        diffs = []
+        with open(plan_file, encoding="utf-8") as f:
+            for kind, payload in events(f):
+                if kind == "change":
+                    diffs.append(ResourceDiff.from_change(payload, unstable))
+        return cls(diffs, unstable)
+
+    def changes(self):
+        return [d for d in self.diffs if d.action != "no-op"]
+
+    @property
+    def perpetual(self):
+        return [d for d in self.diffs if d.perpetual]
+
+    def as_dict(self):
+        return {
+            "counts": {action: self.counts.get(action, 0) for action in ACTIONS},
+            "changes": [d.as_dict() for d in self.changes()],
+            "unstable": [
+                {"address": address, "attribute": attribute, "function": function}
+                for address, attributes in sorted(self.unstable.items())
+                for attribute, function in sorted(attributes.items())
+            ],
+            "perpetual_replacements": [d.address for d in self.perpetual],
+        }
+
+    def summary_lines(self):
+        counts = self.counts
+        lines = [
+            f"plan: {counts['create']} to create, {counts['update']} to update, "
+            f"{counts['replace']} to replace, {counts['delete']} to delete, "
+            f"{counts['no-op']} unchanged" + (f", {counts['other']} other" if counts['other'] else "")
+        ]
+        symbols = {"create": "+", "update": "~", "replace": "-/+", "delete": "-", "read": "<=", "other": "?"}
+        for diff in self.changes():
+            detail = ", ".join(diff.changed) if diff.changed else ""
+            forced = f" [forces replacement: {', '.join(diff.replace_paths)}]" if diff.replace_paths else ""
+            lines.append(f"  {symbols[diff.action]} {diff.address} ({diff.action}) {detail}{forced}".rstrip())
+        for address, attributes in sorted(self.unstable.items()):
+            for attribute, function in sorted(attributes.items()):
+                lines.append(f"  ! {address}.{attribute} uses {function} - its value changes on every plan")
+        return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Classify the resource changes of a JSON plan")
+    parser.add_argument("plan", help="output of `terraform show -json <planfile>`")
+    parser.add_argument("--terraform-dir", help="configuration to scan for unstable expressions")
+    parser.add_argument("--json", dest="json_out", help="write the machine-readable summary here")
+    args = parser.parse_args(argv)
+
+    diff = PlanDiff.from_file(args.plan, args.terraform_dir)
+    for line in diff.summary_lines():
+        print(line)
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(diff.as_dict(), f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
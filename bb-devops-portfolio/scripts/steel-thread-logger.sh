@@ -189,6 +189,36 @@ log_resource() {
     echo "    $timestamp - RESOURCE: $resource_type $resource_id $action" >> "${JSON_LOG}.resources"
 }
 
+# Terraform plan summary (machine-readable output of scripts/plandiff.py)
+log_plan_diff() {
+    local plan_json="$1"
+    local timestamp=$(date '+%Y-%m-%d %H:%M:%S')
+    
+    python3 "$SCRIPT_DIR/plandiff.py" "$plan_json" \
+        --terraform-dir "$PROJECT_ROOT/terraform" \
+        --json "$LOG_DIR/plan-diff.json" | sed 's/^/   /' | tee -a "$LOG_FILE"
+    echo "    $timestamp - PLAN: $LOG_DIR/plan-diff.json" >> "${JSON_LOG}.steps"
+}
+
+# Ansible phase timings (written by the phase_report callback plugin)
+log_ansible_phases() {
+    local report_json="$1"
+    local timestamp=$(date '+%Y-%m-%d %H:%M:%S')
+    
+    [ -f "$report_json" ] || { echo "   → Ansible phase report: not written" | tee -a "$LOG_FILE"; return 0; }
+    python3 -c "
+import json, sys
+report = json.load(open(sys.argv[1]))
+for phase in report['phases']:
+    print(f\"ansible/{phase['name']} = {phase['seconds']:.1f}s\")
+facts = 'from cache' if report['facts_cached'] else 'gathered'
+print(f\"ansible/single-pass = {report['total_seconds']:.1f}s (facts {facts}, ~{report['saved_seconds']:.1f}s saved over {report['baseline_runs']} runs)\")
+" "$report_json" | while read -r line; do
+        echo -e "   ${BLUE}⏱️${NC}  DURATION: $line" | tee -a "$LOG_FILE"
+        echo "    $timestamp - DURATION: $line" >> "${JSON_LOG}.durations"
+    done
+}
+
 # Initialize the logging session
 initialize_logging() {
     echo -e "${CYAN}🚀 BB DevOps Portfolio - Steel-Thread Execution Log${NC}" | tee "$LOG_FILE"
@@ -254,6 +284,10 @@ $(grep "✅" "$LOG_FILE" | sed 's/^/- /')
 
 $(if [ -f "${JSON_LOG}.resources" ]; then cat "${JSON_LOG}.resources" | sed 's/^/- /'; else echo "- No resources tracked"; fi)
 
+## Terraform Plan
+
+$(if [ -f "$LOG_DIR/plan-diff.json" ]; then python3 -c "import json,sys; d=json.load(open(sys.argv[1])); print('- Counts: ' + ', '.join(f'{k} {v}' for k, v in d['counts'].items())); [print(f'- Perpetual replacement: {a}') for a in d['perpetual_replacements']]" "$LOG_DIR/plan-diff.json"; else echo "- No plan captured"; fi)
+
 ## Performance Metrics
 
 $(if [ -f "${JSON_LOG}.durations" ]; then cat "${JSON_LOG}.durations" | sed 's/^/- /'; else echo "- No duration metrics captured"; fi)
@@ -271,7 +305,7 @@ EOF
 }
 
 # Export functions for use in Makefile
-export -f log_phase_start log_phase_end log_step log_result log_sequence log_cost log_duration log_resource initialize_logging finalize_logging
+export -f log_phase_start log_phase_end log_step log_result log_sequence log_cost log_duration log_resource log_plan_diff log_ansible_phases initialize_logging finalize_logging
 
 # If script is run directly, initialize logging
 if [[ "${BASH_SOURCE[0]}" == "${0}" ]]; then
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+Streaming Terraform state/plan reader
+Reads terraform.tfstate, `terraform show -json` and plan JSON one resource
+at a time with a chunked pull parser, and indexes the resources by
+address, type and tag in a single pass
+
+Usage:
+    tfstate.py summary STATE
+    tfstate.py query STATE TYPE_OR_ADDRESS ATTRIBUTE
+    tfstate.py missing-tag STATE TAG
+"""
+
+import argparse
+import json
+import re
+import sys
+from collections import defaultdict
+
+CHUNK_SIZE = 1 << 16
+
+_WHITESPACE = " \t\n\r"
+_DECODER = json.JSONDecoder()
+_SKIP_TOKEN = re.compile(r'["{}\[\]]')
+_STRING_TAIL = re.compile(r'(?:[^"\\]|\\.)*"', re.DOTALL)
+
+# Small top-level scalars worth keeping from every document kind
+METADATA_KEYS = ("version", "format_version", "terraform_version", "serial", "lineage")
+
+
+class JsonStream:
+    """Pull parser over a JSON document read in fixed-size chunks
+
+    object_items()/array_items() position the stream at each member;
+    the caller must consume it with value() or skip() before advancing
+    """
+
+    def __init__(self, fp, chunk_size=CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """Append the next chunk, dropping consumed text; False at EOF"""
+        if self.eof:
+            return False
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError("unexpected end of JSON document")
+
+    def _expect(self, chars):
+        char = self.peek()
+        if char not in chars:
+            raise ValueError(f"expected one of {chars!r}, found {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decode the next complete value"""
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A bare number ending the buffer may continue in the next chunk
+            if end == len(self.buf) and self.buf[self.pos] not in '{["' and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def skip(self):
+        """Step over the next value without building it"""
+        if self.peek() not in "{[":
+            self.value()
+            return
+        depth = 0
+        while True:
+            token = _SKIP_TOKEN.search(self.buf, self.pos)
+            if token is None:
+                self.pos = len(self.buf)
+                if not self._fill():
+                    raise ValueError("unexpected end of JSON document")
+                continue
+            if token.group() == '"':
+                tail = _STRING_TAIL.match(self.buf, token.end())
+                if tail is None:
+                    # String runs past the buffer - keep the opening quote
+                    self.pos = token.start()
+                    if not self._fill():
+                        raise ValueError("unterminated string")
+                    continue
+                self.pos = tail.end()
+                continue
+            self.pos = token.end()
+            depth += 1 if token.group() in "{[" else -1
+            if depth == 0:
+                return
+
+    def object_items(self):
+        """Yield each key of the next object"""
+        self._expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self._expect(":")
+            yield key
+            if self._expect(",}") == "}":
+                return
+
+    def array_items(self):
+        """Yield the index of each element of the next array"""
+        self._expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        index = 0
+        while True:
+            yield index
+            index += 1
+            if self._expect(",]") == "]":
+                return
+
+
+def _index_suffix(index):
+    if index is None:
+        return ""
+    return f"[{json.dumps(index)}]"
+
+
+class Resource:
+    """One resource instance from state, show -json or planned values"""
+
+    __slots__ = ("address", "mode", "type", "name", "module", "index", "provider", "attributes")
+
+    def __init__(self, address, mode, type, name, module, index, provider, attributes):
+        self.address = address
+        self.mode = mode
+        self.type = type
+        self.name = name
+        self.module = module
+        self.index = index
+        self.provider = provider
+        self.attributes = attributes or {}
+
+    @property
+    def taggable(self):
+        return "tags_all" in self.attributes or "tags" in self.attributes
+
+    @property
+    def tags(self):
+        """Effective tags, including provider default_tags when known"""
+        return self.attributes.get("tags_all") or self.attributes.get("tags") or {}
+
+    def __repr__(self):
+        return f"Resource({self.address})"
+
+
+def _state_instances(raw):
+    """Resource instances of one v4 state `resources` entry"""
+    module = raw.get("module")
+    prefix = f"{module}." if module else ""
+    data = "data." if raw.get("mode") == "data" else ""
+    for instance in raw.get("instances", []):
+        index = instance.get("index_key")
+        yield Resource(
+            address=f"{prefix}{data}{raw['type']}.{raw['name']}{_index_suffix(index)}",
+            mode=raw.get("mode", "managed"),
+            type=raw["type"],
+            name=raw["name"],
+            module=module,
+            index=index,
+            provider=raw.get("provider"),
+            attributes=instance.get("attributes"),
+        )
+
+
+def _module_resource(raw, module):
+    return Resource(
+        address=raw["address"],
+        mode=raw.get("mode", "managed"),
+        type=raw["type"],
+        name=raw["name"],
+        module=module,
+        index=raw.get("index"),
+        provider=raw.get("provider_name"),
+        attributes=raw.get("values"),
+    )
+
+
+def _module_events(stream):
+    """Resources of a show -json module, recursing into child modules"""
+    module = None
+    for key in stream.object_items():
+        if key == "address":
+            module = stream.value()
+        elif key == "resources":
+            for _ in stream.array_items():
+                yield "resource", _module_resource(stream.value(), module)
+        elif key == "child_modules":
+            for _ in stream.array_items():
+                yield from _module_events(stream)
+        else:
+            stream.skip()
+
+
+def _values_events(stream):
+    for key in stream.object_items():
+        if key == "outputs":
+            yield "outputs", stream.value()
+        elif key == "root_module":
+            yield from _module_events(stream)
+        else:
+            stream.skip()
+
+
+def events(fp, chunk_size=CHUNK_SIZE):
+    """Stream (kind, payload) events from any Terraform JSON document
+
+    kinds: "metadata" ((key, value)), "outputs" (dict), "resource"
+    (Resource) and "change" (one raw resource_changes entry of a plan)
+    """
+    stream = JsonStream(fp, chunk_size)
+    for key in stream.object_items():
+        if key == "resources":
+            for _ in stream.array_items():
+                for resource in _state_instances(stream.value()):
+                    yield "resource", resource
+        elif key == "outputs":
+            yield "outputs", stream.value()
+        elif key in ("values", "planned_values"):
+            yield from _values_events(stream)
+        elif key == "resource_changes":
+            for _ in stream.array_items():
+                yield "change", stream.value()
+        elif key in METADATA_KEYS:
+            yield "metadata", (key, stream.value())
+        else:
+            stream.skip()
+
+
+class StateIndex:
+    """Resources indexed by address, type and tag after one streaming pass"""
+
+    def __init__(self):
+        self.metadata = {}
+        self.outputs = {}
+        self.resources = {}
+        self.by_type = defaultdict(list)
+        self.by_tag = defaultdict(list)
+        self.tag_keys = defaultdict(set)
+        self.taggable = []
+        self._missing = {}
+
+    @classmethod
+    def from_events(cls, stream_events):
+        index = cls()
+        for kind, payload in stream_events:
+            if kind == "resource":
+                index.add(payload)
+            elif kind == "outputs":
+                index.outputs = payload
+            elif kind == "metadata":
+                index.metadata[payload[0]] = payload[1]
+        return index
+
+    def add(self, resource):
+        self.resources[resource.address] = resource
+        self.by_type[resource.type].append(resource)
+        if resource.taggable:
+            self.taggable.append(resource)
+            for key, value in resource.tags.items():
+                self.by_tag[(key, value)].append(resource)
+                self.tag_keys[key].add(resource.address)
+        self._missing.clear()
+
+    def __len__(self):
+        return len(self.resources)
+
+    def __contains__(self, address):
+        return address in self.resources
+
+    def __getitem__(self, address):
+        return self.resources[address]
+
+    def of_type(self, type):
+        return self.by_type.get(type, [])
+
+    def with_tag(self, key, value):
+        return self.by_tag.get((key, value), [])
+
+    def missing_tag(self, key):
+        """Taggable resources without the tag (computed once per key)"""
+        if key not in self._missing:
+            tagged = self.tag_keys.get(key, set())
+            self._missing[key] = [r for r in self.taggable if r.address not in tagged]
+        return self._missing[key]
+
+    def attribute(self, selector, name):
+        """Values of one attribute for an address or for every resource of a type"""
+        resources = [self.resources[selector]] if selector in self.resources else self.of_type(selector)
+        return [r.attributes.get(name) for r in resources if r.attributes.get(name) is not None]
+
+    def summary(self):
+        return {
+            "metadata": self.metadata,
+            "resources": len(self.resources),
+            "types": {t: len(rs) for t, rs in sorted(self.by_type.items())},
+            "outputs": sorted(self.outputs),
+        }
+
+
+def load_index(path, chunk_size=CHUNK_SIZE):
+    """Build a StateIndex from a state, show -json or plan JSON file"""
+    with open(path, encoding="utf-8") as f:
+        return StateIndex.from_events(events(f, chunk_size))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query Terraform state without loading it whole")
+    commands = parser.add_subparsers(dest="command", required=True)
+    summary = commands.add_parser("summary", help="resource counts by type")
+    summary.add_argument("state")
+    query = commands.add_parser("query", help="attribute values of an address or type")
+    query.add_argument("state")
+    query.add_argument("selector", help="resource address (aws_instance.web) or type (aws_instance)")
+    query.add_argument("attribute")
+    missing = commands.add_parser("missing-tag", help="taggable resources without a tag")
+    missing.add_argument("state")
+    missing.add_argument("tag")
+    args = parser.parse_args(argv)
+
+    index = load_index(args.state)
+    if args.command == "summary":
+        json.dump(index.summary(), sys.stdout, indent=2)
+        print()
+    elif args.command == "query":
+        values = index.attribute(args.selector, args.attribute)
+        for value in values:
+            print(value if isinstance(value, str) else json.dumps(value))
+        return 0 if values else 1
+    elif args.command == "missing-tag":
+        for resource in index.missing_tag(args.tag):
+            print(resource.address)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
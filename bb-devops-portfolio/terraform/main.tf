@@ -149,6 +149,7 @@ resource "aws_instance" "web" {
   key_name               = aws_key_pair.deployer.key_name
   vpc_security_group_ids = [aws_security_group.web.id]
   subnet_id              = aws_subnet.public.id
+  iam_instance_profile   = aws_iam_instance_profile.web.name
 
   # Wait for instance to be ready for Ansible
   user_data = <<-EOF
@@ -210,6 +211,63 @@ resource "aws_s3_bucket_public_access_block" "config" {
   restrict_public_buckets = true
 }
 
+# Instance role: rotated logs to the config bucket (logs/ prefix only) and
+# pre-aggregated metrics to the project CloudWatch namespace
+resource "aws_iam_role" "web" {
+  name = "bb-iac-web-role-${random_string.suffix.result}"
+
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [{
+      Effect    = "Allow"
+      Principal = { Service = "ec2.amazonaws.com" }
+      Action    = "sts:AssumeRole"
+    }]
+  })
+
+  tags = {
+    Name = "bb-iac-web-role-${random_string.suffix.result}"
+  }
+}
+
+resource "aws_iam_role_policy" "web" {
+  name = "bb-iac-web-telemetry"
+  role = aws_iam_role.web.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "s3:PutObject",
+          "s3:GetObject",
+          "s3:AbortMultipartUpload",
+          "s3:ListMultipartUploadParts",
+        ]
+        Resource = "${aws_s3_bucket.config.arn}/logs/*"
+      },
+      {
+        Effect    = "Allow"
+        Action    = "s3:ListBucket"
+        Resource  = aws_s3_bucket.config.arn
+        Condition = { StringLike = { "s3:prefix" = ["logs/*"] } }
+      },
+      {
+        Effect    = "Allow"
+        Action    = "cloudwatch:PutMetricData"
+        Resource  = "*"
+        Condition = { StringEquals = { "cloudwatch:namespace" = "BB-IaC-Pipeline" } }
+      },
+    ]
+  })
+}
+
+resource "aws_iam_instance_profile" "web" {
+  name = "bb-iac-web-profile-${random_string.suffix.result}"
+  role = aws_iam_role.web.name
+}
+
 # CloudWatch Log Group for monitoring
 resource "aws_cloudwatch_log_group" "web_logs" {
   name              = "/aws/ec2/bb-iac-web-${random_string.suffix.result}"
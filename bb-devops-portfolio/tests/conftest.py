@@ -0,0 +1,247 @@
+"""
+Shared pytest fixtures for BB DevOps Portfolio tests
+"""
+
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from support.aws import AWS_REGION, BaselineTopology, MotoBackend, SetupTimings
+from support.config_model import load_projects
+from support.http_pool import DEFAULT_POOL_SIZE, PooledHttpClient
+from support.local_target import start_local_target
+from support.readiness import wait_until_ready
+from support.scripts import load_module
+from support.terraform import TerraformOutputs, TerraformOutputsUnavailable
+
+_MOTO_TIMINGS = pytest.StashKey()
+_READINESS = pytest.StashKey()
+_HTTP_CLIENT = pytest.StashKey()
+# Role tools other tools import by name, in dependency order, as they sit
+# side by side in monitor_lib_dir on the host
+_SHARED_TOOLS = ("auth_detector", "logtail", "monitor_agent", "nginx_log_stats", "log_archive")
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--target",
+        choices=("aws", "local"),
+        default=os.environ.get("TEST_TARGET", "aws"),
+        help="web server under test: the deployed EC2 instance (aws) or a local "
+             "stand-in rendered from the nginx role templates (local)",
+    )
+
+
+def _local_mode(config):
+    return config.getoption("--target") == "local"
+
+
+def _moto_timings(config):
+    if _MOTO_TIMINGS not in config.stash:
+        config.stash[_MOTO_TIMINGS] = SetupTimings()
+    return config.stash[_MOTO_TIMINGS]
+
+
+# ---------------------------------------------------------------------------
+# AWS (moto) backend
+# ---------------------------------------------------------------------------
+
+@pytest.fixture(scope="session")
+def moto_backend():
+    """Single moto backend for the session (one per xdist worker)"""
+    backend = MotoBackend(AWS_REGION)
+    yield backend
+    backend.close()
+
+
+@pytest.fixture(scope="session")
+def _baseline(moto_backend, request):
+    with moto_backend.active():
+        topology = BaselineTopology(moto_backend).build()
+    yield topology
+    _moto_timings(request.config).merge(topology.timings)
+
+
+@pytest.fixture
+def aws(moto_backend, _baseline):
+    """Resume the shared moto backend for the duration of one test"""
+    moto_backend.resume()
+    yield moto_backend
+    moto_backend.pause()
+
+
+@pytest.fixture
+def aws_client(aws):
+    """Cached boto3 client factory bound to the mocked backend"""
+    return aws.client
+
+
+@pytest.fixture
+def baseline_topology(_baseline, aws):
+    """Prebuilt main.tf topology, reset to its snapshot after each test"""
+    yield _baseline.checkout()
+    _baseline.reset()
+
+
+# ---------------------------------------------------------------------------
+# Ansible config model
+# ---------------------------------------------------------------------------
+
+@pytest.fixture(scope="session")
+def config_model(request):
+    """Parsed ansible/ trees of every project, loaded once per session"""
+    cache = getattr(request.config, "cache", None)
+    return load_projects(cache.mkdir("config-model") if cache else None)
+
+
+@pytest.fixture(scope="session")
+def devops_config(config_model):
+    """Parsed ansible/ tree of bb-devops-portfolio"""
+    return config_model["bb-devops-portfolio"]
+
+
+@pytest.fixture(scope="session", params=["bb-devops-portfolio", "bb-iac-integrated-pipeline"])
+def project_config(request, config_model):
+    """Parsed ansible/ tree of each project that ships the shared roles"""
+    if request.param not in config_model:
+        pytest.skip(f"{request.param} is not checked out")
+    return config_model[request.param]
+
+
+@pytest.fixture(scope="session")
+def role_module(devops_config):
+    """Import a Python tool shipped in a role's files/ directory"""
+
+    def load(role, name):
+        files = devops_config.roles[role].files
+        # Registered in sys.modules first, so "from logtail import ..." resolves
+        for shared in _SHARED_TOOLS:
+            if f"{shared}.py" in files:
+                load_module(files[f"{shared}.py"])
+        return load_module(files[f"{name}.py"])
+
+    return load
+
+
+# ---------------------------------------------------------------------------
+# Deployed infrastructure (terraform outputs)
+# ---------------------------------------------------------------------------
+
+@pytest.fixture(scope="session")
+def terraform_outputs(request, tmp_path_factory):
+    """Terraform outputs, read once and shared across xdist workers"""
+    if _local_mode(request.config):
+        pytest.skip("Terraform outputs are not used against the local target")
+    cache = getattr(request.config, "cache", None)
+    cache_dir = cache.mkdir("terraform-outputs") if cache else tmp_path_factory.getbasetemp()
+    try:
+        return TerraformOutputs(cache_dir).load()
+    except TerraformOutputsUnavailable as e:
+        pytest.skip(f"Terraform outputs not available - infrastructure may not be deployed ({e})")
+
+
+@pytest.fixture(scope="session")
+def local_target(tmp_path_factory):
+    """nginx (or the Python stand-in) serving the rendered nginx role on 127.0.0.1"""
+    target = start_local_target(tmp_path_factory.mktemp("local-target"))
+    yield target
+    target.stop()
+
+
+@pytest.fixture(scope="session")
+def web_server_url(request):
+    """Web server URL from Terraform outputs, or the local target's URL"""
+    if _local_mode(request.config):
+        return request.getfixturevalue("local_target").url
+    return request.getfixturevalue("terraform_outputs")["web_server_url"]["value"]
+
+
+@pytest.fixture(scope="session")
+def web_server_ready(request, web_server_url):
+    """Gate the integration suite once on every endpoint being reachable"""
+    report = wait_until_ready(
+        web_server_url,
+        ssh_port=None if _local_mode(request.config) else 22,
+        timeout=float(os.environ.get("READINESS_TIMEOUT", "60")),
+    )
+    request.config.stash[_READINESS] = report
+    if not report.ready:
+        pytest.fail(report.summary(), pytrace=False)
+    return report
+
+
+@pytest.fixture(scope="session")
+def http_client(request):
+    """Session-wide keep-alive HTTP client
+
+    HTTP_POOL_SIZE sets the default per-host pool; HTTP_POOL_SIZES takes
+    comma-separated origin=size overrides (http://1.2.3.4=20)
+    """
+    host_sizes = {}
+    for item in filter(None, os.environ.get("HTTP_POOL_SIZES", "").split(",")):
+        origin, _, size = item.rpartition("=")
+        host_sizes[origin.strip()] = int(size)
+    client = PooledHttpClient(
+        pool_size=int(os.environ.get("HTTP_POOL_SIZE", DEFAULT_POOL_SIZE)),
+        host_pool_sizes=host_sizes,
+    )
+    request.config.stash[_HTTP_CLIENT] = client
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def local_http_server():
+    """Throwaway keep-alive HTTP server serving 200 for Handler.routes"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        routes = {"/", "/health", "/monitoring.html"}
+
+        def do_GET(self):
+            body = b"ok\n" if self.path in self.routes else b"not found\n"
+            self.send_response(200 if self.path in self.routes else 404)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, Handler
+    server.shutdown()
+    server.server_close()
+
+
+def pytest_sessionfinish(session):
+    workeroutput = getattr(session.config, "workeroutput", None)
+    if workeroutput is not None and _MOTO_TIMINGS in session.config.stash:
+        workeroutput["moto_timings"] = session.config.stash[_MOTO_TIMINGS].as_dict()
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_testnodedown(node, error):
+    data = getattr(node, "workeroutput", {}).get("moto_timings")
+    if data:
+        _moto_timings(node.config).merge(SetupTimings(**data))
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    timings = config.stash.get(_MOTO_TIMINGS, None)
+    readiness = config.stash.get(_READINESS, None)
+    http_lines = config.stash[_HTTP_CLIENT].summary() if _HTTP_CLIENT in config.stash else []
+    if not ((timings and timings.builds) or readiness or http_lines):
+        return
+    terminalreporter.write_sep("-", "setup cost")
+    if timings and timings.builds:
+        terminalreporter.write_line(timings.summary())
+    if readiness:
+        terminalreporter.write_line(readiness.summary())
+    for line in http_lines:
+        terminalreporter.write_line(line)
@@ -0,0 +1,4 @@
+"""
+Shared test support layer for BB DevOps Portfolio
+Fixture backends and helpers reused across the test modules
+"""
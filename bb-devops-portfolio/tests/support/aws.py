@@ -0,0 +1,332 @@
+"""
+Session-scoped moto backend and baseline topology for infrastructure tests
+Builds the terraform/main.tf network and config bucket once per session
+(or xdist worker) and hands each test a cheaply reset copy of it
+"""
+
+import time
+from contextlib import contextmanager
+from datetime import date
+
+import boto3
+from moto import mock_aws
+
+AWS_REGION = "us-east-1"
+
+# Fixed stand-in for random_string.suffix so names are predictable in tests
+BASELINE_SUFFIX = "baseline"
+
+# provider "aws" default_tags from terraform/main.tf
+DEFAULT_TAGS = {
+    "Project": "bb-iac-integrated-pipeline",
+    "Environment": "dev",
+    "ManagedBy": "terraform",
+    "Owner": "brian-boelsterli",
+    "Purpose": "enterprise-devops-demo",
+}
+
+# aws_security_group.web ingress blocks from terraform/main.tf
+WEB_INGRESS_RULES = [
+    {"port": 22, "description": "SSH access"},
+    {"port": 80, "description": "HTTP access"},
+    {"port": 443, "description": "HTTPS access"},
+]
+
+PUBLIC_ACCESS_BLOCK = {
+    "BlockPublicAcls": True,
+    "IgnorePublicAcls": True,
+    "BlockPublicPolicy": True,
+    "RestrictPublicBuckets": True,
+}
+
+SSE_CONFIGURATION = {
+    "Rules": [{"ApplyServerSideEncryptionByDefault": {"SSEAlgorithm": "AES256"}}]
+}
+
+
+def _tag_list(tags):
+    return [{"Key": key, "Value": value} for key, value in tags.items()]
+
+
+def _ingress_permissions():
+    return [
+        {
+            "IpProtocol": "tcp",
+            "FromPort": rule["port"],
+            "ToPort": rule["port"],
+            "IpRanges": [{"CidrIp": "0.0.0.0/0", "Description": rule["description"]}],
+        }
+        for rule in WEB_INGRESS_RULES
+    ]
+
+
+def _permission_key(permissions):
+    """Order-insensitive fingerprint of a security group's ingress rules"""
+    return sorted(
+        (
+            p.get("IpProtocol"),
+            p.get("FromPort"),
+            p.get("ToPort"),
+            tuple(sorted(r["CidrIp"] for r in p.get("IpRanges", []))),
+        )
+        for p in permissions
+    )
+
+
+class SetupTimings:
+    """Setup cost accounting for the shared baseline"""
+
+    def __init__(self, build_seconds=0.0, builds=0, reuses=0, reset_seconds=0.0):
+        self.build_seconds = build_seconds
+        self.builds = builds
+        self.reuses = reuses
+        self.reset_seconds = reset_seconds
+
+    @property
+    def saved_seconds(self):
+        """Estimated time saved versus rebuilding the topology in every test"""
+        if not self.builds:
+            return 0.0
+        per_build = self.build_seconds / self.builds
+        return max(0.0, per_build * self.reuses - self.build_seconds - self.reset_seconds)
+
+    def merge(self, other):
+        self.build_seconds += other.build_seconds
+        self.builds += other.builds
+        self.reuses += other.reuses
+        self.reset_seconds += other.reset_seconds
+
+    def as_dict(self):
+        return {
+            "build_seconds": self.build_seconds,
+            "builds": self.builds,
+            "reuses": self.reuses,
+            "reset_seconds": self.reset_seconds,
+        }
+
+    def summary(self):
+        return (
+            f"moto baseline topology: {self.builds} build(s) in "
+            f"{self.build_seconds * 1000:.1f} ms, reused by {self.reuses} test(s), "
+            f"resets {self.reset_seconds * 1000:.1f} ms, "
+            f"~{self.saved_seconds:.2f}s setup saved"
+        )
+
+
+class MotoBackend:
+    """One moto backend per process, paused between tests instead of torn down"""
+
+    def __init__(self, region=AWS_REGION):
+        self.region = region
+        self._mock = mock_aws()
+        self._started = False
+        self._active = False
+        self._clients = {}
+
+    def resume(self):
+        # Only the very first start wipes state; later starts keep the baseline
+        self._mock.start(reset=not self._started)
+        self._started = True
+        self._active = True
+
+    def pause(self):
+        if self._active:
+            self._mock.stop(remove_data=False)
+            self._active = False
+
+    @contextmanager
+    def active(self):
+        self.resume()
+        try:
+            yield self
+        finally:
+            self.pause()
+
+    def client(self, service, region=None):
+        """Cached boto3 client factory - one client per service/region"""
+        key = (service, region or self.region)
+        if key not in self._clients:
+            self._clients[key] = boto3.client(service, region_name=key[1])
+        return self._clients[key]
+
+    def close(self):
+        if self._started:
+            self.pause()
+            self._mock.start(reset=False)
+            self._mock.stop(remove_data=True)
+            self._started = False
+        self._clients.clear()
+
+
+class BaselineTopology:
+    """VPC, public subnet, web security group and config bucket from main.tf"""
+
+    def __init__(self, backend, suffix=BASELINE_SUFFIX):
+        self.backend = backend
+        self.suffix = suffix
+        self.vpc_id = None
+        self.subnet_id = None
+        self.security_group_id = None
+        self.bucket_name = f"bb-iac-config-{date.today():%Y%m%d}-{suffix}"
+        self.tags = {}
+        self.timings = SetupTimings()
+        self._snapshot = {}
+
+    @property
+    def availability_zone(self):
+        return f"{self.backend.region}a"
+
+    def build(self):
+        """Create the baseline resources and snapshot everything that exists"""
+        started = time.perf_counter()
+        ec2 = self.backend.client("ec2")
+        s3 = self.backend.client("s3")
+
+        self.vpc_id = ec2.create_vpc(CidrBlock="10.0.0.0/16")["Vpc"]["VpcId"]
+        ec2.modify_vpc_attribute(VpcId=self.vpc_id, EnableDnsHostnames={"Value": True})
+        ec2.modify_vpc_attribute(VpcId=self.vpc_id, EnableDnsSupport={"Value": True})
+
+        self.subnet_id = ec2.create_subnet(
+            VpcId=self.vpc_id,
+            CidrBlock="10.0.1.0/24",
+            AvailabilityZone=self.availability_zone,
+        )["Subnet"]["SubnetId"]
+        ec2.modify_subnet_attribute(
+            SubnetId=self.subnet_id, MapPublicIpOnLaunch={"Value": True}
+        )
+
+        self.security_group_id = ec2.create_security_group(
+            GroupName=f"bb-iac-web-sg-{self.suffix}",
+            Description="Security group for web server",
+            VpcId=self.vpc_id,
+        )["GroupId"]
+        ec2.authorize_security_group_ingress(
+            GroupId=self.security_group_id, IpPermissions=_ingress_permissions()
+        )
+
+        s3.create_bucket(Bucket=self.bucket_name)
+
+        self.tags = {
+            self.vpc_id: {**DEFAULT_TAGS, "Name": f"bb-iac-vpc-{self.suffix}"},
+            self.subnet_id: {
+                **DEFAULT_TAGS,
+                "Name": f"bb-iac-public-subnet-{self.suffix}",
+                "Type": "public",
+            },
+            self.security_group_id: {
+                **DEFAULT_TAGS,
+                "Name": f"bb-iac-web-sg-{self.suffix}",
+            },
+        }
+        self._restore_tags(ec2)
+        s3.put_bucket_tagging(
+            Bucket=self.bucket_name,
+            Tagging={
+                "TagSet": _tag_list(
+                    {
+                        **DEFAULT_TAGS,
+                        "Name": f"bb-iac-config-bucket-{self.suffix}",
+                        "Purpose": "configuration-storage",
+                    }
+                )
+            },
+        )
+        self._restore_bucket(s3)
+
+        self._snapshot = {
+            "vpcs": {v["VpcId"] for v in ec2.describe_vpcs()["Vpcs"]},
+            "subnets": {s["SubnetId"] for s in ec2.describe_subnets()["Subnets"]},
+            "security_groups": {
+                g["GroupId"] for g in ec2.describe_security_groups()["SecurityGroups"]
+            },
+            "buckets": {b["Name"] for b in s3.list_buckets()["Buckets"]},
+        }
+
+        self.timings.build_seconds += time.perf_counter() - started
+        self.timings.builds += 1
+        return self
+
+    def checkout(self):
+        """Hand the baseline to a test"""
+        self.timings.reuses += 1
+        return self
+
+    def reset(self):
+        """Drop anything a test created and restore mutated baseline settings"""
+        started = time.perf_counter()
+        ec2 = self.backend.client("ec2")
+        s3 = self.backend.client("s3")
+
+        for bucket in s3.list_buckets()["Buckets"]:
+            if bucket["Name"] not in self._snapshot["buckets"]:
+                self._purge_bucket(s3, bucket["Name"])
+        self._empty_bucket(s3, self.bucket_name)
+        self._restore_bucket(s3)
+
+        for group in ec2.describe_security_groups()["SecurityGroups"]:
+            if group["GroupName"] == "default":
+                continue
+            if group["GroupId"] not in self._snapshot["security_groups"]:
+                ec2.delete_security_group(GroupId=group["GroupId"])
+        for subnet in ec2.describe_subnets()["Subnets"]:
+            if subnet["SubnetId"] not in self._snapshot["subnets"]:
+                ec2.delete_subnet(SubnetId=subnet["SubnetId"])
+        for vpc in ec2.describe_vpcs()["Vpcs"]:
+            if vpc["VpcId"] not in self._snapshot["vpcs"]:
+                ec2.delete_vpc(VpcId=vpc["VpcId"])
+
+        self._restore_ingress(ec2)
+        self._restore_tags(ec2)
+
+        self.timings.reset_seconds += time.perf_counter() - started
+
+    def _restore_tags(self, ec2):
+        for resource_id, tags in self.tags.items():
+            ec2.create_tags(Resources=[resource_id], Tags=_tag_list(tags))
+
+    def _restore_ingress(self, ec2):
+        group = ec2.describe_security_groups(GroupIds=[self.security_group_id])[
+            "SecurityGroups"
+        ][0]
+        current = group["IpPermissions"]
+        if _permission_key(current) == _permission_key(_ingress_permissions()):
+            return
+        if current:
+            ec2.revoke_security_group_ingress(
+                GroupId=self.security_group_id, IpPermissions=current
+            )
+        ec2.authorize_security_group_ingress(
+            GroupId=self.security_group_id, IpPermissions=_ingress_permissions()
+        )
+
+    def _restore_bucket(self, s3):
+        s3.put_bucket_versioning(
+            Bucket=self.bucket_name, VersioningConfiguration={"Status": "Enabled"}
+        )
+        s3.put_bucket_encryption(
+            Bucket=self.bucket_name,
+            ServerSideEncryptionConfiguration=SSE_CONFIGURATION,
+        )
+        s3.put_public_access_block(
+            Bucket=self.bucket_name,
+            PublicAccessBlockConfiguration=PUBLIC_ACCESS_BLOCK,
+        )
+
+    @staticmethod
+    def _empty_bucket(s3, bucket_name):
+        """Delete every object version and abort unfinished multipart uploads"""
+        paginator = s3.get_paginator("list_object_versions")
+        for page in paginator.paginate(Bucket=bucket_name):
+            for entry in page.get("Versions", []) + page.get("DeleteMarkers", []):
+                s3.delete_object(
+                    Bucket=bucket_name, Key=entry["Key"], VersionId=entry["VersionId"]
+                )
+        for upload in s3.list_multipart_uploads(Bucket=bucket_name).get("Uploads", []):
+            s3.abort_multipart_upload(
+                Bucket=bucket_name, Key=upload["Key"], UploadId=upload["UploadId"]
+            )
+
+    @classmethod
+    def _purge_bucket(cls, s3, bucket_name):
+        cls._empty_bucket(s3, bucket_name)
+        s3.delete_bucket(Bucket=bucket_name)
@@ -0,0 +1,275 @@
+"""
+Config model for the Ansible trees under test
+Loads the real site.yml, inventory, ansible.cfg, role tasks, handlers and
+templates once, using the libyaml loader and an on-disk parse cache keyed
+by mtime with a content-hash fallback
+"""
+
+import configparser
+import hashlib
+import os
+import pickle
+import re
+from pathlib import Path
+
+import yaml
+
+# C-accelerated loader when PyYAML was built against libyaml
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Bump when the parsed representation changes shape
+CACHE_VERSION = 1
+
+REPO_ROOT = Path(__file__).resolve().parents[3]
+
+# Project trees that carry an ansible/ directory with roles
+PROJECT_TREES = {
+    "bb-devops-portfolio": REPO_ROOT / "bb-devops-portfolio",
+    "bb-iac-integrated-pipeline": REPO_ROOT / "bb-iac-portfolio" / "bb-iac-integrated-pipeline",
+}
+
+
+def _parse_yaml(data):
+    return yaml.load(data, Loader=YamlLoader)
+
+
+def _parse_ini(data):
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.read_string(data.decode("utf-8"))
+    return {section: dict(parser.items(section)) for section in parser.sections()}
+
+
+def _parse_text(data):
+    return data.decode("utf-8")
+
+
+class ParseCache:
+    """Path -> parsed object cache persisted as a single pickle per tree"""
+
+    def __init__(self, cache_file=None):
+        self.cache_file = Path(cache_file) if cache_file else None
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+        if self.cache_file and self.cache_file.exists():
+            try:
+                with open(self.cache_file, "rb") as f:
+                    version, entries = pickle.load(f)
+                if version == CACHE_VERSION:
+                    self.entries = entries
+            except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+                self.entries = {}
+
+    def load(self, path, parser):
+        """Return the parsed content of path, parsing only when it changed"""
+        key = str(path)
+        stat = os.stat(path)
+        entry = self.entries.get(key)
+        if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            self.hits += 1
+            return entry["value"]
+
+        data = Path(path).read_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        if entry and entry["sha256"] == digest:
+            # Touched but unchanged - refresh the stat key only
+            self.hits += 1
+            value = entry["value"]
+        else:
+            self.misses += 1
+            value = parser(data)
+        self.entries[key] = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": digest,
+            "value": value,
+        }
+        self._dirty = True
+        return value
+
+    def save(self):
+        if not (self.cache_file and self._dirty):
+            return
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.cache_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump((CACHE_VERSION, self.entries), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.cache_file)
+        self._dirty = False
+
+
+class RoleConfig:
+    """Tasks, handlers, templates, defaults and static files of a single Ansible role"""
+
+    def __init__(self, name, tasks, handlers, templates, defaults=None, files=None):
+        self.name = name
+        self.tasks = tasks
+        self.handlers = handlers
+        self.templates = templates
+        self.defaults = defaults or {}
+        self.files = files or {}
+
+    def task(self, name):
+        return next((t for t in self.tasks if t.get("name") == name), None)
+
+    @property
+    def handler_names(self):
+        return [h["name"] for h in self.handlers]
+
+    @property
+    def notifications(self):
+        """Every handler name notified by the role's tasks"""
+        names = set()
+        for task in self.tasks:
+            notify = task.get("notify")
+            if isinstance(notify, str):
+                names.add(notify)
+            elif notify:
+                names.update(notify)
+        return names
+
+
+class ProjectConfig:
+    """Parsed ansible/ tree of one project"""
+
+    def __init__(self, name, root, cache):
+        self.name = name
+        self.root = Path(root)
+        self.ansible_dir = self.root / "ansible"
+        self._cache = cache
+
+        self.site = self._optional(self.ansible_dir / "site.yml", _parse_yaml)
+        self.inventory = self._optional(self.ansible_dir / "inventory" / "hosts.yml", _parse_yaml)
+        self.ansible_cfg = self._optional(self.ansible_dir / "ansible.cfg", _parse_ini)
+        self.roles = {}
+        roles_dir = self.ansible_dir / "roles"
+        if roles_dir.is_dir():
+            for role_dir in sorted(p for p in roles_dir.iterdir() if p.is_dir()):
+                self.roles[role_dir.name] = self._load_role(role_dir)
+
+    def _optional(self, path, parser, default=None):
+        if not path.is_file():
+            return default
+        return self._cache.load(path, parser)
+
+    def _load_role(self, role_dir):
+        templates = {}
+        templates_dir = role_dir / "templates"
+        if templates_dir.is_dir():
+            for template in sorted(templates_dir.iterdir()):
+                if template.is_file():
+                    templates[template.name] = self._cache.load(template, _parse_text)
+        files_dir = role_dir / "files"
+        files = {}
+        if files_dir.is_dir():
+            # Directories are keyed as copy tasks name them ("assets/")
+            files = {p.name + ("/" if p.is_dir() else ""): p for p in sorted(files_dir.iterdir())}
+        return RoleConfig(
+            role_dir.name,
+            tasks=self._optional(role_dir / "tasks" / "main.yml", _parse_yaml) or [],
+            handlers=self._optional(role_dir / "handlers" / "main.yml", _parse_yaml) or [],
+            templates=templates,
+            defaults=self._optional(role_dir / "defaults" / "main.yml", _parse_yaml) or {},
+            files=files,
+        )
+
+    @property
+    def play(self):
+        return self.site[0] if self.site else None
+
+    @property
+    def role_order(self):
+        if not self.play:
+            return []
+        return [r["role"] if isinstance(r, dict) else r for r in self.play.get("roles", [])]
+
+    @property
+    def handler_names(self):
+        names = set()
+        for role in self.roles.values():
+            names.update(role.handler_names)
+        if self.play:
+            names.update(h["name"] for h in self.play.get("handlers", []))
+        return names
+
+
+def load_projects(cache_dir=None):
+    """Load every available project tree, sharing one parse cache per tree"""
+    projects = {}
+    caches = []
+    for name, root in PROJECT_TREES.items():
+        if not (root / "ansible").is_dir():
+            continue
+        cache_file = Path(cache_dir) / f"{name}.pickle" if cache_dir else None
+        cache = ParseCache(cache_file)
+        projects[name] = ProjectConfig(name, root, cache)
+        caches.append(cache)
+    for cache in caches:
+        cache.save()
+    return projects
+
+
+# ---------------------------------------------------------------------------
+# Lightweight parsers for the non-YAML templates
+# ---------------------------------------------------------------------------
+
+_ADD_HEADER = re.compile(r'^\s*add_header\s+(\S+)\s+"([^"]*)"', re.MULTILINE)
+_LOCATION = re.compile(r"^\s*location\s+([^{]+?)\s*\{", re.MULTILINE)
+
+
+def parse_nginx_headers(text):
+    """Map of add_header name -> value"""
+    return dict(_ADD_HEADER.findall(text))
+
+
+def parse_nginx_directives(text, name):
+    """All values of a simple `name value;` directive"""
+    pattern = re.compile(rf"^\s*{re.escape(name)}\s+([^;]+);", re.MULTILINE)
+    return [value.strip() for value in pattern.findall(text)]
+
+
+def parse_nginx_locations(text):
+    """Map of location match -> body text of the block"""
+    locations = {}
+    for match in _LOCATION.finditer(text):
+        depth, start = 1, match.end()
+        pos = start
+        while depth and pos < len(text):
+            if text[pos] == "{":
+                depth += 1
+            elif text[pos] == "}":
+                depth -= 1
+            pos += 1
+        locations[match.group(1).strip()] = text[start:pos - 1]
+    return locations
+
+
+def parse_logrotate(text):
+    """Map of log path pattern -> directives for a logrotate config"""
+    stanzas = {}
+    current = None
+    in_script = False
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line or line.startswith("#"):
+            continue
+        if current is None:
+            if line.endswith("{"):
+                current = {}
+                stanzas[line[:-1].strip()] = current
+            continue
+        if in_script:
+            if line == "endscript":
+                in_script = False
+            continue
+        if line == "}":
+            current = None
+        elif line in ("prerotate", "postrotate", "firstaction", "lastaction"):
+            current[line] = True
+            in_script = True
+        else:
+            key, _, value = line.partition(" ")
+            value = value.strip()
+            current[key] = int(value) if value.isdigit() else (value or True)
+    return stanzas
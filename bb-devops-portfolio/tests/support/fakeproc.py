@@ -0,0 +1,46 @@
+"""
+Fake /proc tree and statvfs for the monitoring role's host probes
+The probes take proc_root and statvfs arguments, so the tests point them
+at a temporary directory instead of the machine running the suite
+"""
+
+import os
+
+# 4 KiB blocks, 1000 of them
+BLOCK_SIZE = 4096
+BLOCKS = 1000
+
+
+def fake_proc(root, meminfo=None, loadavg=None, processes=(), tcp=None, nginx_pid=None):
+    """Create root/proc with the given files and return its path
+
+    meminfo is {field: kB}; processes are (pid, ppid, comm) tuples, written
+    as <pid>/comm and <pid>/stat; tcp is a list of /proc/net/tcp st values;
+    nginx_pid writes root/nginx.pid next to the tree
+    """
+    proc = root / "proc"
+    proc.mkdir(parents=True)
+    if meminfo:
+        (proc / "meminfo").write_text("".join(f"{name}: {kb} kB\n" for name, kb in meminfo.items()))
+    if loadavg:
+        (proc / "loadavg").write_text(f"{loadavg}\n")
+    for pid, ppid, comm in processes:
+        (proc / str(pid)).mkdir()
+        (proc / str(pid) / "comm").write_text(f"{comm}\n")
+        (proc / str(pid) / "stat").write_text(f"{pid} ({comm}) S {ppid} {pid} {pid} 0 -1\n")
+    if tcp is not None:
+        (proc / "net").mkdir()
+        (proc / "net" / "tcp").write_text("  sl  local_address rem_address   st tx_queue rx_queue\n" + "".join(
+            f"   {i}: 0100007F:0050 0100007F:{i:04X} {state} 00000000:00000000\n" for i, state in enumerate(tcp)
+        ))
+    if nginx_pid is not None:
+        (root / "nginx.pid").write_text(f"{nginx_pid}\n")
+    return proc
+
+
+def fake_statvfs(used_blocks=500, reserved_blocks=0):
+    """statvfs stand-in for a BLOCKS-block filesystem; reserved blocks are free but not available"""
+    def statvfs(path):
+        free = BLOCKS - used_blocks
+        return os.statvfs_result((BLOCK_SIZE, BLOCK_SIZE, BLOCKS, free, free - reserved_blocks, 0, 0, 0, 0, 255))
+    return statvfs
@@ -0,0 +1,79 @@
+"""
+Pooled keep-alive HTTP client for integration tests
+One requests.Session per test session with per-host pool sizing and
+connection-reuse statistics read from the underlying urllib3 pools
+"""
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 10
+
+
+class PooledHttpClient:
+    """requests.Session wrapper that keeps connections warm across tests"""
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, host_pool_sizes=None, timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._adapters = []
+        self._closed_stats = {}
+        self._mount("http://", pool_size)
+        self._mount("https://", pool_size)
+        for origin, size in (host_pool_sizes or {}).items():
+            self.size_pool(origin, size)
+
+    def _mount(self, prefix, size):
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=size)
+        self.session.mount(prefix, adapter)
+        self._adapters.append(adapter)
+        return adapter
+
+    def size_pool(self, url, size):
+        """Give one host (scheme://host[:port]) its own pool of `size` connections"""
+        parsed = urlparse(url)
+        self._mount(f"{parsed.scheme}://{parsed.netloc}", size)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def stats(self):
+        """Per-origin request/connection counts and reuse ratio"""
+        totals = {origin: dict(counts) for origin, counts in self._closed_stats.items()}
+        for adapter in self._adapters:
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                origin = f"{pool.scheme}://{pool.host}:{pool.port}"
+                counts = totals.setdefault(origin, {"requests": 0, "connections": 0})
+                counts["requests"] += pool.num_requests
+                counts["connections"] += pool.num_connections
+        for counts in totals.values():
+            requests_made = counts["requests"]
+            reused = max(requests_made - counts["connections"], 0)
+            counts["reuse_ratio"] = reused / requests_made if requests_made else 0.0
+        return totals
+
+    def summary(self):
+        lines = []
+        for origin, counts in sorted(self.stats().items()):
+            lines.append(
+                f"http pool: {origin} {counts['requests']} request(s) over "
+                f"{counts['connections']} connection(s), {counts['reuse_ratio']:.0%} reused"
+            )
+        return lines
+
+    def close(self):
+        self._closed_stats = self.stats()
+        self.session.close()
@@ -0,0 +1,398 @@
+"""
+Built-in load harness for the nginx web server
+Async HTTP/1.1 client (plain or TLS) with keep-alive connection reuse,
+closed-loop (concurrency) or open-loop (arrival rate) load, per-endpoint
+latency histograms, JSON results and SLO checks, plus a TLS handshake
+probe comparing full and resumed handshakes
+"""
+
+import asyncio
+import itertools
+import json
+import socket
+import ssl
+import time
+from urllib.parse import urlparse
+
+from support.scripts import PROJECT_ROOT, load_module
+
+# Same histogram the monitoring role reports access log percentiles with
+LatencyHistogram = load_module(
+    PROJECT_ROOT / "ansible" / "roles" / "monitoring" / "files" / "nginx_log_stats.py"
+).LatencyHistogram
+
+DEFAULT_ENDPOINTS = ("/", "/health", "/monitoring.html")
+
+
+class EndpointStats:
+    """Counters and latency histogram for one endpoint"""
+
+    def __init__(self, path):
+        self.path = path
+        self.latency = LatencyHistogram()
+        self.requests = 0
+        self.errors = 0
+        self.statuses = {}
+
+    def record(self, seconds, status=None, ok=True):
+        self.requests += 1
+        if status is not None:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+        if ok:
+            self.latency.record(seconds)
+        else:
+            self.errors += 1
+
+    @property
+    def error_rate(self):
+        return self.errors / self.requests if self.requests else 0.0
+
+    def as_dict(self, elapsed):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": round(self.error_rate, 6),
+            "throughput_rps": round(self.requests / elapsed, 2) if elapsed else 0.0,
+            "statuses": {str(k): v for k, v in sorted(self.statuses.items())},
+            "latency_ms": {
+                "p50": round(self.latency.percentile(50) * 1000, 3),
+                "p90": round(self.latency.percentile(90) * 1000, 3),
+                "p99": round(self.latency.percentile(99) * 1000, 3),
+                "max": round(self.latency.max * 1000, 3),
+                "mean": round(self.latency.mean * 1000, 3),
+            },
+        }
+
+
+def client_context(verify=False):
+    """TLS client context; unverified by default for self-signed test certificates"""
+    context = ssl.create_default_context()
+    if not verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    context.set_alpn_protocols(["http/1.1"])
+    return context
+
+
+class KeepAliveConnection:
+    """Single persistent HTTP/1.1 connection"""
+
+    def __init__(self, host, port, timeout, ssl_context=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self.reader = None
+        self.writer = None
+        self.opened = 0
+        self.requests = 0
+
+    async def _connect(self):
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self.ssl_context), self.timeout
+        )
+        self.opened += 1
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def request(self, method, path):
+        """Send one request and return (status, body_bytes)"""
+        if self.writer is None:
+            await self._connect()
+        self.requests += 1
+        self.writer.write(
+            f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+            f"User-Agent: bb-loadgen\r\nConnection: keep-alive\r\n\r\n".encode("ascii")
+        )
+        try:
+            return await asyncio.wait_for(self._read_response(method), self.timeout)
+        except BaseException:
+            self.close()
+            raise
+
+    async def _read_response(self, method):
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed by server")
+        parts = status_line.split()
+        status = int(parts[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            body = b""
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            body = await self._read_chunked()
+        elif "content-length" in headers:
+            body = await self.reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await self.reader.read()
+            headers["connection"] = "close"
+
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, body
+
+    async def _read_chunked(self):
+        chunks = []
+        while True:
+            size = int((await self.reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                await self.reader.readline()
+                return b"".join(chunks)
+            chunks.append(await self.reader.readexactly(size))
+            await self.reader.readline()
+
+
+class LoadProfile:
+    """What load to generate
+
+    concurrency -- number of connections/workers
+    duration    -- seconds to generate load for
+    rate        -- total requests per second (open loop); None runs
+                   closed loop with each worker sending back-to-back
+    """
+
+    def __init__(self, endpoints=DEFAULT_ENDPOINTS, concurrency=10, duration=10.0,
+                 rate=None, timeout=10.0, method="GET"):
+        self.endpoints = list(endpoints)
+        self.concurrency = concurrency
+        self.duration = duration
+        self.rate = rate
+        self.timeout = timeout
+        self.method = method
+
+    def as_dict(self):
+        return {
+            "endpoints": self.endpoints,
+            "concurrency": self.concurrency,
+            "duration": self.duration,
+            "rate": self.rate,
+            "timeout": self.timeout,
+        }
+
+
+class LoadResult:
+    """Outcome of one load run"""
+
+    def __init__(self, target, profile, stats, elapsed, connections):
+        self.target = target
+        self.profile = profile
+        self.stats = stats
+        self.elapsed = elapsed
+        self.connections = connections
+
+    @property
+    def requests(self):
+        return sum(s.requests for s in self.stats.values())
+
+    @property
+    def errors(self):
+        return sum(s.errors for s in self.stats.values())
+
+    @property
+    def throughput(self):
+        return self.requests / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            "target": self.target,
+            "profile": self.profile.as_dict(),
+            "elapsed_seconds": round(self.elapsed, 3),
+            "requests": self.requests,
+            "errors": self.errors,
+            "throughput_rps": round(self.throughput, 2),
+            "connections_opened": self.connections,
+            "endpoints": {path: s.as_dict(self.elapsed) for path, s in self.stats.items()},
+        }
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+    def slo_violations(self, p99_ms=None, error_rate=None, min_rps=None):
+        """Human-readable list of SLO breaches (empty when all are met)"""
+        violations = []
+        for path, s in self.stats.items():
+            p99 = s.latency.percentile(99) * 1000
+            if p99_ms is not None and p99 > p99_ms:
+                violations.append(f"{path}: p99 {p99:.1f}ms > {p99_ms}ms")
+            if error_rate is not None and s.error_rate > error_rate:
+                violations.append(f"{path}: error rate {s.error_rate:.2%} > {error_rate:.2%}")
+        if min_rps is not None and self.throughput < min_rps:
+            violations.append(f"throughput {self.throughput:.1f} rps < {min_rps} rps")
+        return violations
+
+
+async def run_load_async(url, profile):
+    parsed = urlparse(url)
+    host = parsed.hostname
+    secure = parsed.scheme == "https"
+    port = parsed.port or (443 if secure else 80)
+    base = parsed.path.rstrip("/")
+    stats = {path: EndpointStats(path) for path in profile.endpoints}
+    # One context for all connections. A client context keeps no session
+    # cache and asyncio cannot offer a session, so each connection makes a
+    # full handshake once; keep-alive then reuses it (see measure_handshakes
+    # for resumption)
+    context = client_context() if secure else None
+    connections = [KeepAliveConnection(host, port, profile.timeout, context)
+                   for _ in range(profile.concurrency)]
+    started = time.monotonic()
+    stop_at = started + profile.duration
+    sequence = itertools.count()
+
+    async def fire(connection, scheduled):
+        path = profile.endpoints[next(sequence) % len(profile.endpoints)]
+        try:
+            status, _ = await connection.request(profile.method, base + path)
+        except (OSError, asyncio.TimeoutError, ConnectionError, ValueError, IndexError,
+                asyncio.IncompleteReadError):
+            stats[path].record(time.monotonic() - scheduled, ok=False)
+            return
+        # Latency is measured from the scheduled start to avoid coordinated omission
+        stats[path].record(time.monotonic() - scheduled, status, ok=status < 400)
+
+    async def closed_loop(connection):
+        while time.monotonic() < stop_at:
+            await fire(connection, time.monotonic())
+
+    async def open_loop(connection, queue):
+        while True:
+            scheduled = await queue.get()
+            if scheduled is None:
+                return
+            await fire(connection, scheduled)
+
+    if profile.rate:
+        queue = asyncio.Queue()
+        workers = [asyncio.create_task(open_loop(c, queue)) for c in connections]
+        interval = 1.0 / profile.rate
+        next_at = started
+        while next_at < stop_at:
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            queue.put_nowait(next_at)
+            next_at += interval
+        for _ in workers:
+            queue.put_nowait(None)
+        await asyncio.gather(*workers)
+    else:
+        await asyncio.gather(*(closed_loop(c) for c in connections))
+
+    elapsed = time.monotonic() - started
+    for connection in connections:
+        connection.close()
+    return LoadResult(url, profile, stats, elapsed, sum(c.opened for c in connections))
+
+
+def run_load(url, profile):
+    """Blocking wrapper around run_load_async"""
+    return asyncio.run(run_load_async(url, profile))
+
+
+class HandshakeResult:
+    """Full and resumed TLS handshake latency against one target"""
+
+    def __init__(self, target):
+        self.target = target
+        self.full = LatencyHistogram()
+        self.resumed = LatencyHistogram()
+        self.resume_attempts = 0
+        self.resume_misses = 0
+        self.protocol = None
+        self.cipher = None
+
+    @property
+    def resumption_rate(self):
+        return (self.resume_attempts - self.resume_misses) / self.resume_attempts if self.resume_attempts else 0.0
+
+    def as_dict(self):
+        def summary(histogram):
+            return {
+                "count": histogram.count,
+                "p50_ms": round(histogram.percentile(50) * 1000, 3),
+                "p99_ms": round(histogram.percentile(99) * 1000, 3),
+                "mean_ms": round(histogram.mean * 1000, 3),
+            }
+
+        full, resumed = summary(self.full), summary(self.resumed)
+        return {
+            "target": self.target,
+            "protocol": self.protocol,
+            "cipher": self.cipher,
+            "full": full,
+            "resumed": resumed,
+            "resumption_rate": round(self.resumption_rate, 4),
+            "saved_ms_per_resumption": round(full["mean_ms"] - resumed["mean_ms"], 3),
+        }
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+
+def _handshake(host, port, context, timeout, session=None):
+    """(seconds, reused, tls socket) for one TCP connect plus TLS handshake"""
+    started = time.perf_counter()
+    raw = socket.create_connection((host, port), timeout)
+    tls = context.wrap_socket(raw, server_hostname=host, session=session, do_handshake_on_connect=False)
+    try:
+        tls.do_handshake()
+    except BaseException:
+        tls.close()
+        raise
+    return time.perf_counter() - started, tls.session_reused, tls
+
+
+def _fetch_session(tls, host):
+    """Send one request so TLS 1.3 session tickets (post-handshake) arrive"""
+    tls.sendall(f"HEAD / HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode("ascii"))
+    response = b""
+    try:
+        while b"\r\n\r\n" not in response:
+            chunk = tls.recv(65536)
+            if not chunk:
+                break
+            response += chunk
+    except ssl.SSLEOFError:
+        # Peer closed without close_notify; the tickets were read before the response
+        pass
+    return tls.session
+
+
+def measure_handshakes(url, rounds=50, timeout=10.0, context=None):
+    """Alternate fresh and resumed handshakes; each pair reuses the session of its full one
+
+    Each full handshake uses a new client context, so nothing is cached on
+    the client side; the resumed one offers that connection's session
+    """
+    parsed = urlparse(url)
+    host = parsed.hostname
+    port = parsed.port or 443
+    result = HandshakeResult(url)
+    for _ in range(rounds):
+        full_context = context or client_context()
+        seconds, _, tls = _handshake(host, port, full_context, timeout)
+        result.full.record(seconds)
+        result.protocol, result.cipher = tls.version(), tls.cipher()[0]
+        with tls:
+            session = _fetch_session(tls, host)
+        result.resume_attempts += 1
+        seconds, reused, tls = _handshake(host, port, full_context, timeout, session=session)
+        tls.close()
+        if reused:
+            result.resumed.record(seconds)
+        else:
+            result.resume_misses += 1
+            result.full.record(seconds)
+    return result
@@ -0,0 +1,619 @@
+"""
+Local stand-in for the deployed web server
+Renders the nginx role templates and every web-root file the playbook
+deploys with the inventory vars, then serves them on 127.0.0.1 from a
+local nginx when one is installed, or from a Python server that follows
+the same location rules and headers. When the site terminates TLS, both
+also listen for HTTPS with a throwaway self-signed certificate
+"""
+
+import importlib.util
+import json
+import mimetypes
+import os
+import re
+import shutil
+import socket
+import ssl
+import subprocess
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+
+import jinja2
+
+from support.config_model import (
+    PROJECT_TREES,
+    ParseCache,
+    ProjectConfig,
+    parse_nginx_directives,
+)
+
+PROJECT_NAME = "bb-devops-portfolio"
+DOCUMENT_ROOT = "/var/www/html"
+SECURITY_HEADERS_PATH = "/etc/nginx/conf.d/security-headers.conf"
+SITE_CONF_PATH = "/etc/nginx/sites-available/default"
+
+# Quoted or bare add_header values (add_header Content-Type text/plain;)
+_ADD_HEADER = re.compile(r'^\s*add_header\s+(\S+)\s+(?:"([^"]*)"|([^\s;]+))', re.MULTILINE)
+
+
+def _headers(text):
+    return {name: quoted or bare for name, quoted, bare in _ADD_HEADER.findall(text)}
+
+
+def _local_facts():
+    """Minimal stand-ins for the Ansible facts the templates reference"""
+    now = datetime.now(timezone.utc)
+    return {
+        "ansible_hostname": socket.gethostname().split(".")[0],
+        "ansible_host": "127.0.0.1",
+        "inventory_hostname": "local",
+        "ansible_date_time": {"iso8601": now.strftime("%Y-%m-%dT%H:%M:%SZ")},
+        "ansible_distribution": "Ubuntu",
+        "ansible_distribution_version": "22.04",
+        "ansible_architecture": os.uname().machine,
+        "ansible_processor_vcpus": os.cpu_count() or 1,
+        "ansible_memtotal_mb": 1024,
+        "ansible_uptime_seconds": 0,
+        "ansible_default_ipv4": {"address": "127.0.0.1"},
+        "ansible_mounts": [{"size_total": shutil.disk_usage("/").total}],
+        "ansible_os_family": "Debian",
+    }
+
+
+def template_vars(project):
+    """Role defaults, inventory group vars, play vars and local facts, as Ansible would merge them"""
+    variables = {}
+    # Role defaults have the lowest precedence of all
+    for role in project.roles.values():
+        variables.update(role.defaults)
+    variables.update(_local_facts())
+    inventory = project.inventory or {}
+    group_all = inventory.get("all", {})
+    variables.update(group_all.get("vars") or {})
+    web = (group_all.get("children") or {}).get("web", {})
+    variables.update(web.get("vars") or {})
+    if project.play:
+        variables.update(project.play.get("vars") or {})
+    return variables
+
+
+def _render(source, variables):
+    env = jinja2.Environment(undefined=jinja2.Undefined, keep_trailing_newline=True)
+    return env.from_string(source).render(**variables)
+
+
+def _deploy_tasks(project):
+    """(role, task) for every template/copy task in roles and play post_tasks"""
+    for role_name in project.role_order or project.roles:
+        role = project.roles.get(role_name)
+        if role:
+            for task in role.tasks:
+                yield role, task
+    if project.play:
+        for task in project.play.get("post_tasks", []):
+            yield None, task
+
+
+def _nginx_tool(project, name):
+    nginx = project.roles.get("nginx")
+    tool = nginx.files.get(f"{name}.py") if nginx else None
+    if tool is None:
+        return None
+    spec = importlib.util.spec_from_file_location(name, tool)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _publish_assets(project, workdir, web_root, variables):
+    """Publish every role's files/assets bundle, as the roles' fingerprint tasks do"""
+    fingerprint = _nginx_tool(project, "fingerprint")
+    urls = {}
+    if fingerprint is None:
+        return urls
+    document_root = variables.get("document_root", DOCUMENT_ROOT).rstrip("/")
+    assets_dir = web_root / variables.get("nginx_assets_dir", "")[len(document_root) + 1:]
+    for role_name in project.role_order or project.roles:
+        source = project.ansible_dir / "roles" / role_name / "files" / "assets"
+        if source.is_dir():
+            urls.update(fingerprint.publish(str(source), str(assets_dir), role_name,
+                                            str(workdir / "assets.json")))
+    return urls
+
+
+def _precompress(project, web_root, variables):
+    """Run the role's precompressor over the web root, as the nginx role's handler does"""
+    precompress = _nginx_tool(project, "precompress")
+    if precompress is None:
+        return
+    precompress.precompress(str(web_root), set(variables.get("nginx_precompress_exclude", ())))
+
+
+def _self_signed_certificate(workdir, site_conf):
+    """Stand-in for the role's generated certificate; None without TLS or openssl"""
+    certificates = parse_nginx_directives(site_conf, "ssl_certificate")
+    keys = parse_nginx_directives(site_conf, "ssl_certificate_key")
+    openssl = shutil.which("openssl")
+    if not (certificates and keys and openssl):
+        return None
+    tls_dir = workdir / "tls"
+    tls_dir.mkdir(parents=True, exist_ok=True)
+    certificate, key = tls_dir / "server.crt", tls_dir / "server.key"
+    subprocess.run(
+        [openssl, "req", "-x509", "-nodes", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+         "-days", "1", "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+         "-keyout", str(key), "-out", str(certificate)],
+        check=True, capture_output=True,
+    )
+    return {
+        "certificate": certificate,
+        "key": key,
+        "conf_certificate": certificates[0],
+        "conf_key": keys[0],
+        "session_tickets": parse_nginx_directives(site_conf, "ssl_session_tickets") != ["off"],
+    }
+
+
+def render_site(workdir, project=None):
+    """Render config and web root into workdir; return the rendered paths"""
+    if project is None:
+        project = ProjectConfig(PROJECT_NAME, PROJECT_TREES[PROJECT_NAME], ParseCache())
+    workdir = Path(workdir)
+    variables = template_vars(project)
+    document_root = variables.get("document_root", DOCUMENT_ROOT)
+    web_root = workdir / "html"
+    web_root.mkdir(parents=True, exist_ok=True)
+    variables["asset_urls"] = _publish_assets(project, workdir, web_root, variables)
+    rendered = {}
+
+    for role, task in _deploy_tasks(project):
+        if "template" in task:
+            src = task["template"]["src"]
+            templates = role.templates if role else {}
+            if src not in templates:
+                # Play-level template paths are resolved by Ansible, not the roles
+                continue
+            content = _render(templates[src], variables)
+            dest = task["template"]["dest"]
+        elif "copy" in task and "content" in task["copy"]:
+            content = _render(task["copy"]["content"], variables)
+            dest = task["copy"]["dest"]
+        else:
+            continue
+        rendered[dest] = content
+
+    for dest, content in rendered.items():
+        if dest.startswith(document_root.rstrip("/") + "/"):
+            target = web_root / dest[len(document_root.rstrip("/")) + 1:]
+        else:
+            target = workdir / "conf" / dest.lstrip("/")
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_text(content)
+
+    # health_check.py writes /health on the host; the stand-in plays a healthy one
+    health = variables.get("health_status_file", f"{document_root}/health")
+    health_file = web_root / health[len(document_root.rstrip("/")) + 1:]
+    health_file.write_text(json.dumps({
+        "status": "healthy",
+        "timestamp": variables["ansible_date_time"]["iso8601"],
+        "version": variables.get("app_version", "unknown"),
+        "server": variables["inventory_hostname"],
+        "checks": {},
+    }) + "\n")
+
+    _precompress(project, web_root, variables)
+
+    site_conf = rendered.get(SITE_CONF_PATH, "")
+    headers_conf = rendered.get(SECURITY_HEADERS_PATH, "")
+    return {
+        "web_root": web_root,
+        "site_conf": site_conf,
+        "headers_conf": headers_conf,
+        "document_root": document_root,
+        "tls": _self_signed_certificate(workdir, site_conf),
+    }
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _localise_site_conf(site_conf, port, web_root, headers_path, document_root, tls_port=None, tls=None):
+    # Keep the TLS listen parameters (ssl, http2) for the loopback HTTPS port
+    tls_listen = re.search(r"^\s*listen\s+\d+\s+(ssl\b[^;]*);", site_conf, re.MULTILINE)
+    conf = re.sub(r"^\s*listen\s+[^;]+;\s*$", "", site_conf, flags=re.MULTILINE)
+    listen = f"    listen 127.0.0.1:{port} default_server;"
+    if tls and tls_port and tls_listen:
+        parameters = " ".join(p for p in tls_listen.group(1).split() if p != "default_server")
+        listen += f"\n    listen 127.0.0.1:{tls_port} {parameters} default_server;"
+        conf = conf.replace(tls["conf_certificate"] + ";", f"{tls['certificate']};")
+        conf = conf.replace(tls["conf_key"] + ";", f"{tls['key']};")
+    conf = conf.replace("server {", f"server {{\n{listen}", 1)
+    conf = conf.replace(SECURITY_HEADERS_PATH, str(headers_path))
+    conf = conf.replace("/var/log/nginx/", f"{headers_path.parent}/logs/")
+    return conf.replace(document_root, str(web_root))
+
+
+class NginxTarget:
+    """Real nginx process serving the rendered config from a private prefix"""
+
+    def __init__(self, workdir, site, nginx_binary):
+        self.workdir = Path(workdir)
+        self.site = site
+        self.binary = nginx_binary
+        self.port = _free_port()
+        self.tls_port = _free_port() if site.get("tls") else None
+        self.process = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def tls_url(self):
+        return f"https://127.0.0.1:{self.tls_port}" if self.tls_port else None
+
+    def start(self):
+        prefix = self.workdir / "nginx"
+        for name in ("logs", "tmp"):
+            (prefix / name).mkdir(parents=True, exist_ok=True)
+        headers_path = prefix / "security-headers.conf"
+        headers_path.write_text(self.site["headers_conf"])
+        server = _localise_site_conf(
+            self.site["site_conf"], self.port, self.site["web_root"], headers_path,
+            self.site["document_root"], self.tls_port, self.site.get("tls"),
+        )
+        (prefix / "nginx.conf").write_text(f"""
+daemon off;
+worker_processes 1;
+pid {prefix}/nginx.pid;
+error_log {prefix}/logs/error.log warn;
+events {{ worker_connections 256; }}
+http {{
+    types {{
+        text/html html htm;
+        text/css css;
+        application/javascript js;
+        application/json json;
+        image/png png;
+        image/jpeg jpg jpeg;
+        image/gif gif;
+        image/x-icon ico;
+        text/plain txt;
+    }}
+    default_type application/octet-stream;
+    access_log {prefix}/logs/access.log;
+    client_body_temp_path {prefix}/tmp/body;
+    proxy_temp_path {prefix}/tmp/proxy;
+    fastcgi_temp_path {prefix}/tmp/fastcgi;
+    uwsgi_temp_path {prefix}/tmp/uwsgi;
+    scgi_temp_path {prefix}/tmp/scgi;
+{server}
+}}
+""")
+        self.process = subprocess.Popen(
+            [self.binary, "-p", str(prefix), "-c", str(prefix / "nginx.conf")],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        )
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"nginx exited: {self.process.stderr.read().decode()}")
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=0.2).close()
+                return self
+            except OSError:
+                time.sleep(0.05)
+        self.stop()
+        raise RuntimeError("nginx did not start listening within 10s")
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait(timeout=10)
+
+
+class _Location:
+    def __init__(self, modifier, pattern, body):
+        self.modifier = modifier
+        self.pattern = pattern
+        self.body = body
+        self.headers = _headers(body)
+        self.deny = "deny all" in body
+        returns = re.search(r'^\s*return\s+(\d+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*;', body, re.MULTILINE)
+        self.return_status = int(returns.group(1)) if returns else None
+        self.return_body = (
+            returns.group(2).encode().decode("unicode_escape") if returns and returns.group(2) else ""
+        )
+        expires = parse_nginx_directives(body, "expires")
+        self.max_age = _seconds(expires[0]) if expires else None
+        roots = parse_nginx_directives(body, "root")
+        self.root = roots[0] if roots else None
+        gzip_static = parse_nginx_directives(body, "gzip_static")
+        self.gzip_static = gzip_static[0] == "on" if gzip_static else None
+        default_types = parse_nginx_directives(body, "default_type")
+        self.default_type = default_types[0] if default_types else None
+        self.internal = bool(re.search(r"^\s*internal\s*;", body, re.MULTILINE))
+        # try_files ... =503: the status when no candidate exists (404 otherwise)
+        try_files = parse_nginx_directives(body, "try_files")
+        fallback = re.search(r"=(\d+)$", try_files[0]) if try_files else None
+        self.missing_status = int(fallback.group(1)) if fallback else 404
+        self.error_pages = {}
+        for value in parse_nginx_directives(body, "error_page"):
+            *codes, uri = value.split()
+            self.error_pages.update((int(code), uri) for code in codes if code.isdigit())
+        self.regex = None
+        if modifier in ("~", "~*"):
+            self.regex = re.compile(pattern, re.IGNORECASE if modifier == "~*" else 0)
+
+    def matches_prefix(self, path):
+        if self.modifier == "=":
+            return path == self.pattern
+        return self.modifier in ("", "^~") and path.startswith(self.pattern)
+
+
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800, "M": 2592000, "y": 31536000}
+
+
+def _seconds(value):
+    """nginx time value ("5s", "1y", "30") in seconds"""
+    match = re.fullmatch(r"(\d+)([smhdwMy]?)", value)
+    return int(match.group(1)) * _UNITS.get(match.group(2) or "s", 1) if match else None
+
+
+def _server_body(site_conf):
+    start = site_conf.index("server {") + len("server {")
+    depth, pos = 1, start
+    while depth:
+        if site_conf[pos] == "{":
+            depth += 1
+        elif site_conf[pos] == "}":
+            depth -= 1
+        pos += 1
+    return site_conf[start:pos - 1]
+
+
+def _split_locations(server_body):
+    """(modifier, pattern, body) for each location plus server-level text"""
+    locations = []
+    outside = []
+    pos = 0
+    pattern = re.compile(r"^\s*location\s+(=|~\*|~|\^~)?\s*(\S+)\s*\{", re.MULTILINE)
+    while True:
+        match = pattern.search(server_body, pos)
+        if not match:
+            outside.append(server_body[pos:])
+            break
+        outside.append(server_body[pos:match.start()])
+        depth, end = 1, match.end()
+        while depth:
+            if server_body[end] == "{":
+                depth += 1
+            elif server_body[end] == "}":
+                depth -= 1
+            end += 1
+        locations.append(_Location(match.group(1) or "", match.group(2), server_body[match.end():end - 1]))
+        pos = end
+    return locations, "".join(outside)
+
+
+class NginxRules:
+    """The subset of nginx location semantics the site config relies on"""
+
+    def __init__(self, site_conf, headers_conf, web_root, document_root):
+        body = _server_body(site_conf)
+        self.locations, server_level = _split_locations(body)
+        self.web_root = Path(web_root)
+        self.document_root = document_root
+        self.server_headers = _headers(headers_conf)
+        self.server_headers.update(_headers(server_level))
+        self.hide_version = parse_nginx_directives(headers_conf + server_level, "server_tokens") == ["off"]
+        self.index = (parse_nginx_directives(server_level, "index") or ["index.html"])[0].split()
+        self.gzip_static = parse_nginx_directives(server_level, "gzip_static") == ["on"]
+        self.gzip_vary = parse_nginx_directives(server_level, "gzip_vary") == ["on"]
+
+    def match(self, path):
+        """nginx order: exact, longest prefix, then first regex unless ^~"""
+        exact = [loc for loc in self.locations if loc.modifier == "=" and loc.pattern == path]
+        if exact:
+            return exact[0]
+        prefixes = sorted((loc for loc in self.locations if loc.matches_prefix(path)),
+                          key=lambda loc: len(loc.pattern), reverse=True)
+        best = prefixes[0] if prefixes else None
+        if best is None or best.modifier != "^~":
+            for loc in self.locations:
+                if loc.regex and loc.regex.search(path):
+                    return loc
+        return best
+
+    def headers_for(self, location):
+        # add_header in a location replaces, not extends, the server-level set
+        if location and location.headers:
+            headers = dict(location.headers)
+        else:
+            headers = dict(self.server_headers)
+        # expires is not add_header: it never drops the inherited set
+        if location and location.max_age is not None:
+            added = headers.get("Cache-Control")
+            headers["Cache-Control"] = f"max-age={location.max_age}" + (f", {added}" if added else "")
+        return headers
+
+    def precompressed(self, location, file_path):
+        """The stored .gz variant gzip_static considers for file_path, if any"""
+        enabled = location.gzip_static if location and location.gzip_static is not None else self.gzip_static
+        if not enabled:
+            return None
+        variant = file_path.with_name(file_path.name + ".gz")
+        return variant if variant.is_file() else None
+
+    def content_type(self, location, file_path):
+        guessed = mimetypes.guess_type(file_path.name)[0]
+        return guessed or (location and location.default_type) or "application/octet-stream"
+
+    def resolve_file(self, location, path):
+        root = Path(location.root.replace(self.document_root, str(self.web_root))) \
+            if location and location.root else self.web_root
+        candidate = (root / path.lstrip("/")).resolve()
+        if root.resolve() not in candidate.parents and candidate != root.resolve():
+            return None
+        if candidate.is_dir():
+            for name in self.index:
+                if (candidate / name).is_file():
+                    return candidate / name
+            return None
+        return candidate if candidate.is_file() else None
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    rules = None
+
+    def version_string(self):
+        return "nginx" if self.rules.hide_version else "nginx/1.24.0"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type, headers):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            if name.lower() == "content-type":
+                continue
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _error(self, status, headers):
+        body = f"<html><head><title>{status}</title></head><body>" \
+               f"<center><h1>{status}</h1></center><hr><center>nginx</center></body></html>\n".encode()
+        self._send(status, body, "text/html", headers)
+
+    def _serve(self):
+        path = unquote(urlparse(self.path).path)
+        location = self.rules.match(path)
+        headers = self.rules.headers_for(location)
+        if location and location.deny:
+            return self._error(403, headers)
+        if location and location.return_status:
+            content_type = location.headers.get("Content-Type", "application/octet-stream")
+            return self._send(location.return_status, location.return_body.encode(), content_type, headers)
+        if self.command not in ("GET", "HEAD"):
+            return self._error(405, headers)
+        file_path = None if location and location.internal else self.rules.resolve_file(location, path)
+        if file_path is None:
+            status = location.missing_status if location else 404
+            page = location.error_pages.get(status) if location else None
+            if page:
+                # error_page: internal redirect that keeps the status code
+                page_location = self.rules.match(page)
+                page_file = self.rules.resolve_file(page_location, page)
+                if page_file is not None:
+                    return self._send(status, page_file.read_bytes(),
+                                      self.rules.content_type(page_location, page_file),
+                                      self.rules.headers_for(page_location))
+            return self._error(status, headers)
+        content_type = self.rules.content_type(location, file_path)
+        variant = self.rules.precompressed(location, file_path)
+        if variant is not None:
+            if self.rules.gzip_vary:
+                headers = dict(headers, Vary="Accept-Encoding")
+            if "gzip" in self.headers.get("Accept-Encoding", ""):
+                headers["Content-Encoding"] = "gzip"
+                file_path = variant
+        self._send(200, file_path.read_bytes(), content_type, headers)
+
+    def handle_one_request(self):
+        # Accept any method token, as nginx does, and answer per location rules
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+            if not self.raw_requestline:
+                self.close_connection = True
+                return
+            if not self.parse_request():
+                return
+            self._serve()
+            self.wfile.flush()
+        except (ConnectionError, TimeoutError):
+            self.close_connection = True
+
+
+class _TLSServer(ThreadingHTTPServer):
+    """HTTPS listener; the handshake runs in the connection's thread, not the accept loop"""
+
+    def __init__(self, address, handler, context):
+        super().__init__(address, handler)
+        self.context = context
+
+    def get_request(self):
+        sock, address = super().get_request()
+        return self.context.wrap_socket(sock, server_side=True, do_handshake_on_connect=False), address
+
+    def finish_request(self, request, client_address):
+        try:
+            request.do_handshake()
+        except (ssl.SSLError, OSError):
+            return
+        super().finish_request(request, client_address)
+
+
+def _server_context(tls):
+    """TLS 1.2+ with the session cache and tickets nginx would use; ALPN http/1.1 only"""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(tls["certificate"], tls["key"])
+    context.set_alpn_protocols(["http/1.1"])
+    if not tls["session_tickets"]:
+        context.options |= ssl.OP_NO_TICKET
+    return context
+
+
+class StandInTarget:
+    """Pure-Python server reproducing the rendered nginx routes and headers"""
+
+    def __init__(self, site):
+        self.site = site
+        self.servers = []
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.servers[0].server_port}"
+
+    @property
+    def tls_url(self):
+        return f"https://127.0.0.1:{self.servers[1].server_port}" if len(self.servers) > 1 else None
+
+    def start(self):
+        rules = NginxRules(self.site["site_conf"], self.site["headers_conf"],
+                           self.site["web_root"], self.site["document_root"])
+        handler = type("StandInHandler", (_StandInHandler,), {"rules": rules})
+        self.servers = [ThreadingHTTPServer(("127.0.0.1", 0), handler)]
+        if self.site.get("tls"):
+            self.servers.append(_TLSServer(("127.0.0.1", 0), handler, _server_context(self.site["tls"])))
+        for server in self.servers:
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+
+def start_local_target(workdir, prefer_nginx=True, project=None):
+    """Render the site and start nginx if available, else the Python stand-in"""
+    site = render_site(workdir, project)
+    nginx = shutil.which("nginx") if prefer_nginx else None
+    if nginx:
+        return NginxTarget(workdir, site, nginx).start()
+    return StandInTarget(site).start()
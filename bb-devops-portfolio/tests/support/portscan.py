@@ -0,0 +1,127 @@
+"""
+Concurrent port-exposure scanner
+Checks a port list across many hosts in parallel under a global
+concurrency cap and compares what it finds with the ingress rules of
+aws_security_group.web in terraform/main.tf
+"""
+
+import asyncio
+import errno
+import re
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+MAIN_TF = PROJECT_ROOT / "terraform" / "main.tf"
+
+OPEN = "open"
+CLOSED = "closed"
+FILTERED = "filtered"
+
+# Ports that must never be reachable on the web server
+INSECURE_PORTS = [21, 23, 135, 139, 445, 1433, 3389]
+
+_SECURITY_GROUP = re.compile(r'resource\s+"aws_security_group"\s+"(\w+)"\s*\{')
+_INGRESS = re.compile(r"\bingress\s*\{([^}]*)\}", re.DOTALL)
+_ATTRIBUTE = re.compile(r'^\s*(\w+)\s*=\s*"?([^"\n]+?)"?\s*$', re.MULTILINE)
+
+
+def _resource_body(text, start):
+    depth, pos = 1, start
+    while depth and pos < len(text):
+        if text[pos] == "{":
+            depth += 1
+        elif text[pos] == "}":
+            depth -= 1
+        pos += 1
+    return text[start:pos - 1]
+
+
+def security_group_ingress(main_tf=MAIN_TF, name="web"):
+    """Ingress rules of aws_security_group.<name> as dicts"""
+    text = Path(main_tf).read_text()
+    for match in _SECURITY_GROUP.finditer(text):
+        if match.group(1) != name:
+            continue
+        body = _resource_body(text, match.end())
+        rules = []
+        for ingress in _INGRESS.finditer(body):
+            attrs = dict(_ATTRIBUTE.findall(ingress.group(1)))
+            rules.append({
+                "from_port": int(attrs["from_port"]),
+                "to_port": int(attrs["to_port"]),
+                "protocol": attrs.get("protocol", "tcp"),
+                "description": attrs.get("description", ""),
+            })
+        return rules
+    raise KeyError(f"aws_security_group.{name} not found in {main_tf}")
+
+
+def allowed_tcp_ports(rules):
+    """Set of TCP ports opened by a list of ingress rules"""
+    ports = set()
+    for rule in rules:
+        if rule["protocol"] == "-1":
+            ports.update(range(1, 65536))
+        elif rule["protocol"] == "tcp":
+            ports.update(range(rule["from_port"], rule["to_port"] + 1))
+    return ports
+
+
+async def _probe(host, port, timeout, semaphore):
+    async with semaphore:
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        except ConnectionRefusedError:
+            return CLOSED
+        except asyncio.TimeoutError:
+            return FILTERED
+        except OSError as e:
+            # Unreachable networks/hosts behave like a dropping firewall
+            if e.errno in (errno.ECONNREFUSED, errno.ECONNRESET):
+                return CLOSED
+            return FILTERED
+        writer.close()
+        return OPEN
+
+
+async def scan_async(hosts, ports, timeout=2.0, concurrency=256):
+    """Map of (host, port) -> open/closed/filtered"""
+    semaphore = asyncio.Semaphore(concurrency)
+    targets = [(host, port) for host in hosts for port in ports]
+    states = await asyncio.gather(*(_probe(h, p, timeout, semaphore) for h, p in targets))
+    return dict(zip(targets, states))
+
+
+def scan(hosts, ports, **kwargs):
+    """Blocking wrapper around scan_async"""
+    return asyncio.run(scan_async(hosts, ports, **kwargs))
+
+
+class ExposureReport:
+    """Expected (security group) versus actual (scan) exposure per host:port"""
+
+    def __init__(self, results, allowed_ports):
+        self.results = results
+        self.allowed_ports = set(allowed_ports)
+
+    def rows(self):
+        for (host, port), state in sorted(self.results.items()):
+            expected = "allowed" if port in self.allowed_ports else "blocked"
+            yield {"host": host, "port": port, "expected": expected, "actual": state}
+
+    @property
+    def unexpected_open(self):
+        """Ports that answer although the security group should block them"""
+        return [r for r in self.rows() if r["actual"] == OPEN and r["expected"] == "blocked"]
+
+    @property
+    def allowed_not_listening(self):
+        """Ports the security group opens that nothing is serving"""
+        return [r for r in self.rows() if r["actual"] != OPEN and r["expected"] == "allowed"]
+
+
+def exposure_report(hosts, ports=None, main_tf=MAIN_TF, **kwargs):
+    """Scan the security group ports plus ports, then compare with main.tf"""
+    allowed = allowed_tcp_ports(security_group_ingress(main_tf))
+    ports = sorted(set(ports if ports is not None else INSECURE_PORTS) | allowed)
+    return ExposureReport(scan(hosts, ports, **kwargs), allowed)
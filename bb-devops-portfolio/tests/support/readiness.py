@@ -0,0 +1,135 @@
+"""
+Async readiness waiter for the deployed web server
+Probes the HTTP endpoints and the SSH port concurrently with jittered
+exponential backoff and returns as soon as every probe is green
+"""
+
+import asyncio
+import random
+import time
+from urllib.parse import urlparse
+
+DEFAULT_PATHS = ("/", "/health", "/monitoring.html")
+
+
+class ProbeResult:
+    """Outcome of one readiness probe"""
+
+    def __init__(self, name):
+        self.name = name
+        self.ready = False
+        self.attempts = 0
+        self.time_to_ready = None
+        self.last_error = None
+
+    def __repr__(self):
+        state = f"ready in {self.time_to_ready:.2f}s" if self.ready else f"not ready ({self.last_error})"
+        return f"{self.name}: {state} after {self.attempts} attempt(s)"
+
+
+class ReadinessReport:
+    """Aggregate of all probes for one target"""
+
+    def __init__(self, target, probes, elapsed):
+        self.target = target
+        self.probes = probes
+        self.elapsed = elapsed
+
+    @property
+    def ready(self):
+        return all(p.ready for p in self.probes)
+
+    @property
+    def time_to_ready(self):
+        return max(p.time_to_ready for p in self.probes) if self.ready else None
+
+    @property
+    def pending(self):
+        return [p for p in self.probes if not p.ready]
+
+    def summary(self):
+        if self.ready:
+            head = f"readiness: {self.target} ready in {self.time_to_ready:.2f}s"
+        else:
+            head = f"readiness: {self.target} NOT ready after {self.elapsed:.2f}s"
+        return head + " (" + ", ".join(repr(p) for p in self.probes) + ")"
+
+
+async def _http_status(host, port, path, timeout):
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        request = f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n"
+        writer.write(request.encode("ascii"))
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+    finally:
+        writer.close()
+    parts = status_line.split()
+    if len(parts) < 2 or not parts[0].startswith(b"HTTP/"):
+        raise ConnectionError(f"malformed status line {status_line!r}")
+    return int(parts[1])
+
+
+async def _ssh_banner(host, port, timeout):
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        banner = await asyncio.wait_for(reader.readline(), timeout)
+    finally:
+        writer.close()
+    if not banner.startswith(b"SSH-"):
+        raise ConnectionError(f"unexpected banner {banner!r}")
+
+
+async def _poll(result, check, started, deadline, base_delay, max_delay):
+    """Retry check with full-jitter exponential backoff until it passes"""
+    delay = base_delay
+    while True:
+        result.attempts += 1
+        try:
+            await check()
+        except (OSError, asyncio.TimeoutError, ConnectionError, ValueError) as e:
+            result.last_error = str(e) or type(e).__name__
+        else:
+            result.ready = True
+            result.time_to_ready = time.monotonic() - started
+            return result
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return result
+        await asyncio.sleep(min(random.uniform(0, delay), remaining))
+        delay = min(delay * 2, max_delay)
+
+
+async def wait_until_ready_async(url, paths=DEFAULT_PATHS, ssh_port=22, timeout=60.0,
+                                 probe_timeout=5.0, base_delay=0.25, max_delay=5.0):
+    """Probe every endpoint concurrently and return a ReadinessReport"""
+    parsed = urlparse(url)
+    host = parsed.hostname
+    port = parsed.port or 80
+    started = time.monotonic()
+    deadline = started + timeout
+
+    async def expect_ok(path):
+        status = await _http_status(host, port, path, probe_timeout)
+        if status != 200:
+            raise ConnectionError(f"HTTP {status}")
+
+    probes = []
+    tasks = []
+    for path in paths:
+        result = ProbeResult(f"GET {path}")
+        probes.append(result)
+        tasks.append(_poll(result, lambda p=path: expect_ok(p), started, deadline, base_delay, max_delay))
+    if ssh_port:
+        result = ProbeResult(f"ssh:{ssh_port}")
+        probes.append(result)
+        tasks.append(_poll(result, lambda: _ssh_banner(host, ssh_port, probe_timeout),
+                           started, deadline, base_delay, max_delay))
+
+    await asyncio.gather(*tasks)
+    return ReadinessReport(url, probes, time.monotonic() - started)
+
+
+def wait_until_ready(url, **kwargs):
+    """Blocking wrapper around wait_until_ready_async"""
+    return asyncio.run(wait_until_ready_async(url, **kwargs))
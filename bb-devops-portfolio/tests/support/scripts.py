@@ -0,0 +1,34 @@
+"""
+Python tooling shipped outside tests/: the stdlib-only Terraform scripts
+shared with the Makefile, and role tools the load harness reuses
+Loaded by path rather than from sys.path; each module is registered under
+its own name because plandiff imports tfstate the way it does when run
+from scripts/, and role_module then finds the same module object
+"""
+
+import importlib.util
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+SCRIPTS_DIR = PROJECT_ROOT / "scripts"
+
+
+def load_module(path):
+    """Import the Python file at path once, as a module named after its stem"""
+    name = Path(path).stem
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[name]
+
+
+def load_script(name):
+    """Import scripts/<name>.py once and return the module"""
+    return load_module(SCRIPTS_DIR / f"{name}.py")
+
+
+tfstate = load_script("tfstate")
+plandiff = load_script("plandiff")
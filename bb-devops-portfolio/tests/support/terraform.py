@@ -0,0 +1,134 @@
+"""
+Terraform outputs provider for integration tests
+Runs `terraform output -json` once (or streams the outputs out of the
+local state when no terraform binary is available) and publishes the
+result to a lock-protected cache file shared by every xdist worker, keyed
+on the state lineage/serial so a new apply invalidates it
+"""
+
+import fcntl
+import json
+import os
+import re
+import shutil
+import subprocess
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from support.scripts import tfstate
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+TERRAFORM_DIR = PROJECT_ROOT / "terraform"
+
+# serial/lineage sit in the first few hundred bytes of a v4 state file
+_STATE_HEADER_BYTES = 4096
+_SERIAL = re.compile(rb'"serial"\s*:\s*(\d+)')
+_LINEAGE = re.compile(rb'"lineage"\s*:\s*"([^"]+)"')
+
+
+class TerraformOutputsUnavailable(Exception):
+    """Raised when no deployed infrastructure outputs can be read"""
+
+
+def terraform_command():
+    """Terraform binary, honouring the TERRAFORM_CMD used by the Makefile"""
+    return os.environ.get("TERRAFORM_CMD") or shutil.which("terraform")
+
+
+def state_key(terraform_dir=TERRAFORM_DIR):
+    """(lineage, serial) of the local state, or None for remote/absent state"""
+    state_file = Path(terraform_dir) / "terraform.tfstate"
+    try:
+        with open(state_file, "rb") as f:
+            header = f.read(_STATE_HEADER_BYTES)
+    except OSError:
+        return None
+    serial = _SERIAL.search(header)
+    lineage = _LINEAGE.search(header)
+    if not serial:
+        return None
+    return [lineage.group(1).decode() if lineage else "", int(serial.group(1))]
+
+
+@contextmanager
+def _locked(lock_path):
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "a+") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class TerraformOutputs:
+    """Session-wide, cross-worker cache of `terraform output -json`"""
+
+    def __init__(self, cache_dir, terraform_dir=TERRAFORM_DIR, run_id=None):
+        self.terraform_dir = Path(terraform_dir).resolve()
+        self.cache_file = Path(cache_dir) / "outputs.json"
+        self.lock_file = Path(cache_dir) / "outputs.lock"
+        # Without a local state file the cache can only be trusted for this run
+        self.run_id = run_id or os.environ.get("PYTEST_XDIST_TESTRUNUID") or uuid.uuid4().hex
+        self.reads = 0
+
+    def _cache_key(self):
+        key = state_key(self.terraform_dir)
+        return {"state": key, "run": None if key else self.run_id}
+
+    def _read_cache(self, key):
+        try:
+            cached = json.loads(self.cache_file.read_text())
+        except (OSError, ValueError):
+            return None
+        if cached.get("key") != key or cached.get("terraform_dir") != str(self.terraform_dir):
+            return None
+        return cached["outputs"]
+
+    def _read_state(self):
+        state_file = self.terraform_dir / "terraform.tfstate"
+        if not state_file.is_file():
+            raise TerraformOutputsUnavailable("terraform binary not found")
+        self.reads += 1
+        outputs = tfstate.load_index(state_file).outputs
+        if not outputs:
+            raise TerraformOutputsUnavailable("terraform state has no outputs")
+        return outputs
+
+    def _read_terraform(self):
+        command = terraform_command()
+        if not command:
+            # Local state carries the same {name: {value, type}} outputs map
+            return self._read_state()
+        try:
+            result = subprocess.run(
+                [command, "output", "-json"],
+                cwd=self.terraform_dir,
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise TerraformOutputsUnavailable(str(e)) from e
+        self.reads += 1
+        outputs = json.loads(result.stdout or "{}")
+        if not outputs:
+            raise TerraformOutputsUnavailable("terraform state has no outputs")
+        return outputs
+
+    def load(self):
+        key = self._cache_key()
+        with _locked(self.lock_file):
+            outputs = self._read_cache(key)
+            if outputs is not None:
+                return outputs
+            outputs = self._read_terraform()
+            tmp = self.cache_file.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps({
+                "key": key,
+                "terraform_dir": str(self.terraform_dir),
+                "outputs": outputs,
+            }))
+            os.replace(tmp, self.cache_file)
+            return outputs
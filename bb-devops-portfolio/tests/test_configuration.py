@@ -3,378 +3,1180 @@ Configuration management tests for BB IaC Integrated Pipeline
 Tests Ansible playbooks and configuration states
 """
 
-import pytest
-import yaml
+import configparser
+import gzip
 import json
-import tempfile
 import os
-from pathlib import Path
-from unittest.mock import patch, MagicMock, mock_open
+import re
+import shutil
+import subprocess
+import sys
+import time
+
+import jinja2
+import pytest
+
+from support.config_model import (
+    parse_logrotate,
+    parse_nginx_directives,
+    parse_nginx_headers,
+    parse_nginx_locations,
+)
+from support.fakeproc import fake_proc, fake_statvfs
 
 
 class TestAnsiblePlaybooks:
     """Test Ansible playbook syntax and structure"""
-    
-    def setup_method(self):
-        """Setup test environment"""
-        self.project_root = Path(__file__).parent.parent
-        self.ansible_dir = self.project_root / "ansible"
-        
-    def test_site_playbook_syntax(self):
+
+    def test_site_playbook_syntax(self, devops_config):
         """Test main site.yml playbook syntax"""
-        site_yml_content = """
----
-- hosts: all
-  become: yes
-  gather_facts: yes
-  roles:
-    - security
-    - nginx
-    - monitoring
-  
-  pre_tasks:
-    - name: Update apt cache
-      apt:
-        update_cache: yes
-        cache_valid_time: 3600
-      when: ansible_os_family == "Debian"
-    
-    - name: Update yum cache
-      yum:
-        update_cache: yes
-      when: ansible_os_family == "RedHat"
-  
-  post_tasks:
-    - name: Verify all services are running
-      service:
-        name: "{{ item }}"
-        state: started
-      loop:
-        - nginx
-        - ufw
-        - fail2ban
-"""
-        
-        # Parse YAML to verify syntax
-        try:
-            playbook = yaml.safe_load(site_yml_content)
-            assert isinstance(playbook, list)
-            assert len(playbook) == 1
-            
-            play = playbook[0]
-            assert 'hosts' in play
-            assert 'roles' in play
-            assert play['hosts'] == 'all'
-            assert 'security' in play['roles']
-            assert 'nginx' in play['roles']
-            assert 'monitoring' in play['roles']
-            
-        except yaml.YAMLError as e:
-            pytest.fail(f"Invalid YAML syntax in site.yml: {e}")
-    
-    def test_ansible_cfg_configuration(self):
+        playbook = devops_config.site
+        assert isinstance(playbook, list)
+        assert len(playbook) == 1
+
+        play = devops_config.play
+        assert 'hosts' in play
+        assert 'roles' in play
+        assert play['hosts'] == 'web'
+        assert play['become'] is True
+        assert 'security' in devops_config.role_order
+        assert 'nginx' in devops_config.role_order
+        assert 'monitoring' in devops_config.role_order
+
+    def test_play_templates_resolve(self, devops_config):
+        """Test every play-level template src exists where Ansible searches for it"""
+        play = devops_config.play
+        for section in ('pre_tasks', 'tasks', 'post_tasks', 'handlers'):
+            for task in play.get(section) or []:
+                if 'template' not in task:
+                    continue
+                src = task['template']['src']
+                # Relative to the playbook: templates/<src>, then <src>
+                candidates = [devops_config.ansible_dir / 'templates' / src, devops_config.ansible_dir / src]
+                assert any(path.is_file() for path in candidates), f"{task['name']}: {src} not found"
+
+    def test_ansible_cfg_configuration(self, devops_config):
         """Test ansible.cfg has proper settings"""
-        ansible_cfg_content = """[defaults]
-inventory = inventory/aws_ec2.yml
-remote_user = ubuntu
-private_key_file = ~/.ssh/bb-iac-key
-host_key_checking = False
-timeout = 30
-gathering = smart
-fact_caching = memory
-
-[inventory]
-enable_plugins = aws_ec2
-
-[ssh_connection]
-ssh_args = -o ControlMaster=auto -o ControlPersist=60s -o UserKnownHostsFile=/dev/null
-pipelining = True
-"""
-        
-        # Parse INI-style configuration
-        lines = ansible_cfg_content.strip().split('\n')
-        config_sections = {}
-        current_section = None
-        
-        for line in lines:
-            line = line.strip()
-            if line.startswith('[') and line.endswith(']'):
-                current_section = line[1:-1]
-                config_sections[current_section] = {}
-            elif '=' in line and current_section:
-                key, value = line.split('=', 1)
-                config_sections[current_section][key.strip()] = value.strip()
-        
+        config_sections = devops_config.ansible_cfg
+
         # Verify critical settings
         assert 'defaults' in config_sections
-        assert 'inventory' in config_sections['defaults']
+        assert config_sections['defaults']['inventory'] == 'inventory/hosts.yml'
         assert 'remote_user' in config_sections['defaults']
-        assert config_sections['defaults']['remote_user'] == 'ubuntu'
+        assert config_sections['defaults']['remote_user'] == 'ansible'
         assert config_sections['defaults']['host_key_checking'] == 'False'
-    
-    def test_aws_ec2_inventory_structure(self):
-        """Test AWS EC2 dynamic inventory configuration"""
-        inventory_config = {
-            "plugin": "aws_ec2",
-            "regions": ["us-east-1"],
-            "filters": {
-                "tag:Project": ["BB Engineering Portfolio"],
-                "instance-state-name": ["running"]
-            },
-            "keyed_groups": [
-                {
-                    "prefix": "aws",
-                    "key": "tags"
-                }
-            ],
-            "hostnames": ["tag:Name", "public_ip_address"],
-            "compose": {
-                "ansible_host": "public_ip_address"
-            }
-        }
-        
+        assert config_sections['ssh_connection']['pipelining'] == 'True'
+        assert 'ControlMaster=auto' in config_sections['ssh_connection']['ssh_args']
+
+    def test_facts_and_connections_outlive_a_run(self, devops_config):
+        """Test facts come from a JSON cache with a TTL and SSH masters persist across phases"""
+        defaults = devops_config.ansible_cfg['defaults']
+        assert defaults['gathering'] == 'smart'
+        assert defaults['fact_caching'] == 'jsonfile'
+        assert 0 < int(defaults['fact_caching_timeout']) <= 86400
+        assert 'phase_report' in [c.strip() for c in defaults['callbacks_enabled'].split(',')]
+
+        ssh_args = devops_config.ansible_cfg['ssh_connection']['ssh_args']
+        persist = next(arg.split('=', 1)[1] for arg in ssh_args.split() if arg.startswith('ControlPersist='))
+        assert persist.endswith('m') and int(persist[:-1]) >= 10
+
+        play = devops_config.play
+        assert 'all' not in play['gather_subset'] and {'hardware', 'network'} <= set(play['gather_subset'])
+        refresh = play['pre_tasks'][0]
+        assert refresh['setup']['gather_subset'] == ['!all', '!min', 'date_time']
+
+    def test_single_pass_reports_phases_and_reuses_facts(self, devops_config, tmp_path):
+        """Test the phase_report callback times each role and a second run skips fact gathering"""
+        if shutil.which('ansible-playbook') is None:
+            pytest.skip('ansible-playbook not installed')
+
+        # A two-role play on localhost, run with the real cache and callback settings
+        for role, task in (('first', 'debug: msg=first'), ('second', 'command: "true"')):
+            (tmp_path / 'roles' / role / 'tasks').mkdir(parents=True)
+            (tmp_path / 'roles' / role / 'tasks' / 'main.yml').write_text(f'- name: {role}\n  {task}\n')
+        (tmp_path / 'site.yml').write_text(
+            '- hosts: local\n  gather_facts: true\n  gather_subset: [min]\n'
+            '  pre_tasks:\n    - name: pre\n      debug: msg=pre\n'
+            '  roles: [first, second]\n'
+        )
+        (tmp_path / 'hosts').write_text(f'local ansible_connection=local ansible_python_interpreter={sys.executable}\n')
+        defaults = devops_config.ansible_cfg['defaults']
+        keys = ('gathering', 'fact_caching', 'fact_caching_connection', 'fact_caching_timeout', 'callbacks_enabled')
+        (tmp_path / 'ansible.cfg').write_text('[defaults]\n' + ''.join(f'{key} = {defaults[key]}\n' for key in keys) +
+                                              f'callback_plugins = {devops_config.ansible_dir / "callback_plugins"}\n')
+
+        reports = []
+        for run in (1, 2):
+            output = tmp_path / f'phases-{run}.json'
+            env = dict(os.environ, ANSIBLE_CONFIG=str(tmp_path / 'ansible.cfg'), BB_PHASE_REPORT_JSON=str(output))
+            result = subprocess.run(['ansible-playbook', '-i', 'hosts', 'site.yml'], cwd=tmp_path, env=env,
+                                    capture_output=True, text=True, timeout=120)
+            assert result.returncode == 0, result.stdout + result.stderr
+            assert '→ second: started' in result.stdout
+            reports.append(json.loads(output.read_text()))
+
+        first, second = reports
+        assert [phase['name'] for phase in first['phases']] == ['facts', 'pre_tasks', 'first', 'second']
+        assert first['facts_cached'] is False
+        assert first['saved_seconds'] >= 2 * first['phases'][0]['seconds']
+        assert second['facts_cached'] is True
+        assert [phase['name'] for phase in second['phases']] == ['pre_tasks', 'first', 'second']
+        assert second['phases'][2]['changed'] == 1
+
+    def test_aws_ec2_inventory_structure(self, devops_config):
+        """Test inventory and AWS EC2 dynamic inventory configuration"""
+        inventory = devops_config.inventory
+        web_group = inventory['all']['children']['web']
+
         # Verify inventory structure
-        assert inventory_config["plugin"] == "aws_ec2"
-        assert "us-east-1" in inventory_config["regions"]
-        assert "tag:Project" in inventory_config["filters"]
-        assert inventory_config["filters"]["tag:Project"] == ["BB Engineering Portfolio"]
+        assert web_group['hosts'], "No hosts defined in web group"
+        assert web_group['vars']['nginx_port'] == 80
+        assert web_group['vars']['nginx_ssl_port'] == 443
+        assert inventory['all']['vars']['ssh_port'] == 22
+
+        # Dynamic inventory plugin stays available for tag-based discovery
+        plugins = [p.strip() for p in devops_config.ansible_cfg['inventory']['enable_plugins'].split(',')]
+        assert 'aws_ec2' in plugins
 
 
 class TestSecurityRole:
     """Test security role configuration"""
-    
-    def test_security_tasks_structure(self):
+
+    def test_security_tasks_structure(self, devops_config):
         """Test security role tasks are properly structured"""
-        security_tasks = [
-            {
-                "name": "Update system packages",
-                "package": {
-                    "name": "*",
-                    "state": "latest"
-                },
-                "become": True
-            },
-            {
-                "name": "Install security packages",
-                "package": {
-                    "name": ["ufw", "fail2ban", "unattended-upgrades"],
-                    "state": "present"
-                },
-                "become": True
-            }
-        ]
-        
+        security_tasks = devops_config.roles['security'].tasks
+
         # Verify tasks structure
         assert len(security_tasks) >= 2
-        
+
         for task in security_tasks:
             assert 'name' in task
             assert isinstance(task['name'], str)
             if 'become' in task:
                 assert task['become'] is True
-    
-    def test_ufw_configuration(self):
+
+        packages = devops_config.roles['security'].task('Install security packages')['apt']['name']
+        assert {'ufw', 'fail2ban', 'unattended-upgrades'} <= set(packages)
+
+    def test_ufw_configuration(self, devops_config):
         """Test UFW firewall configuration"""
-        ufw_rules = [
-            {"rule": "allow", "port": "22", "proto": "tcp"},
-            {"rule": "allow", "port": "80", "proto": "tcp"},
-            {"rule": "deny", "direction": "incoming"},
-            {"rule": "allow", "direction": "outgoing"}
-        ]
-        
+        role = devops_config.roles['security']
+        ufw_rules = role.task('Configure UFW firewall rules')['loop']
+        ufw_policies = role.task('Set UFW default policies')['loop']
+
         # Verify UFW rules
-        ssh_allowed = any(rule.get('port') == '22' and rule.get('rule') == 'allow' for rule in ufw_rules)
-        http_allowed = any(rule.get('port') == '80' and rule.get('rule') == 'allow' for rule in ufw_rules)
-        default_deny = any(rule.get('rule') == 'deny' and rule.get('direction') == 'incoming' for rule in ufw_rules)
-        
+        ssh_allowed = any(rule.get('port') == 22 and rule.get('rule') == 'allow' for rule in ufw_rules)
+        http_allowed = any(rule.get('port') == 80 and rule.get('rule') == 'allow' for rule in ufw_rules)
+        default_deny = any(p.get('policy') == 'deny' and p.get('direction') == 'incoming' for p in ufw_policies)
+
         assert ssh_allowed, "SSH access not allowed in UFW rules"
         assert http_allowed, "HTTP access not allowed in UFW rules"
         assert default_deny, "Default deny rule not configured"
-    
-    def test_fail2ban_configuration(self):
+
+    def test_fail2ban_configuration(self, devops_config):
         """Test Fail2Ban configuration"""
-        fail2ban_config = {
-            "ssh": {
-                "enabled": True,
-                "port": "ssh",
-                "filter": "sshd",
-                "logpath": "/var/log/auth.log",
-                "maxretry": 3,
-                "bantime": 3600
-            },
-            "nginx-http-auth": {
-                "enabled": True,
-                "port": "http,https",
-                "filter": "nginx-http-auth",
-                "logpath": "/var/log/nginx/error.log",
-                "maxretry": 5
-            }
-        }
-        
+        role = devops_config.roles['security']
+        task = role.task('Configure fail2ban for SSH protection')
+        assert task['template']['src'] in role.templates
+
+        template = jinja2.Template(role.templates[task['template']['src']])
+
+        def render(**overrides):
+            parsed = configparser.ConfigParser(interpolation=None)
+            parsed.read_string(template.render(**dict(role.defaults, **overrides)))
+            return parsed
+
         # Verify Fail2Ban configuration
-        assert 'ssh' in fail2ban_config
-        assert fail2ban_config['ssh']['enabled'] is True
-        assert fail2ban_config['ssh']['maxretry'] <= 5
-        assert fail2ban_config['ssh']['bantime'] >= 1800  # At least 30 minutes
+        fail2ban_config = render(auth_detector_bans=False)
+        assert 'sshd' in fail2ban_config
+        assert fail2ban_config['sshd'].getboolean('enabled') is True
+        assert fail2ban_config['sshd'].getint('maxretry') <= 5
+        assert fail2ban_config['sshd'].getint('bantime') >= 1800  # At least 30 minutes
+        assert fail2ban_config['sshd']['logpath'] == '/var/log/auth.log'
+
+        # By default SSH offenders are banned from the agent's ban log, with
+        # the sshd jail kept as a looser backstop
+        fail2ban_config = render()
+        assert fail2ban_config['sshd'].getboolean('enabled') is True
+        assert fail2ban_config['sshd'].getint('maxretry') > fail2ban_config['DEFAULT'].getint('maxretry')
+        detector = fail2ban_config['bb-auth-detector']
+        assert detector.getboolean('enabled') is True
+        assert detector['logpath'] == devops_config.roles['monitoring'].defaults['auth_ban_log']
+        assert detector.getint('bantime') >= 1800
+        assert role.task('Install fail2ban filter for the auth detector ban log')['template']['src'] in role.templates
+
+    @pytest.mark.parametrize('profile, vcpus, memory_mb, expected', [
+        # t3.micro, kernel defaults mostly kept
+        ('conservative', 2, 957, {'net.core.somaxconn': '4096', 'net.ipv4.tcp_max_syn_backlog': '4096',
+                                  'net.core.netdev_max_backlog': '2000', 'net.ipv4.tcp_congestion_control': 'cubic',
+                                  'net.ipv4.tcp_tw_reuse': '2', 'fs.file-max': '9223372036854775807'}),
+        ('web-heavy', 2, 957, {'net.core.somaxconn': '65535', 'net.ipv4.tcp_max_syn_backlog': '15312',
+                               'net.core.netdev_max_backlog': '8192', 'net.ipv4.tcp_congestion_control': 'bbr',
+                               'net.core.default_qdisc': 'fq', 'net.ipv4.ip_local_port_range': '10240 65535'}),
+        # m5.xlarge: the SYN backlog cap applies
+        ('web-heavy', 4, 15798, {'net.ipv4.tcp_max_syn_backlog': '252768', 'net.core.netdev_max_backlog': '16384'}),
+        ('web-heavy', 16, 124000, {'net.ipv4.tcp_max_syn_backlog': '262144'}),
+    ])
+    def test_performance_profile_follows_instance_facts(self, devops_config, profile, vcpus, memory_mb, expected):
+        """Test the sysctl profile scales with the host and never lowers a kernel ceiling"""
+        settings = self._render_performance(devops_config, '99-bb-iac-performance.conf.j2', profile,
+                                            ansible_processor_vcpus=vcpus, ansible_memtotal_mb=memory_mb)
+        for name, value in expected.items():
+            assert settings[name] == value, name
+
+    def test_performance_profile_keeps_hardening(self, devops_config):
+        """Test the profile is applied from its own file and shares no key with the hardening set"""
+        role = devops_config.roles['security']
+        hardening = {item['name'] for item in role.task('Set secure kernel parameters')['loop']}
+        assert 'net.ipv4.tcp_syncookies' in hardening
+        for profile in role.defaults['performance_profiles']:
+            settings = self._render_performance(devops_config, '99-bb-iac-performance.conf.j2', profile)
+            assert not hardening & set(settings), profile
+
+        task = role.task('Configure performance kernel parameters')
+        assert task['template']['dest'].startswith('/etc/sysctl.d/')
+        assert task['notify'] == 'reload sysctl'
+        assert {'reload sysctl', 'reload systemd', 'load bbr'} <= set(role.handler_names)
+        assert role.task('Load BBR congestion control at boot')['when'] == "performance.congestion_control == 'bbr'"
+
+    def test_performance_profile_raises_nginx_limits(self, devops_config):
+        """Test nginx's accept queue and unit descriptor limit follow the profile"""
+        limits = self._render_performance(devops_config, 'nginx-limits.conf.j2', 'web-heavy')
+        assert limits['LimitNOFILE'] == '1048576'
+        capped = self._render_performance(devops_config, 'nginx-limits.conf.j2', 'web-heavy',
+                                          performance_kernel={'stdout_lines': ['fs.nr_open = 524288']})
+        assert capped['LimitNOFILE'] == '524288'
+
+        nginx = devops_config.roles['nginx']
+        security = devops_config.roles['security'].defaults
+        site = jinja2.Environment(trim_blocks=True).from_string(nginx.templates['default.conf.j2'])
+
+        # No `performance` fact: a --tags nginx run skips the security role's set_fact
+        def backlogs(**variables):
+            return {value.rsplit('backlog=', 1)[1]
+                    for value in parse_nginx_directives(site.render(**dict(nginx.defaults, **variables)), 'listen')}
+        assert backlogs(**dict(security, performance_profile='web-heavy')) == {'65535'}
+        assert backlogs(**dict(security, performance_profile='web-heavy',
+                               performance_overrides={'somaxconn': 8192})) == {'8192'}
+        assert backlogs(**security) == {'4096'}
+        assert backlogs() == {'511'}
+
+    @staticmethod
+    def _render_performance(config, template, profile, **facts):
+        """Rendered `key = value` (sysctl) or `Key=value` (systemd) settings"""
+        role = config.roles['security']
+        variables = dict(role.defaults, performance_profile=profile, performance_kernel={'stdout_lines': [
+            # Ubuntu 22.04 kernel defaults
+            'fs.file-max = 9223372036854775807',
+            'fs.nr_open = 1048576',
+            'net.core.somaxconn = 4096',
+            'net.ipv4.tcp_max_syn_backlog = 512',
+            'net.core.netdev_max_backlog = 1000',
+        ]})
+        variables.update(facts)
+        rendered = jinja2.Environment(trim_blocks=True).from_string(role.templates[template]).render(**variables)
+        settings = {}
+        for line in rendered.splitlines():
+            if line and not line.startswith(('#', '[')):
+                key, _, value = line.partition('=')
+                settings[key.strip()] = value.strip()
+        return settings
 
 
 class TestNginxRole:
     """Test Nginx role configuration"""
-    
-    def test_nginx_security_headers(self):
+
+    def test_nginx_security_headers(self, project_config):
         """Test Nginx security headers configuration"""
-        security_headers = [
-            'X-Frame-Options "SAMEORIGIN"',
-            'X-XSS-Protection "1; mode=block"',
-            'X-Content-Type-Options "nosniff"',
-            'Referrer-Policy "strict-origin-when-cross-origin"',
-            'Strict-Transport-Security "max-age=31536000; includeSubDomains; preload"'
-        ]
-        
+        template = project_config.roles['nginx'].templates['security-headers.conf.j2']
+        security_headers = parse_nginx_headers(template)
+
         # Verify security headers are present
         required_headers = ['X-Frame-Options', 'X-XSS-Protection', 'X-Content-Type-Options']
-        
+
         for required_header in required_headers:
-            header_found = any(required_header in header for header in security_headers)
-            assert header_found, f"Required security header not found: {required_header}"
-    
-    def test_nginx_site_configuration(self):
+            assert required_header in security_headers, f"Required security header not found: {required_header}"
+        assert security_headers['X-Frame-Options'] == 'SAMEORIGIN'
+        assert parse_nginx_directives(template, 'server_tokens') == ['off']
+
+    def test_nginx_site_configuration(self, project_config):
         """Test Nginx site configuration structure"""
-        nginx_config = {
-            "server": {
-                "listen": ["80 default_server", "[::]:80 default_server"],
-                "root": "/var/www/html",
-                "index": "index.html index.htm",
-                "server_name": "_",
-                "locations": {
-                    "/": {
-                        "try_files": "$uri $uri/ =404"
-                    },
-                    "/health": {
-                        "access_log": "off",
-                        "return": "200 \"healthy\\n\""
-                    }
-                }
-            }
-        }
-        
+        nginx_config = project_config.roles['nginx'].templates['default.conf.j2']
+        locations = parse_nginx_locations(nginx_config)
+
         # Verify Nginx configuration structure
-        assert 'server' in nginx_config
-        assert 'root' in nginx_config['server']
-        assert nginx_config['server']['root'] == '/var/www/html'
-        assert 'locations' in nginx_config['server']
-        assert '/health' in nginx_config['server']['locations']
+        assert any(value.split(' backlog=')[0] == '80 default_server'
+                   for value in parse_nginx_directives(nginx_config, 'listen'))
+        assert parse_nginx_directives(nginx_config, 'root')[0] == '/var/www/html'
+        assert '/' in locations
+        assert '/health' in locations
+        assert 'include /etc/nginx/conf.d/security-headers.conf;' in nginx_config
+
+    @pytest.mark.parametrize('vcpus, memory_mb, expected', [
+        # Below the per-worker floor
+        (1, 100, {'worker_processes': '1', 'worker_connections': '1024', 'worker_rlimit_nofile': '2048',
+                  'client_body_buffer_size': '16k', 'open_file_cache': 'max=400 inactive=60s'}),
+        # t3.nano
+        (2, 458, {'worker_processes': '2', 'worker_connections': '1832', 'worker_rlimit_nofile': '3664',
+                  'client_body_buffer_size': '16k', 'open_file_cache': 'max=1832 inactive=60s'}),
+        # t3.micro
+        (2, 957, {'worker_processes': '2', 'worker_connections': '3828', 'worker_rlimit_nofile': '7656',
+                  'client_body_buffer_size': '16k', 'open_file_cache': 'max=3828 inactive=60s'}),
+        # m5.xlarge
+        (4, 15798, {'worker_processes': '4', 'worker_connections': '31596', 'worker_rlimit_nofile': '63192',
+                    'client_body_buffer_size': '64k', 'open_file_cache': 'max=63192 inactive=60s'}),
+        # x1e.xlarge: the per-worker ceiling and the cache cap apply
+        (4, 124000, {'worker_processes': '4', 'worker_connections': '65535', 'worker_rlimit_nofile': '131070',
+                     'client_body_buffer_size': '64k', 'open_file_cache': 'max=65536 inactive=60s'}),
+    ])
+    def test_nginx_tuning_follows_instance_facts(self, devops_config, vcpus, memory_mb, expected):
+        """Test nginx.conf worker, descriptor and buffer sizing per instance profile"""
+        rendered = self._render_nginx_conf(devops_config, ansible_processor_vcpus=vcpus, ansible_memtotal_mb=memory_mb)
+        for name, value in expected.items():
+            assert parse_nginx_directives(rendered, name) == [value], name
+        assert parse_nginx_directives(rendered, 'sendfile') == ['on']
+        assert parse_nginx_directives(rendered, 'tcp_nopush') == ['on']
+        assert parse_nginx_directives(rendered, 'keepalive_timeout') == ['15']
+
+    def test_nginx_tuning_respects_limits_and_group_overrides(self, devops_config):
+        """Test fs.nr_open caps descriptors and group vars override computed values"""
+        rendered = self._render_nginx_conf(devops_config, ansible_processor_vcpus=2, ansible_memtotal_mb=957,
+                                           nginx_nr_open={'stdout': '4096'})
+        assert parse_nginx_directives(rendered, 'worker_rlimit_nofile') == ['4096']
+        assert parse_nginx_directives(rendered, 'worker_connections') == ['2048']
+
+        rendered = self._render_nginx_conf(devops_config, ansible_processor_vcpus=8, ansible_memtotal_mb=957,
+                                           nginx_worker_processes=1, nginx_keepalive_timeout=5)
+        assert parse_nginx_directives(rendered, 'worker_processes') == ['1']
+        assert parse_nginx_directives(rendered, 'worker_connections') == ['7656']
+        assert parse_nginx_directives(rendered, 'keepalive_timeout') == ['5']
+
+        # auto stays auto; the connection budget is split across one worker per vCPU
+        facts = {'ansible_processor_vcpus': 4, 'ansible_memtotal_mb': 15798}
+        rendered = self._render_nginx_conf(devops_config, nginx_worker_processes='auto', **facts)
+        assert parse_nginx_directives(rendered, 'worker_processes') == ['auto']
+        assert parse_nginx_directives(rendered, 'worker_connections') == ['31596']
+
+        # Files rewritten in place must bypass the descriptor cache
+        locations = parse_nginx_locations(devops_config.roles['nginx'].templates['default.conf.j2'])
+        for location in ('/health', '= /health.unhealthy', '^~ /status/'):
+            assert 'open_file_cache off;' in locations[location], location
+        assert devops_config.roles['nginx'].task('Configure nginx main configuration')['template']['dest'] == \
+            '/etc/nginx/nginx.conf'
+
+    def test_nginx_terminates_tls_with_session_resumption(self, devops_config):
+        """Test the site listens for HTTP/2 over TLS and caches sessions across workers"""
+        rendered = self._render_template(devops_config, 'default.conf.j2')
+        listen = parse_nginx_directives(rendered, 'listen')
+        assert '443 ssl http2 default_server backlog=511' in listen
+        assert '80 default_server backlog=511' in listen
+        assert parse_nginx_directives(rendered, 'ssl_protocols') == ['TLSv1.2 TLSv1.3']
+        assert parse_nginx_directives(rendered, 'ssl_session_cache') == ['shared:SSL:10m']
+        assert parse_nginx_directives(rendered, 'ssl_session_tickets') == ['on']
+        assert all(cipher.startswith(('ECDHE-ECDSA-', 'ECDHE-RSA-'))
+                   for cipher in parse_nginx_directives(rendered, 'ssl_ciphers')[0].split(':'))
+        # A self-signed certificate has no responder to staple
+        assert parse_nginx_directives(rendered, 'ssl_stapling') == []
+
+        stapled = self._render_template(devops_config, 'default.conf.j2', nginx_tls_ocsp_stapling=True)
+        assert parse_nginx_directives(stapled, 'ssl_stapling') == ['on']
+        assert parse_nginx_directives(stapled, 'resolver') == ['169.254.169.253 valid=300s']
+
+        plain = self._render_template(devops_config, 'default.conf.j2', nginx_tls_enabled=False)
+        assert parse_nginx_directives(plain, 'ssl_certificate') == []
+
+        generate = devops_config.roles['nginx'].task('Generate self-signed TLS certificate')
+        assert generate['args']['creates'] == '{{ nginx_tls_certificate }}'
+        assert 'restart nginx' in generate['notify']
+
+    @staticmethod
+    def _render_template(config, name, **variables):
+        role = config.roles['nginx']
+        env = jinja2.Environment(trim_blocks=True)
+        return env.from_string(role.templates[name]).render(**dict(role.defaults, **variables))
+
+    @staticmethod
+    def _render_nginx_conf(config, **facts):
+        role = config.roles['nginx']
+        # Ansible renders templates with trim_blocks
+        env = jinja2.Environment(trim_blocks=True)
+        variables = dict(role.defaults, nginx_nr_open={'stdout': '1048576'})
+        variables.update(facts)
+        return env.from_string(role.templates['nginx.conf.j2']).render(**variables)
+
+
+class TestPrecompress:
+    """Test deploy-time precompression of the web root for gzip_static"""
+
+    @pytest.fixture
+    def precompress(self, role_module):
+        return role_module('nginx', 'precompress')
+
+    @pytest.fixture
+    def web_root(self, tmp_path):
+        root = tmp_path / 'html'
+        (root / 'status').mkdir(parents=True)
+        (root / 'index.html').write_text('<p>infrastructure pipeline</p>\n' * 200)
+        (root / 'monitoring.html').write_text('<div class="metric">value</div>\n' * 300)
+        (root / 'tiny.css').write_text('body{}')
+        (root / 'status' / 'dashboard.json').write_text('{"status": "healthy"}' * 100)
+        (root / 'backup.tar.gz').write_bytes(b'not ours')
+        return root
+
+    def test_compresses_once_and_rebuilds_on_change(self, precompress, web_root):
+        """Test variants are max-level gzip, skipped when unchanged and rebuilt on a new mtime"""
+        counts = precompress.precompress(str(web_root), {'status'})
+        assert counts == {'compressed': 2, 'unchanged': 0, 'skipped': 1, 'removed': 0}
+        stored = (web_root / 'index.html.gz').read_bytes()
+        assert gzip.decompress(stored) == (web_root / 'index.html').read_bytes()
+        assert len(stored) <= len(gzip.compress((web_root / 'index.html').read_bytes(), 9))
+        assert not (web_root / 'tiny.css.gz').exists()
+        assert not (web_root / 'status' / 'dashboard.json.gz').exists()
+
+        assert precompress.precompress(str(web_root), {'status'})['unchanged'] == 2
+
+        (web_root / 'index.html').write_text('<p>changed</p>\n' * 200)
+        os.utime(web_root / 'index.html', (1_700_000_000, 1_700_000_000))
+        (web_root / 'monitoring.html').unlink()
+        counts = precompress.precompress(str(web_root), {'status'})
+        assert counts['compressed'] == 1 and counts['removed'] == 1
+        assert gzip.decompress((web_root / 'index.html.gz').read_bytes()).startswith(b'<p>changed')
+        assert (web_root / 'backup.tar.gz').read_bytes() == b'not ours'
+
+    def test_benchmark_reports_cpu_saved(self, precompress, web_root):
+        """Test the benchmark finds on-the-fly gzip dearer than sending the stored variant"""
+        precompress.precompress(str(web_root), {'status'})
+        rows = precompress.benchmark(str(web_root), rounds=50)
+        assert sorted(row[0] for row in rows) == ['index.html', 'monitoring.html']
+        for _, size, gz_size, _, _ in rows:
+            assert gz_size < size
+        assert sum(row[3] for row in rows) > sum(row[4] for row in rows)
+
+    def test_site_serves_variants_statically(self, devops_config):
+        """Test gzip_static serves the stored pages and run-time files bypass it"""
+        site = devops_config.roles['nginx'].templates['default.conf.j2']
+        assert parse_nginx_directives(site, 'gzip_static').count('on') == 1
+        locations = parse_nginx_locations(site)
+        for location in ('/health', '= /health.unhealthy', '^~ /status/'):
+            assert 'gzip_static off;' in locations[location], location
+
+        handlers = {h['name']: h for h in devops_config.roles['nginx'].handlers}
+        # Every page template refreshes its .gz, whichever role tags a run selects
+        pages = (('nginx', 'Deploy custom index page'), ('monitoring', 'Create monitoring dashboard endpoint'))
+        for role, page in pages:
+            notify = devops_config.roles[role].task(page)['notify']
+            assert 'precompress static assets' in ([notify] if isinstance(notify, str) else notify), page
+        # The nginx role renders its handler from its own defaults
+        env = jinja2.Environment()
+        env.filters.update(bool=bool)
+        command = env.from_string(handlers['precompress static assets']['command'])
+        rendered = command.render(**devops_config.roles['nginx'].defaults)
+        assert rendered.startswith('/usr/bin/python3 /usr/local/lib/bb-iac-nginx/precompress.py --exclude status ')
+        snapshot_dir = devops_config.roles['monitoring'].defaults['dashboard_snapshot_url'].split('/')[1]
+        assert snapshot_dir in devops_config.roles['nginx'].defaults['nginx_precompress_exclude']
+        rendered = command.render(**dict(devops_config.roles['nginx'].defaults, nginx_precompress_exclude=['a', 'b']))
+        assert '--exclude a --exclude b ' in rendered
+
+
+class TestFingerprint:
+    """Test content-hashed asset publishing and generation collection"""
+
+    @pytest.fixture
+    def fingerprint(self, role_module):
+        return role_module('nginx', 'fingerprint')
+
+    def _publish(self, fingerprint, tmp_path, bundle, **files):
+        source = tmp_path / 'src' / bundle
+        source.mkdir(parents=True, exist_ok=True)
+        for name in list(p.name for p in source.iterdir()):
+            (source / name).unlink()
+        for name, text in files.items():
+            (source / name.replace('_', '.')).write_text(text)
+        return fingerprint.publish(str(source), str(tmp_path / 'assets'), bundle, str(tmp_path / 'assets.json'))
+
+    def test_changed_content_gets_a_new_url(self, fingerprint, tmp_path):
+        """Test URLs embed the content hash and stay put while content does"""
+        first = self._publish(fingerprint, tmp_path, 'nginx', site_css='body { color: #eee; }')
+        assert first['site.css'].startswith('/assets/site.') and first['site.css'].endswith('.css')
+        assert (tmp_path / 'assets' / first['site.css'].rsplit('/', 1)[1]).read_text() == 'body { color: #eee; }'
+        assert self._publish(fingerprint, tmp_path, 'nginx', site_css='body { color: #eee; }') == first
+        assert len(json.loads((tmp_path / 'assets.json').read_text())['bundles']['nginx']) == 1
+
+        second = self._publish(fingerprint, tmp_path, 'nginx', site_css='body { color: #fff; }')
+        assert second['site.css'] != first['site.css']
+
+    def test_old_generations_are_collected(self, fingerprint, tmp_path):
+        """Test the previous release stays servable, older ones and their variants go"""
+        assets = tmp_path / 'assets'
+        dashboard = self._publish(fingerprint, tmp_path, 'monitoring', monitoring_js='poll();')
+        urls = [self._publish(fingerprint, tmp_path, 'nginx', site_css=f'/* release {n} */')['site.css']
+                for n in range(3)]
+        names = [url.rsplit('/', 1)[1] for url in urls]
+        (assets / (names[2] + '.gz')).write_bytes(b'variant')
+        assert not (assets / names[0]).exists()
+        assert (assets / names[1]).exists() and (assets / (names[2] + '.gz')).exists()
+        # Another bundle's files are live as long as that bundle keeps them
+        assert (assets / dashboard['monitoring.js'].rsplit('/', 1)[1]).exists()
+
+        self._publish(fingerprint, tmp_path, 'nginx', site_css='/* release 3 */')
+        self._publish(fingerprint, tmp_path, 'nginx', site_css='/* release 4 */')
+        assert not (assets / (names[2] + '.gz')).exists()
+
+    def test_dry_run_prints_urls_without_writing(self, fingerprint, tmp_path, capsys):
+        """Test --dry-run (ansible --check) reports the URLs a publish would and leaves the host alone"""
+        source = tmp_path / 'src'
+        source.mkdir()
+        (source / 'site.css').write_text('body { color: #eee; }')
+        args = [str(source), str(tmp_path / 'assets'), '--bundle', 'nginx', '--manifest', str(tmp_path / 'assets.json')]
+        assert fingerprint.main(args + ['--dry-run']) == 0
+        planned = json.loads(capsys.readouterr().out)
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['src']
+        assert fingerprint.main(args) == 0
+        assert json.loads(capsys.readouterr().out) == planned
+
+    def test_publish_tasks_survive_check_mode(self, devops_config):
+        """Test the fingerprint commands run read-only under --check so asset_urls is always set"""
+        for role, task, result in [('nginx', 'Publish fingerprinted site assets', 'nginx_assets'),
+                                   ('monitoring', 'Publish fingerprinted dashboard assets', 'monitoring_assets')]:
+            publish = devops_config.roles[role].task(task)
+            assert publish['check_mode'] is False
+            assert "{{ '--dry-run' if ansible_check_mode else '' }}" in publish['command']
+            assert publish['register'] == result
+            urls = next(t for t in devops_config.roles[role].tasks if 'asset_urls' in t.get('set_fact', {}))
+            assert f"{result}.stdout | default('{{}}', true) | from_json" in urls['set_fact']['asset_urls']
+
+    def test_templates_link_published_assets(self, devops_config):
+        """Test pages carry no inline CSS/JS and only link assets a role publishes"""
+        for role, template in [('nginx', 'index.html.j2'), ('monitoring', 'monitoring.html.j2')]:
+            page = devops_config.roles[role].templates[template]
+            assert '<style>' not in page and '<script>' not in page
+            linked = set(re.findall(r"asset_urls\['([^']+)'\]", page))
+            assert linked
+            assert linked <= {p.name for p in devops_config.roles[role].files['assets/'].iterdir()}
+        locations = parse_nginx_locations(devops_config.roles['nginx'].templates['default.conf.j2'])
+        assert 'immutable' in locations['^~ /assets/']
+        assert 'immutable' not in locations['~* \\.(jpg|jpeg|png|gif|ico|css|js)$']
 
 
 class TestMonitoringRole:
     """Test monitoring role configuration"""
-    
-    def test_cloudwatch_configuration(self):
+
+    def test_cloudwatch_configuration(self, project_config):
         """Test CloudWatch agent configuration"""
-        cloudwatch_config = {
-            "metrics": {
-                "namespace": "BB-IaC-Pipeline",
-                "metrics_collected": {
-                    "cpu": {"measurement": ["cpu_usage_idle", "cpu_usage_user"]},
-                    "disk": {"measurement": ["used_percent"]},
-                    "mem": {"measurement": ["mem_used_percent"]}
-                }
-            },
-            "logs": {
-                "logs_collected": {
-                    "files": {
-                        "collect_list": [
-                            {"file_path": "/var/log/nginx/access.log"},
-                            {"file_path": "/var/log/nginx/error.log"},
-                            {"file_path": "/var/log/auth.log"}
-                        ]
-                    }
-                }
-            }
-        }
-        
+        cloudwatch_config = json.loads(project_config.roles['monitoring'].templates['cloudwatch-config.json.j2'])
+
         # Verify CloudWatch configuration
         assert 'metrics' in cloudwatch_config
         assert 'logs' in cloudwatch_config
         assert cloudwatch_config['metrics']['namespace'] == 'BB-IaC-Pipeline'
-        
+
         log_files = cloudwatch_config['logs']['logs_collected']['files']['collect_list']
         nginx_logs = [f for f in log_files if 'nginx' in f['file_path']]
         assert len(nginx_logs) >= 2, "Nginx access and error logs not configured"
-    
-    def test_log_rotation_configuration(self):
+
+    def test_log_rotation_configuration(self, project_config):
         """Test log rotation configuration"""
-        logrotate_config = {
-            "/var/log/bb-iac-monitor.log": {
-                "daily": True,
-                "rotate": 30,
-                "compress": True,
-                "delaycompress": True,
-                "missingok": True,
-                "notifempty": True
-            },
-            "/var/log/nginx/*.log": {
-                "daily": True,
-                "rotate": 52,
-                "compress": True,
-                "sharedscripts": True
-            }
-        }
-        
+        logrotate_config = parse_logrotate(project_config.roles['monitoring'].templates['app-logrotate.conf.j2'])
+        assert '/var/log/bb-iac-monitor.log' in logrotate_config
+        assert '/var/log/nginx/*.log' in logrotate_config
+
         # Verify log rotation settings
         for log_path, config in logrotate_config.items():
             assert config.get('daily') is True
             assert config.get('compress') is True
             assert isinstance(config.get('rotate'), int)
 
+    def test_metric_rollup_publishes_to_deployed_region(self, devops_config):
+        """Test the rollup service uses the region passed in, not a hard-wired default"""
+        role = devops_config.roles['monitoring']
+        template = jinja2.Template(role.templates['bb-iac-metric-rollup.service.j2'])
+        assert '--region us-east-1 ' in template.render(**role.defaults)
+        assert '--region eu-west-1 ' in template.render(**dict(role.defaults, aws_region='eu-west-1'))
+
+
+class TestLogTailer:
+    """Test the incremental auth.log tailer used by log-monitor.sh"""
+
+    @pytest.fixture
+    def logtail(self, role_module):
+        return role_module('monitoring', 'logtail')
+
+    def _append(self, path, *lines):
+        with open(path, 'ab') as f:
+            f.write(b''.join(line + b'\n' for line in lines))
+
+    def test_reads_only_new_complete_lines(self, logtail, tmp_path):
+        """Test each run resumes from the checkpoint and holds back partial lines"""
+        log = tmp_path / 'auth.log'
+        store = logtail.CheckpointStore(str(tmp_path / 'state.json'))
+        self._append(log, b'one', b'two')
+        with open(log, 'ab') as f:
+            f.write(b'thr')
+
+        assert list(logtail.LogTailer(str(log), store).lines()) == [b'one', b'two']
+        with open(log, 'ab') as f:
+            f.write(b'ee\n')
+        assert list(logtail.LogTailer(str(log), store).lines()) == [b'three']
+        assert list(logtail.LogTailer(str(log), store).lines()) == []
+
+        # Checkpoints survive a restart of the tool
+        store.save()
+        self._append(log, b'four')
+        reloaded = logtail.CheckpointStore(str(tmp_path / 'state.json'))
+        assert list(logtail.LogTailer(str(log), reloaded).lines()) == [b'four']
+
+    def test_follows_logrotate_rename(self, logtail, tmp_path):
+        """Test lines written just before a rotation are read from path.1"""
+        log = tmp_path / 'auth.log'
+        store = logtail.CheckpointStore(str(tmp_path / 'state.json'))
+        self._append(log, b'old-1')
+        list(logtail.LogTailer(str(log), store).lines())
+
+        # Written after our last run, then logrotate renames and `create`s a new file
+        self._append(log, b'old-2')
+        log.rename(tmp_path / 'auth.log.1')
+        self._append(log, b'new-1')
+
+        tailer = logtail.LogTailer(str(log), store)
+        assert list(tailer.lines()) == [b'old-2', b'new-1']
+        assert tailer.lost_rotations == 0
+
+    def test_follows_compressed_rotation(self, logtail, tmp_path):
+        """Test a rotation compressed straight away is read from path.1.gz"""
+        log = tmp_path / 'auth.log'
+        store = logtail.CheckpointStore(str(tmp_path / 'state.json'))
+        self._append(log, b'old-1')
+        list(logtail.LogTailer(str(log), store).lines())
+        self._append(log, b'old-2')
+        with gzip.open(tmp_path / 'auth.log.1.gz', 'wb') as f:
+            f.write(log.read_bytes())
+        log.unlink()
+        self._append(log, b'new-1')
+
+        assert list(logtail.LogTailer(str(log), store).lines()) == [b'old-2', b'new-1']
+
+    def test_daily_counters_keep_grep_semantics(self, logtail, tmp_path):
+        """Test today's counts accumulate across runs and reset at midnight"""
+        now = time.mktime((2025, 3, 7, 12, 0, 0, 0, 0, -1))
+        tomorrow = now + 86400
+        store = logtail.CheckpointStore(str(tmp_path / 'state.json'))
+
+        counters = logtail.DailyCounters(store, now)
+        counters.update([
+            b'Mar  7 11:59:01 web1 sshd[1]: pam_unix(sshd:auth): authentication failure; rhost=1.2.3.4',
+            b'Mar  7 11:59:02 web1 sshd[1]: Failed password for root from 1.2.3.4',
+            b'Mar  6 23:00:00 web1 sshd[1]: pam_unix(sshd:auth): authentication failure; rhost=1.2.3.4',
+            b'2025-03-07T11:59:03.000000+00:00 web1 sudo: pam_unix(sudo:auth): authentication failure',
+        ])
+        assert counters.values == {'day': '2025-03-07', 'auth_failures': 2, 'security_events': 1}
+
+        counters = logtail.DailyCounters(store, now)
+        counters.update([b'Mar  7 12:00:00 web1 sshd[2]: Connection closed: permission denied'])
+        assert counters.values['security_events'] == 2
+
+        assert logtail.DailyCounters(store, tomorrow).values['auth_failures'] == 0
+
+    def test_log_monitor_uses_tailer(self, devops_config):
+        """Test log-monitor.sh no longer greps the whole of auth.log"""
+        monitoring = devops_config.roles['monitoring']
+        script = monitoring.templates['log-monitor.sh.j2']
+        assert 'grep' not in script.split('# Check for disk space')[0]
+        assert 'logtail.py' in script
+        copied = {t['copy']['src'] for t in monitoring.tasks if 'copy' in t and 'src' in t['copy']}
+        assert copied <= set(monitoring.files)
+        assert 'logtail.py' in copied
+
+
+class TestMonitorAgent:
+    """Test the resident monitoring agent against a fake /proc"""
+
+    @pytest.fixture
+    def agent_module(self, role_module):
+        return role_module('monitoring', 'monitor_agent')
+
+    @pytest.fixture
+    def proc(self, tmp_path):
+        return fake_proc(tmp_path, meminfo={'MemTotal': 1000000, 'MemFree': 100000, 'MemAvailable': 400000},
+                         loadavg='0.52 0.40 0.31 1/123 4567', processes=[(4242, 1, 'nginx')], nginx_pid=4242)
+
+    def _probe(self, agent_module, proc, used_blocks=500):
+        return agent_module.HostProbe(str(proc), nginx_pidfile=str(proc.parent / 'nginx.pid'),
+                                      statvfs=fake_statvfs(used_blocks, reserved_blocks=50))
+
+    def test_probe_reads_proc_like_the_shell_tools(self, agent_module, proc):
+        """Test load, memory, disk and nginx readings match uptime/free/df/systemctl"""
+        sample = self._probe(agent_module, proc).sample()
+        assert sample.load == '0.52'
+        assert sample.memory_pct == 60
+        # df: used / (used + available), rounded up
+        assert sample.disk_pct == 53
+        assert sample.nginx_running
+
+        (proc / '4242' / 'comm').write_text('bash\n')
+        assert not self._probe(agent_module, proc).nginx_running()
+
+    def test_alerts_on_spike_and_reports_health(self, agent_module, proc, tmp_path):
+        """Test a spike is logged immediately and HEALTH keeps the cron format"""
+        log = tmp_path / 'monitor.log'
+        agent = agent_module.MonitorAgent(
+            self._probe(agent_module, proc), log_file=str(log),
+            auth_log=str(tmp_path / 'auth.log'), state_file=str(tmp_path / 'state.json'),
+        )
+        agent.tick(report=True)
+        assert log.read_text().splitlines()[-1].endswith('HEALTH: CPU Load: 0.52, Memory: 60%, Disk: 53%')
+
+        (proc / 'loadavg').write_text('3.10 0.90 0.40 1/123 4567\n')
+        agent.tick()
+        agent.tick()
+        lines = log.read_text().splitlines()
+        assert len(lines) == 2, "an active alert is only repeated on report ticks"
+        assert lines[-1].endswith('ALERT: High load average detected: 3.10')
+
+    def test_snapshot_feeds_every_dashboard_field(self, agent_module, proc, tmp_path, devops_config):
+        """Test each tick writes the JSON the dashboard polls, with every field it renders"""
+        (proc / 'uptime').write_text('7384.21 12000.00\n')
+        snapshot = tmp_path / 'status' / 'dashboard.json'
+        agent = agent_module.MonitorAgent(
+            self._probe(agent_module, proc), log_file=str(tmp_path / 'monitor.log'),
+            auth_log=str(tmp_path / 'auth.log'), state_file=str(tmp_path / 'state.json'),
+            snapshot=str(snapshot),
+        )
+        agent.tick()
+        data = json.loads(snapshot.read_text())
+        assert data['status'] == 'healthy'
+        assert data['uptime_seconds'] == 7384
+        assert data['services'] == {'nginx': True}
+        assert data['alerts'] == []
+
+        (proc / 'loadavg').write_text('3.10 0.90 0.40 1/123 4567\n')
+        agent.tick()
+        data = json.loads(snapshot.read_text())
+        assert data['status'] == 'warning'
+        assert data['alerts'] == ['ALERT: High load average detected: 3.10']
+        assert [p.name for p in snapshot.parent.iterdir()] == ['dashboard.json']
+
+        page = devops_config.roles['monitoring'].templates['monitoring.html.j2']
+        assert 'location.reload' not in page
+        paths = set(re.findall(r'data-(?:field|status)="([^"]+)"', page))
+        assert paths
+        for path in paths:
+            value = data
+            for key in path.split('.'):
+                value = value[key]
+
+    def test_service_unit_renders_from_defaults(self, devops_config):
+        """Test the systemd unit and its tasks use the role defaults"""
+        monitoring = devops_config.roles['monitoring']
+        unit = jinja2.Template(monitoring.templates['bb-iac-monitor-agent.service.j2']).render(**monitoring.defaults)
+        assert 'ExecStart=/usr/bin/python3 /usr/local/lib/bb-iac-monitor/monitor_agent.py' in unit
+        assert '--interval 10' in unit
+        assert 'Restart=always' in unit
+
+        cron = monitoring.task('Remove log monitoring cron job')
+        assert cron['cron']['state'] == 'absent'
+        assert monitoring.task('Start and enable monitoring agent')['systemd']['enabled'] is True
+
+
+class TestAuthDetector:
+    """Test the sliding-window auth failure detector and its agent wiring"""
+
+    @pytest.fixture
+    def auth_detector(self, role_module):
+        return role_module('monitoring', 'auth_detector')
+
+    def test_windows_slide_and_flag_once(self, auth_detector):
+        """Test per-source counts expire with the window and a breach is reported once"""
+        detector = auth_detector.AuthFailureDetector({'1m': 5, '5m': 10, '1h': 30})
+        start = 1_700_000_000
+        breaches = [detector.record('203.0.113.7', start + i) for i in range(7)]
+        assert breaches[:5] == [None] * 5
+        assert breaches[5] == ('1m', 6)
+        assert breaches[6] is None, "an already flagged source is not reported again"
+
+        assert detector.rates('203.0.113.7', start + 6) == {'1m': 7, '5m': 7, '1h': 7}
+        assert detector.rates('203.0.113.7', start + 120) == {'1m': 0, '5m': 7, '1h': 7}
+        assert detector.rates('203.0.113.7', start + 7200) == {'1m': 0, '5m': 0, '1h': 0}
+
+        assert detector.offenders(start + 6) == [('203.0.113.7', '1m', 7)]
+        assert detector.offenders(start + 7200) == []
+        assert detector.flagged == {}
+
+    def test_slow_brute_force_caught_by_hour_window(self, auth_detector):
+        """Test one failure every 90 s stays under 1m/5m but trips the 1h limit"""
+        detector = auth_detector.AuthFailureDetector({'1m': 5, '5m': 10, '1h': 30})
+        start = 1_700_000_000
+        breaches = [detector.record('198.51.100.9', start + i * 90) for i in range(31)]
+        assert [b for b in breaches if b] == [('1h', 31)]
+
+    def test_memory_bounded_by_lru_eviction(self, auth_detector):
+        """Test a spray of distinct sources keeps only the most recent ones"""
+        detector = auth_detector.AuthFailureDetector(max_sources=100)
+        start = 1_700_000_000
+        for i in range(10_000):
+            detector.record(f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}', start + i / 100)
+        assert len(detector.sources) == 100
+        assert detector.evicted == 9_900
+        assert '10.0.39.15' in detector.sources
+        assert '10.0.0.0' not in detector.sources
+        # Host-wide totals still see every failure
+        assert detector.totals(start + 100)['5m'] == 10_000
+
+    def test_parses_sshd_lines(self, auth_detector):
+        """Test source addresses and timestamps come from classic and RFC 3339 syslog lines"""
+        now = time.mktime((2025, 3, 7, 12, 0, 0, 0, 0, -1))
+        lines = [
+            b'Mar  7 11:59:01 web1 sshd[1]: Failed password for invalid user admin from 203.0.113.7 port 4242 ssh2',
+            b'Mar  7 11:59:02 web1 sshd[1]: Invalid user oracle from 203.0.113.8 port 4243',
+            b'2025-03-07T11:59:03.000000+00:00 web1 sshd[2]: Failed publickey for root from 2001:db8::5 port 22 ssh2',
+            b'Mar  7 11:59:04 web1 sshd[3]: Accepted publickey for ubuntu from 192.0.2.1 port 22 ssh2',
+            # Repeats an attempt sshd already logged
+            b'Mar  7 11:59:05 web1 sshd[4]: pam_unix(sshd:auth): authentication failure; '
+            b'logname= uid=0 euid=0 tty=ssh ruser= rhost=203.0.113.9',
+        ]
+        assert [auth_detector.failure_source(line) for line in lines] == [
+            '203.0.113.7', '203.0.113.8', '2001:db8::5', None, None,
+        ]
+        assert auth_detector.line_time(lines[0], now) == now - 59
+        assert auth_detector.line_time(b'Dec 31 23:59:59 web1 sshd[1]: x', now) < now
+        assert auth_detector.parse_limits('1m=3,1h=20') == {'1m': 3, '1h': 20}
+
+    def test_invalid_user_attempt_counts_once(self, auth_detector):
+        """Test the three lines sshd and PAM log for one invalid-user login are one failure"""
+        now = time.mktime((2025, 3, 7, 12, 0, 0, 0, 0, -1))
+        attempt = [
+            b'Mar  7 11:59:51 web1 sshd[2345]: Invalid user admin from 203.0.113.7 port 4242',
+            b'Mar  7 11:59:53 web1 sshd[2345]: pam_unix(sshd:auth): authentication failure; logname= uid=0 '
+            b'euid=0 tty=ssh ruser= rhost=203.0.113.7',
+            b'Mar  7 11:59:55 web1 sshd[2345]: Failed password for invalid user admin from 203.0.113.7 port 4242 ssh2',
+        ]
+        detector = auth_detector.AuthFailureDetector()
+        assert list(detector.feed(attempt, now)) == attempt
+        assert detector.rates('203.0.113.7', now)['1m'] == 1
+
+        # A second password on the same connection is a new attempt
+        retry = attempt[2].replace(b'11:59:55', b'11:59:58')
+        list(detector.feed([retry], now))
+        assert detector.rates('203.0.113.7', now)['1m'] == 2
+        assert not detector.invalid_users
+
+    def test_agent_bans_from_auth_log(self, role_module, tmp_path):
+        """Test the agent reads auth.log once, writes BAN lines and burst alerts"""
+        agent_module = role_module('monitoring', 'monitor_agent')
+        now = time.mktime((2025, 3, 7, 12, 0, 0, 0, 0, -1))
+        auth_log = tmp_path / 'auth.log'
+        auth_log.write_text(''.join(
+            f'Mar  7 11:59:{30 + i} web1 sshd[1]: Failed password for root from 203.0.113.7 port 22 ssh2\n'
+            for i in range(8)
+        ))
+
+        class Probe:
+            def sample(self):
+                return agent_module.Sample('0.10', 10, 10, True)
+
+        agent = agent_module.MonitorAgent(
+            Probe(), log_file=str(tmp_path / 'monitor.log'), auth_log=str(auth_log),
+            state_file=str(tmp_path / 'state.json'), clock=lambda: now, ban_log=str(tmp_path / 'bans.log'),
+        )
+        agent.tick()
+        agent.tick()
+        bans = (tmp_path / 'bans.log').read_text().splitlines()
+        assert len(bans) == 1
+        assert bans[0].endswith('BAN 203.0.113.7 failures=6 window=1m')
+        alerts = (tmp_path / 'monitor.log').read_text()
+        assert 'ALERT: Authentication failure burst from 203.0.113.7: 8 in 1m' in alerts
+        assert agent.store.get('counters:auth')['security_events'] == 8
+
+    def test_service_unit_passes_window_limits(self, devops_config):
+        """Test the unit renders the per-window limits from the role defaults"""
+        monitoring = devops_config.roles['monitoring']
+        unit = jinja2.Template(monitoring.templates['bb-iac-monitor-agent.service.j2']).render(**monitoring.defaults)
+        assert '--auth-limits 1m=5,5m=10,1h=30' in unit
+        assert '--ban-log /var/log/bb-iac-auth-bans.log' in unit
+        assert 'auth_detector.py' in {t['copy']['src'] for t in monitoring.tasks if 'copy' in t}
+
+
+class TestHealthCheck:
+    """Test the precomputed /health document against a fake /proc"""
+
+    @pytest.fixture
+    def health_check(self, role_module):
+        return role_module('monitoring', 'health_check')
+
+    @pytest.fixture
+    def proc(self, tmp_path):
+        processes = [(1, 0, 'systemd'), (4242, 1, 'nginx'), (4243, 4242, 'nginx'), (4244, 4242, 'nginx'),
+                     (900, 1, 'amazon-cloudwat')]
+        return fake_proc(tmp_path, meminfo={'MemTotal': 1000000, 'MemAvailable': 400000}, processes=processes,
+                         nginx_pid=4242)
+
+    def _checker(self, health_check, proc, path, used_blocks=500):
+        probe = health_check.HealthProbe(str(proc), nginx_pidfile=str(proc.parent / 'nginx.pid'),
+                                         statvfs=fake_statvfs(used_blocks))
+        return health_check.HealthChecker(probe, path=str(path), version='1.0.0', host='web1',
+                                          clock=lambda: 1_700_000_000)
+
+    def test_deep_checks_set_status(self, health_check, proc, tmp_path):
+        """Test nginx workers, disk and memory decide the status; the CloudWatch agent is only reported"""
+        health = tmp_path / 'html' / 'health'
+        document = self._checker(health_check, proc, health).check()
+        assert document['status'] == 'healthy'
+        assert document['version'] == '1.0.0'
+        assert document['timestamp'] == '2023-11-14T22:13:20Z'
+        assert document['checks']['nginx'] == {'status': 'ok', 'master': True, 'workers': 2}
+        assert document['checks']['memory']['used_pct'] == 60
+
+        shutil.rmtree(proc / '900')
+        document = self._checker(health_check, proc, health).check()
+        assert document['status'] == 'healthy'
+        assert document['checks']['cloudwatch_agent'] == {'status': 'ok', 'running': False}
+
+        document = self._checker(health_check, proc, health, used_blocks=900).check()
+        assert document['status'] == 'degraded'
+        assert document['checks']['disk']['status'] == 'warn'
+
+    def test_unhealthy_document_moves_to_error_page(self, health_check, proc, tmp_path):
+        """Test the status file is swapped atomically between the 200 and 503 paths"""
+        health = tmp_path / 'health'
+        checker = self._checker(health_check, proc, health)
+        checker.check()
+        assert json.loads(health.read_text())['status'] == 'healthy'
+
+        (proc / '4242' / 'comm').write_text('bash\n')
+        checker.check()
+        assert not health.exists()
+        down = json.loads((tmp_path / 'health.unhealthy').read_text())
+        assert down['status'] == 'unhealthy'
+        assert down['checks']['nginx']['status'] == 'fail'
+
+        (proc / '4242' / 'comm').write_text('nginx\n')
+        checker.check()
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['health', 'nginx.pid', 'proc']
+
+    def test_service_and_nginx_location_use_defaults(self, devops_config):
+        """Test the unit writes the file nginx serves and reports the play's app_version"""
+        monitoring = devops_config.roles['monitoring']
+        variables = dict(monitoring.defaults, app_version=devops_config.play['vars']['app_version'])
+        unit = jinja2.Template(monitoring.templates['bb-iac-health-check.service.j2']).render(**variables)
+        args = jinja2.Template(monitoring.templates['health-check.args.j2']).render(**variables).splitlines()
+        assert '--version=1.0.0' in args
+        assert '--disk-fail=95' in args and '--min-workers=1' in args
+        assert args[-1] == monitoring.defaults['health_status_file']
+        args_file = monitoring.task('Configure health checker arguments')['template']['dest']
+        assert args_file == '{{ monitor_lib_dir }}/health-check.args'
+        assert f"@{monitoring.defaults['monitor_lib_dir']}/health-check.args" in unit
+        assert monitoring.task('Start and enable health checker')['systemd']['enabled'] is True
+
+        # The deploy gate checks with the service's thresholds, not the script's built-in ones
+        gate = next(t for t in devops_config.play['post_tasks'] if t['name'] == 'Verify health status')
+        assert gate['command'].endswith('--once @{{ monitor_lib_dir }}/health-check.args')
+
+        locations = parse_nginx_locations(devops_config.roles['nginx'].templates['default.conf.j2'])
+        assert 'return' not in locations['/health']
+        assert 'try_files /health =503;' in locations['/health']
+        assert 'internal;' in locations['= /health.unhealthy']
+
+
+class TestNginxLogStats:
+    """Test the bb_timing access log format and its analyzer"""
+
+    @pytest.fixture
+    def log_stats(self, role_module):
+        return role_module('monitoring', 'nginx_log_stats')
+
+    def _write_log(self, path, start, count, route=lambda i: '/', status=lambda i: 200, latency=lambda i: 0.010):
+        with open(path, 'a') as f:
+            for i in range(count):
+                f.write(f'{start + i * 0.01:.3f}\t203.0.113.{i % 200}\tGET\t{route(i)}\t{status(i)}\t'
+                        f'612\t850\t{latency(i):.3f}\t-\t"curl/8.0"\n')
+
+    def test_log_format_matches_analyzer_fields(self, devops_config, log_stats):
+        """Test default.conf.j2 logs the fields in the order the analyzer reads them"""
+        config = devops_config.roles['nginx'].templates['default.conf.j2']
+        log_format = config.split('log_format bb_timing', 1)[1].split(';', 1)[0]
+        variables = re.findall(r'\$(\w+)', log_format)
+        assert variables[log_stats.F_MSEC] == 'msec'
+        assert variables[log_stats.F_URI] == 'uri'
+        assert variables[log_stats.F_STATUS] == 'status'
+        assert variables[log_stats.F_BYTES] == 'bytes_sent'
+        assert variables[log_stats.F_REQUEST_TIME] == 'request_time'
+        assert variables[log_stats.F_UPSTREAM_TIME] == 'upstream_response_time'
+        assert 'access_log /var/log/nginx/access.log bb_timing' in config
+
+    def test_route_rates_statuses_and_percentiles(self, log_stats, tmp_path):
+        """Test per-route rate, 5xx share and latency percentiles"""
+        log = tmp_path / 'access.log'
+        self._write_log(log, 1_700_000_000, 1000,
+                        route=lambda i: '/health' if i % 2 else '/',
+                        status=lambda i: 502 if i % 10 == 0 else 200,
+                        latency=lambda i: (i % 100 + 1) / 1000)
+        stats = log_stats.AccessLogStats()
+        stats.add_file(str(log))
+        data = stats.as_dict()
+
+        assert data['total']['requests'] == 1000
+        assert data['total']['error_rate_5xx'] == pytest.approx(0.10)
+        assert data['total']['latency_ms']['p50'] == pytest.approx(50, rel=0.03)
+        assert data['total']['latency_ms']['p99'] == pytest.approx(99, rel=0.03)
+        assert data['routes']['/']['statuses'] == {'200': 400, '502': 100}
+        assert data['routes']['/health']['rate_rps'] == pytest.approx(50, rel=0.01)
+
+    def test_since_seeks_instead_of_scanning(self, log_stats, tmp_path):
+        """Test a time window only counts (and reads) the matching tail"""
+        log = tmp_path / 'access.log'
+        self._write_log(log, 1_700_000_000, 5000)
+        stats = log_stats.AccessLogStats()
+        stats.add_file(str(log), since=1_700_000_000 + 45)
+        assert stats.total.requests == 500
+        assert stats.malformed == 0
+
+    def test_route_cardinality_is_bounded(self, log_stats, tmp_path):
+        """Test scanners hitting random URIs cannot grow memory without bound"""
+        log = tmp_path / 'access.log'
+        self._write_log(log, 1_700_000_000, 500, route=lambda i: f'/probe-{i}')
+        stats = log_stats.AccessLogStats(max_routes=50)
+        stats.add_file(str(log))
+        assert len(stats.routes) == 51
+        assert stats.routes[log_stats.OTHER_ROUTE].requests == 450
+
+
+class TestLogArchive:
+    """Test the rotated-archive indexer and its query tool"""
+
+    @pytest.fixture
+    def log_archive(self, role_module):
+        return role_module('monitoring', 'log_archive')
+
+    @pytest.fixture
+    def rotated_logs(self, tmp_path):
+        """access.log with three rotated generations an hour apart"""
+        log = tmp_path / 'access.log'
+
+        def generation(start, clients):
+            return ''.join(
+                f'{start + i:.3f}\t{clients[i % len(clients)]}\tGET\t/page-{i % 5}\t{404 if i % 7 == 0 else 200}\t'
+                f'10\t200\t0.002\t-\t"curl"\n'
+                for i in range(600)
+            )
+
+        hour = 1_700_000_000
+        with gzip.open(tmp_path / 'access.log.3.gz', 'wt') as f:
+            f.write(generation(hour, ['198.51.100.1', '198.51.100.2']))
+        with gzip.open(tmp_path / 'access.log.2.gz', 'wt') as f:
+            f.write(generation(hour + 3600, ['198.51.100.3']))
+        (tmp_path / 'access.log.1').write_text(generation(hour + 7200, ['198.51.100.4']))
+        log.write_text(generation(hour + 10800, ['198.51.100.5']))
+        return log, hour
+
+    def test_index_records_range_lines_and_bloom(self, log_archive, rotated_logs, tmp_path):
+        """Test each archive gets a time range, line count and bloom filter"""
+        log, hour = rotated_logs
+        index = log_archive.ArchiveIndex(str(tmp_path / 'index.json'))
+        assert index.update([str(log)]) == 3
+        index.save()
+
+        entry = next(e for e in index.entries.values() if e['path'].endswith('.2.gz'))
+        assert entry['lines'] == 600
+        assert (entry['first'], entry['last']) == (hour + 3600, hour + 3600 + 599)
+        bloom = log_archive.BloomFilter.from_dict(entry['bloom'])
+        assert b'ip:198.51.100.3' in bloom
+        assert b'status:404' in bloom
+
+        # A rename keeps the fingerprint, size and mtime, so the entry stays valid
+        reloaded = log_archive.ArchiveIndex(str(tmp_path / 'index.json'))
+        for old, new in [('3.gz', '4.gz'), ('2.gz', '3.gz'), ('1', '2')]:
+            (tmp_path / f'access.log.{old}').rename(tmp_path / f'access.log.{new}')
+        assert reloaded.update([str(log)]) == 0
+
+    def test_archive_appended_after_indexing_is_reindexed(self, log_archive, rotated_logs, tmp_path):
+        """Test lines nginx writes to .1 after the rotate hook ran are not pruned"""
+        log, hour = rotated_logs
+        index = log_archive.ArchiveIndex(str(tmp_path / 'index.json'))
+        index.update([str(log)])
+
+        late = hour + 7200 + 900
+        with open(tmp_path / 'access.log.1', 'a') as f:
+            f.write(f'{late:.3f}\t198.51.100.4\tGET\t/late\t200\t10\t200\t0.002\t-\t"curl"\n')
+        # Same first bytes, so the same fingerprint; size and mtime have moved on
+        os.utime(tmp_path / 'access.log.1', ns=(0, 1))
+
+        query = log_archive.Query(since=late, until=late + 1)
+        candidates, lines = log_archive.search(index, [str(log)], query, workers=1)
+        assert str(tmp_path / 'access.log.1') in candidates
+        assert len(lines) == 1
+
+        assert index.update([str(log)]) == 1
+        entry = next(e for e in index.entries.values() if e['path'].endswith('.1'))
+        assert (entry['last'], entry['lines']) == (late, 601)
+
+    def test_query_skips_archives_that_cannot_match(self, log_archive, rotated_logs, tmp_path):
+        """Test time window and bloom pruning leave only matching archives to scan"""
+        log, hour = rotated_logs
+        index = log_archive.ArchiveIndex(str(tmp_path / 'index.json'))
+        index.update([str(log)])
+
+        query = log_archive.Query(since=hour + 3000, until=hour + 8000, ip='198.51.100.4', status='404')
+        candidates, lines = log_archive.search(index, [str(log)], query, workers=2)
+
+        # .3.gz is out of range, .2.gz fails the bloom filter, the live log is always read
+        assert sorted(p.rsplit('/', 1)[1] for p in candidates) == ['access.log', 'access.log.1']
+        assert len(lines) == 86
+        assert all(b'\t198.51.100.4\t' in line and b'\t404\t' in line for line in lines)
+
+    def test_hooks_are_wired_into_logrotate(self, devops_config):
+        """Test both logrotate stanzas index archives after rotating"""
+        template = devops_config.roles['monitoring'].templates['app-logrotate.conf.j2']
+        assert template.count('log_archive.py') == 2
+        assert 'log_archive.py' in devops_config.roles['monitoring'].files
+
 
 class TestConfigurationIntegration:
     """Test integration between configuration components"""
-    
-    def test_role_dependencies(self):
+
+    def test_role_dependencies(self, devops_config):
         """Test role dependencies are properly defined"""
-        role_order = ['security', 'nginx', 'monitoring']
-        
+        role_order = devops_config.role_order
+
         # Security should come first
         assert role_order.index('security') == 0
-        
+
         # Nginx should come before monitoring (monitoring needs web server logs)
         assert role_order.index('nginx') < role_order.index('monitoring')
-    
-    def test_handler_notifications(self):
+
+    def test_handler_notifications(self, devops_config):
         """Test handlers are properly configured"""
-        handlers = [
-            {"name": "restart nginx", "service": {"name": "nginx", "state": "restarted"}},
-            {"name": "restart ufw", "service": {"name": "ufw", "state": "restarted"}},
-            {"name": "restart fail2ban", "service": {"name": "fail2ban", "state": "restarted"}}
-        ]
-        
+        handler_names = devops_config.handler_names
+
         # Verify critical handlers exist
-        handler_names = [h['name'] for h in handlers]
         assert 'restart nginx' in handler_names
-        assert 'restart ufw' in handler_names
+        assert 'enable ufw' in handler_names
         assert 'restart fail2ban' in handler_names
-    
-    @patch('builtins.open', new_callable=mock_open, read_data='test content')
-    def test_template_files_exist(self, mock_file):
+
+        # Every notification must resolve to a handler
+        for role in devops_config.roles.values():
+            missing = role.notifications - handler_names
+            assert not missing, f"Role {role.name} notifies undefined handlers: {sorted(missing)}"
+
+    def test_template_files_exist(self, project_config):
         """Test required template files exist"""
-        required_templates = [
-            'index.html.j2',
-            'security-headers.conf.j2',
-            'default.conf.j2',
-            'cloudwatch-config.json.j2',
-            'log-monitor.sh.j2'
-        ]
-        
-        for template in required_templates:
-            # Mock file existence check
-            try:
-                with open(f'/mock/path/{template}', 'r') as f:
-                    content = f.read()
-                    assert len(content) > 0, f"Template {template} appears to be empty"
-            except Exception:
-                pass  # Mock will handle this
+        required_templates = {
+            'nginx': ['index.html.j2', 'security-headers.conf.j2', 'default.conf.j2'],
+            'monitoring': ['cloudwatch-config.json.j2', 'log-monitor.sh.j2']
+        }
+
+        for role_name, templates in required_templates.items():
+            role = project_config.roles[role_name]
+            for template in templates:
+                assert template in role.templates, f"Template {template} missing from {role_name} role"
+                assert len(role.templates[template]) > 0, f"Template {template} appears to be empty"
+
+    def test_role_templates_resolve(self, devops_config):
+        """Test every template task in a role points at a shipped template"""
+        for role in devops_config.roles.values():
+            for task in role.tasks:
+                if 'template' in task:
+                    src = task['template']['src']
+                    assert src in role.templates, f"Role {role.name} task '{task['name']}' uses missing template {src}"
 
 
 if __name__ == "__main__":
-    pytest.main([__file__, "-v"])
\ No newline at end of file
+    pytest.main([__file__, "-v"])
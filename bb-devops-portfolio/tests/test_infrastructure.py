@@ -4,11 +4,20 @@ Tests Terraform-deployed AWS resources and configurations
 """
 
 import boto3
+import gzip
 import pytest
 import json
-from moto import mock_aws
+import os
+import time
+from datetime import datetime, timezone
 from unittest.mock import patch, MagicMock
 
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+from support.fakeproc import fake_proc, fake_statvfs
+from support.scripts import plandiff, tfstate
+from support.terraform import TERRAFORM_DIR, TerraformOutputs
+
 
 class TestTerraformInfrastructure:
     """Test suite for Terraform infrastructure components"""
@@ -18,156 +27,122 @@ class TestTerraformInfrastructure:
         self.aws_region = "us-east-1"
         self.project_name = "bb-iac-pipeline"
         
-    def test_vpc_configuration(self):
+    def test_vpc_configuration(self, aws_client, baseline_topology):
         """Test VPC is properly configured"""
-        with mock_aws():
-            ec2 = boto3.client('ec2', region_name=self.aws_region)
-            
-            # Create mock VPC for testing
-            vpc = ec2.create_vpc(CidrBlock='10.0.0.0/16')
-            vpc_id = vpc['Vpc']['VpcId']
-            
-            # Tag the VPC
-            ec2.create_tags(
-                Resources=[vpc_id],
-                Tags=[
-                    {'Key': 'Name', 'Value': f'{self.project_name}-vpc'},
-                    {'Key': 'Project', 'Value': 'BB Engineering Portfolio'}
-                ]
-            )
-            
-            # Verify VPC exists and has correct configuration
-            vpcs = ec2.describe_vpcs(VpcIds=[vpc_id])
-            assert len(vpcs['Vpcs']) == 1
-            assert vpcs['Vpcs'][0]['CidrBlock'] == '10.0.0.0/16'
-            assert vpcs['Vpcs'][0]['State'] == 'available'
+        ec2 = aws_client('ec2')
+        vpc_id = baseline_topology.vpc_id
+        
+        # Verify VPC exists and has correct configuration
+        vpcs = ec2.describe_vpcs(VpcIds=[vpc_id])
+        assert len(vpcs['Vpcs']) == 1
+        assert vpcs['Vpcs'][0]['CidrBlock'] == '10.0.0.0/16'
+        assert vpcs['Vpcs'][0]['State'] == 'available'
+        
+        # Verify DNS support matches terraform/main.tf
+        dns_hostnames = ec2.describe_vpc_attribute(VpcId=vpc_id, Attribute='enableDnsHostnames')
+        assert dns_hostnames['EnableDnsHostnames']['Value'] is True
+        
+        # Verify default tags are applied
+        tags = {tag['Key']: tag['Value'] for tag in vpcs['Vpcs'][0].get('Tags', [])}
+        assert tags['Name'] == f'bb-iac-vpc-{baseline_topology.suffix}'
+        assert tags['ManagedBy'] == 'terraform'
     
-    def test_subnet_configuration(self):
+    def test_subnet_configuration(self, aws_client, baseline_topology):
         """Test public subnet configuration"""
-        with mock_aws():
-            ec2 = boto3.client('ec2', region_name=self.aws_region)
-            
-            # Create VPC first
-            vpc = ec2.create_vpc(CidrBlock='10.0.0.0/16')
-            vpc_id = vpc['Vpc']['VpcId']
-            
-            # Create subnet
-            subnet = ec2.create_subnet(
-                VpcId=vpc_id,
-                CidrBlock='10.0.1.0/24',
-                AvailabilityZone=f'{self.aws_region}a'
-            )
-            subnet_id = subnet['Subnet']['SubnetId']
-            
-            # Verify subnet configuration
-            subnets = ec2.describe_subnets(SubnetIds=[subnet_id])
-            assert len(subnets['Subnets']) == 1
-            assert subnets['Subnets'][0]['CidrBlock'] == '10.0.1.0/24'
-            assert subnets['Subnets'][0]['VpcId'] == vpc_id
+        ec2 = aws_client('ec2')
+        subnet_id = baseline_topology.subnet_id
+        
+        # Verify subnet configuration
+        subnets = ec2.describe_subnets(SubnetIds=[subnet_id])
+        assert len(subnets['Subnets']) == 1
+        assert subnets['Subnets'][0]['CidrBlock'] == '10.0.1.0/24'
+        assert subnets['Subnets'][0]['VpcId'] == baseline_topology.vpc_id
+        assert subnets['Subnets'][0]['AvailabilityZone'] == f'{self.aws_region}a'
+        assert subnets['Subnets'][0]['MapPublicIpOnLaunch'] is True
     
-    def test_security_group_rules(self):
+    def test_security_group_rules(self, aws_client, baseline_topology):
         """Test security group has proper rules"""
-        with mock_aws():
-            ec2 = boto3.client('ec2', region_name=self.aws_region)
-            
-            # Create VPC and security group
-            vpc = ec2.create_vpc(CidrBlock='10.0.0.0/16')
-            vpc_id = vpc['Vpc']['VpcId']
-            
-            sg = ec2.create_security_group(
-                GroupName=f'{self.project_name}-sg',
-                Description='Security group for BB IaC pipeline',
-                VpcId=vpc_id
-            )
-            sg_id = sg['GroupId']
-            
-            # Add SSH rule
-            ec2.authorize_security_group_ingress(
-                GroupId=sg_id,
-                IpPermissions=[
-                    {
-                        'IpProtocol': 'tcp',
-                        'FromPort': 22,
-                        'ToPort': 22,
-                        'IpRanges': [{'CidrIp': '0.0.0.0/0'}]
-                    }
-                ]
-            )
-            
-            # Add HTTP rule
-            ec2.authorize_security_group_ingress(
-                GroupId=sg_id,
-                IpPermissions=[
-                    {
-                        'IpProtocol': 'tcp',
-                        'FromPort': 80,
-                        'ToPort': 80,
-                        'IpRanges': [{'CidrIp': '0.0.0.0/0'}]
-                    }
-                ]
-            )
-            
-            # Verify security group rules
-            sgs = ec2.describe_security_groups(GroupIds=[sg_id])
-            sg_rules = sgs['SecurityGroups'][0]['IpPermissions']
-            
-            # Check SSH rule exists
-            ssh_rule_exists = any(
-                rule['FromPort'] == 22 and rule['ToPort'] == 22 
-                for rule in sg_rules
-            )
-            assert ssh_rule_exists, "SSH rule not found in security group"
-            
-            # Check HTTP rule exists
-            http_rule_exists = any(
-                rule['FromPort'] == 80 and rule['ToPort'] == 80 
-                for rule in sg_rules
-            )
-            assert http_rule_exists, "HTTP rule not found in security group"
+        ec2 = aws_client('ec2')
+        sg_id = baseline_topology.security_group_id
+        
+        # Verify security group rules
+        sgs = ec2.describe_security_groups(GroupIds=[sg_id])
+        assert sgs['SecurityGroups'][0]['VpcId'] == baseline_topology.vpc_id
+        sg_rules = sgs['SecurityGroups'][0]['IpPermissions']
+        
+        # Check SSH rule exists
+        ssh_rule_exists = any(
+            rule['FromPort'] == 22 and rule['ToPort'] == 22 
+            for rule in sg_rules
+        )
+        assert ssh_rule_exists, "SSH rule not found in security group"
+        
+        # Check HTTP rule exists
+        http_rule_exists = any(
+            rule['FromPort'] == 80 and rule['ToPort'] == 80 
+            for rule in sg_rules
+        )
+        assert http_rule_exists, "HTTP rule not found in security group"
+        
+        # Check HTTPS rule exists
+        https_rule_exists = any(
+            rule['FromPort'] == 443 and rule['ToPort'] == 443 
+            for rule in sg_rules
+        )
+        assert https_rule_exists, "HTTPS rule not found in security group"
     
-    def test_s3_bucket_configuration(self):
-        """Test S3 bucket security and configuration"""
-        with mock_aws():
-            s3 = boto3.client('s3', region_name=self.aws_region)
-            
-            bucket_name = f'{self.project_name}-config-test'
-            
-            # Create bucket
-            s3.create_bucket(Bucket=bucket_name)
-            
-            # Enable versioning
-            s3.put_bucket_versioning(
-                Bucket=bucket_name,
-                VersioningConfiguration={'Status': 'Enabled'}
-            )
-            
-            # Block public access
-            s3.put_public_access_block(
-                Bucket=bucket_name,
-                PublicAccessBlockConfiguration={
-                    'BlockPublicAcls': True,
-                    'IgnorePublicAcls': True,
-                    'BlockPublicPolicy': True,
-                    'RestrictPublicBuckets': True
+    def test_security_group_changes_are_reset(self, aws_client, baseline_topology):
+        """Test rules added by a test do not leak into the shared baseline"""
+        ec2 = aws_client('ec2')
+        sg_id = baseline_topology.security_group_id
+        
+        ec2.authorize_security_group_ingress(
+            GroupId=sg_id,
+            IpPermissions=[
+                {
+                    'IpProtocol': 'tcp',
+                    'FromPort': 3389,
+                    'ToPort': 3389,
+                    'IpRanges': [{'CidrIp': '0.0.0.0/0'}]
                 }
-            )
-            
-            # Verify bucket exists
-            buckets = s3.list_buckets()
-            bucket_names = [bucket['Name'] for bucket in buckets['Buckets']]
-            assert bucket_name in bucket_names
-            
-            # Verify versioning is enabled
-            versioning = s3.get_bucket_versioning(Bucket=bucket_name)
-            assert versioning['Status'] == 'Enabled'
-            
-            # Verify public access is blocked
-            public_access = s3.get_public_access_block(Bucket=bucket_name)
-            config = public_access['PublicAccessBlockConfiguration']
-            assert config['BlockPublicAcls'] is True
-            assert config['IgnorePublicAcls'] is True
-            assert config['BlockPublicPolicy'] is True
-            assert config['RestrictPublicBuckets'] is True
+            ]
+        )
+        extra_vpc = ec2.create_vpc(CidrBlock='10.1.0.0/16')['Vpc']['VpcId']
+        
+        baseline_topology.reset()
+        
+        sg_rules = ec2.describe_security_groups(GroupIds=[sg_id])['SecurityGroups'][0]['IpPermissions']
+        assert not any(rule['FromPort'] == 3389 for rule in sg_rules), "Test rule leaked into baseline"
+        vpc_ids = [vpc['VpcId'] for vpc in ec2.describe_vpcs()['Vpcs']]
+        assert extra_vpc not in vpc_ids, "Test VPC leaked into baseline"
+        assert baseline_topology.vpc_id in vpc_ids
+    
+    def test_s3_bucket_configuration(self, aws_client, baseline_topology):
+        """Test S3 bucket security and configuration"""
+        s3 = aws_client('s3')
+        bucket_name = baseline_topology.bucket_name
+        
+        # Verify bucket exists
+        buckets = s3.list_buckets()
+        bucket_names = [bucket['Name'] for bucket in buckets['Buckets']]
+        assert bucket_name in bucket_names
+        
+        # Verify versioning is enabled
+        versioning = s3.get_bucket_versioning(Bucket=bucket_name)
+        assert versioning['Status'] == 'Enabled'
+        
+        # Verify server-side encryption is configured
+        encryption = s3.get_bucket_encryption(Bucket=bucket_name)
+        rule = encryption['ServerSideEncryptionConfiguration']['Rules'][0]
+        assert rule['ApplyServerSideEncryptionByDefault']['SSEAlgorithm'] == 'AES256'
+        
+        # Verify public access is blocked
+        public_access = s3.get_public_access_block(Bucket=bucket_name)
+        config = public_access['PublicAccessBlockConfiguration']
+        assert config['BlockPublicAcls'] is True
+        assert config['IgnorePublicAcls'] is True
+        assert config['BlockPublicPolicy'] is True
+        assert config['RestrictPublicBuckets'] is True
     
     @patch('boto3.client')
     def test_ec2_instance_tags(self, mock_boto_client):
@@ -203,37 +178,537 @@ class TestTerraformInfrastructure:
         assert 'ManagedBy' in tags
         assert tags['ManagedBy'] == 'Terraform'
     
-    def test_terraform_state_structure(self):
-        """Test Terraform state file structure (mock)"""
-        # Mock Terraform state structure
-        mock_state = {
-            "version": 4,
-            "terraform_version": "1.0.0",
-            "resources": [
-                {
-                    "type": "aws_vpc",
-                    "name": "main",
-                    "instances": [{"attributes": {"cidr_block": "10.0.0.0/16"}}]
+    def test_terraform_state_structure(self, tmp_path):
+        """Test the streaming reader indexes a v4 state file"""
+        state_file = tmp_path / "terraform.tfstate"
+        state_file.write_text(json.dumps(make_state(web_instances=2)))
+        
+        # A tiny chunk size forces tokens to straddle chunk boundaries
+        index = tfstate.load_index(state_file, chunk_size=7)
+        assert index.metadata["version"] == 4
+        assert index.outputs["vpc_id"]["value"] == "vpc-0abc"
+        
+        # Check VPC resource
+        assert index["aws_vpc.main"].attributes["cidr_block"] == "10.0.0.0/16"
+        
+        # Check EC2 resources (count instances carry their index key)
+        assert [r.address for r in index.of_type("aws_instance")] == ["aws_instance.web[0]", "aws_instance.web[1]"]
+        assert index.attribute("aws_instance", "public_ip") == ["54.0.0.10", "54.0.0.11"]
+        assert index["aws_instance.web[0]"].attributes["instance_type"] == "t3.micro"
+        
+        # Tag index - random_string has no tags and is not taggable
+        assert [r.address for r in index.missing_tag("ManagedBy")] == ["aws_s3_bucket.untagged"]
+        assert len(index.with_tag("Project", "bb-iac-pipeline")) == len(index.taggable) - 1
+
+
+def make_state(web_instances=1, extra_buckets=0):
+    """Terraform v4 state shaped like an apply of terraform/main.tf"""
+    default_tags = {"Project": "bb-iac-pipeline", "ManagedBy": "terraform"}
+    
+    def resource(type, name, instances, mode="managed"):
+        return {
+            "mode": mode, "type": type, "name": name,
+            "provider": 'provider["registry.terraform.io/hashicorp/aws"]',
+            "instances": instances,
+        }
+    
+    def instance(attributes, index_key=None, tags=default_tags):
+        if tags is not None:
+            attributes = dict(attributes, tags={"Name": "x \\ \"quoted\" ü"}, tags_all=dict(tags))
+        entry = {"schema_version": 1, "attributes": attributes, "sensitive_attributes": []}
+        if index_key is not None:
+            entry["index_key"] = index_key
+        return entry
+    
+    resources = [
+        resource("random_string", "suffix", [instance({"result": "abc123"}, tags=None)]),
+        resource("aws_vpc", "main", [instance({"id": "vpc-0abc", "cidr_block": "10.0.0.0/16"})]),
+        resource("aws_instance", "web", [
+            instance({"id": f"i-{i}", "instance_type": "t3.micro", "public_ip": f"54.0.0.{10 + i}"}, index_key=i)
+            for i in range(web_instances)
+        ]),
+        resource("aws_s3_bucket", "untagged", [instance({"bucket": "b"}, tags={})]),
+        resource("aws_region", "current", [instance({"id": "eu-west-1", "name": "eu-west-1"}, tags=None)], mode="data"),
+    ]
+    resources += [
+        resource("aws_s3_bucket", f"extra_{i}", [instance({"bucket": f"bucket-{i}", "arn": "arn:" + "x" * 200})])
+        for i in range(extra_buckets)
+    ]
+    return {
+        "version": 4, "terraform_version": "1.5.7", "serial": 12, "lineage": "test-lineage",
+        "outputs": {"vpc_id": {"value": "vpc-0abc", "type": "string"}},
+        "resources": resources,
+        "check_results": None,
+    }
+
+
+class TestTerraformStateReader:
+    """Test the streaming state/plan reader in scripts/tfstate.py"""
+    
+    def test_matches_full_json_load(self, tmp_path):
+        """Test streamed resources equal a full json.load of a large state"""
+        state = make_state(web_instances=50, extra_buckets=500)
+        state_file = tmp_path / "terraform.tfstate"
+        state_file.write_text(json.dumps(state, indent=2))
+        
+        index = tfstate.load_index(state_file, chunk_size=4096)
+        expected = sum(len(r["instances"]) for r in state["resources"])
+        assert len(index) == expected
+        assert index["aws_s3_bucket.extra_499"].attributes == state["resources"][-1]["instances"][0]["attributes"]
+    
+    def test_show_json_with_child_modules(self, tmp_path):
+        """Test `terraform show -json` documents, including nested modules"""
+        show = {
+            "format_version": "1.0",
+            "values": {
+                "outputs": {"web_instance_public_ip": {"value": "54.0.0.10", "sensitive": False}},
+                "root_module": {
+                    "resources": [{"address": "aws_instance.web", "mode": "managed", "type": "aws_instance",
+                                   "name": "web", "values": {"public_ip": "54.0.0.10", "tags_all": {}}}],
+                    "child_modules": [{
+                        "address": "module.edge",
+                        "resources": [{"address": "module.edge.aws_instance.proxy", "mode": "managed",
+                                       "type": "aws_instance", "name": "proxy",
+                                       "values": {"public_ip": "54.0.0.20", "tags_all": {"ManagedBy": "terraform"}}}],
+                    }],
                 },
-                {
-                    "type": "aws_instance",
-                    "name": "app_server",
-                    "instances": [{"attributes": {"instance_type": "t3.micro"}}]
-                }
-            ]
+            },
         }
+        show_file = tmp_path / "show.json"
+        show_file.write_text(json.dumps(show))
         
-        # Verify state structure
-        assert mock_state["version"] == 4
-        assert len(mock_state["resources"]) >= 2
+        index = tfstate.load_index(show_file, chunk_size=16)
+        assert index.attribute("aws_instance", "public_ip") == ["54.0.0.10", "54.0.0.20"]
+        assert index["module.edge.aws_instance.proxy"].module == "module.edge"
+        assert [r.address for r in index.missing_tag("ManagedBy")] == ["aws_instance.web"]
+        assert index.outputs["web_instance_public_ip"]["value"] == "54.0.0.10"
+    
+    def test_cli_query_for_inventory(self, tmp_path, capsys):
+        """Test the CLI the Makefile uses to fill the Ansible inventory"""
+        state_file = tmp_path / "terraform.tfstate"
+        state_file.write_text(json.dumps(make_state()))
         
-        # Check VPC resource
-        vpc_resource = next(r for r in mock_state["resources"] if r["type"] == "aws_vpc")
-        assert vpc_resource["instances"][0]["attributes"]["cidr_block"] == "10.0.0.0/16"
+        assert tfstate.main(["query", str(state_file), "aws_instance.web[0]", "public_ip"]) == 0
+        assert capsys.readouterr().out == "54.0.0.10\n"
+        # The region the Makefile hands to the monitoring role
+        assert tfstate.main(["query", str(state_file), "data.aws_region.current", "name"]) == 0
+        assert capsys.readouterr().out == "eu-west-1\n"
+        assert tfstate.main(["query", str(state_file), "aws_instance", "no_such_attribute"]) == 1
+
+
+def make_plan(changes):
+    """`terraform show -json` plan document for (address, actions, before, after) tuples"""
+    resource_changes = []
+    for address, actions, before, after in changes:
+        change = {"actions": actions, "before": before, "after": after, "after_unknown": {}}
+        if actions == ["delete", "create"]:
+            change["replace_paths"] = [[key] for key in after if before.get(key) != after.get(key)]
+            change["after_unknown"] = {"id": True, "arn": True}
+        resource_changes.append({
+            "address": address, "mode": "managed", "type": address.split(".")[0],
+            "name": address.split(".")[1].split("[")[0], "change": change,
+        })
+    return {
+        "format_version": "1.2",
+        "planned_values": {"root_module": {}},
+        "resource_changes": resource_changes,
+        "configuration": {"root_module": {"resources": []}},
+    }
+
+
+class TestPlanDiff:
+    """Test the plan-diff engine in scripts/plandiff.py"""
+    
+    def test_classify_actions(self):
+        """Test every action list terraform emits maps to one action, unknown ones to other"""
+        assert plandiff.classify(["create"]) == "create"
+        assert plandiff.classify(["update"]) == "update"
+        assert plandiff.classify(["delete", "create"]) == "replace"
+        assert plandiff.classify(["create", "delete"]) == "replace"
+        assert plandiff.classify(["no-op"]) == "no-op"
+        assert plandiff.classify(["forget"]) == "other"
+        assert plandiff.classify(["create", "update"]) == "other"
+    
+    def test_timestamp_bucket_name_is_flagged(self):
+        """Test the timestamp() in aws_s3_bucket.config is found in main.tf"""
+        unstable = plandiff.unstable_attributes(TERRAFORM_DIR)
+        assert unstable["aws_s3_bucket.config"] == {"bucket": "timestamp()"}
+    
+    def test_plan_is_classified_per_resource(self, tmp_path):
+        """Test counts, changed attributes and perpetual replacement detection"""
+        plan_file = tmp_path / "plan.json"
+        plan_file.write_text(json.dumps(make_plan([
+            ("aws_vpc.main", ["no-op"], {"cidr_block": "10.0.0.0/16"}, {"cidr_block": "10.0.0.0/16"}),
+            ("aws_instance.web", ["update"], {"instance_type": "t3.micro", "ami": "ami-1"},
+             {"instance_type": "t3.small", "ami": "ami-1"}),
+            ("aws_s3_bucket.config", ["delete", "create"], {"bucket": "bb-iac-config-20250101-abc"},
+             {"bucket": "bb-iac-config-20250102-abc"}),
+            ("aws_cloudwatch_log_group.web_logs", ["create"], None, {"name": "/aws/ec2/bb-iac-web"}),
+            # removed {} block (Terraform 1.7+): out of state, not destroyed
+            ("aws_eip.legacy", ["forget"], {"public_ip": "203.0.113.7"}, None),
+        ])))
+        
+        diff = plandiff.PlanDiff.from_file(plan_file, TERRAFORM_DIR)
+        summary = diff.as_dict()
+        assert summary["counts"] == {"create": 1, "update": 1, "replace": 1, "delete": 0, "read": 0, "no-op": 1,
+                                     "other": 1}
+        changes = {c["address"]: c for c in summary["changes"]}
+        assert changes["aws_instance.web"]["changed"] == ["instance_type"]
+        assert changes["aws_s3_bucket.config"]["replace_paths"] == ["bucket"]
+        assert summary["perpetual_replacements"] == ["aws_s3_bucket.config"]
+        lines = diff.summary_lines()
+        assert any("uses timestamp()" in line for line in lines)
+        assert lines[0].endswith(", 1 other")
+        assert "  ? aws_eip.legacy (other)" in lines
+    
+    def test_large_plan_is_fast(self, tmp_path):
+        """Test thousands of resource changes are classified well under a second"""
+        changes = [
+            (f"aws_instance.fleet[{i}]", ["update"],
+             {"tags": {"n": "1"}, "ami": "ami-1"}, {"tags": {"n": "2"}, "ami": "ami-1"})
+            for i in range(5000)
+        ]
+        plan_file = tmp_path / "plan.json"
+        plan_file.write_text(json.dumps(make_plan(changes)))
+        
+        started = time.perf_counter()
+        diff = plandiff.PlanDiff.from_file(plan_file, TERRAFORM_DIR)
+        elapsed = time.perf_counter() - started
+        
+        assert diff.counts["update"] == 5000
+        assert elapsed < 1.0, f"plan diff took {elapsed:.2f}s"
+
+
+class TestTerraformOutputsCache:
+    """Test the shared terraform outputs cache used by integration tests"""
+    
+    def _fake_terraform(self, tmp_path, monkeypatch, outputs):
+        """Install a stub terraform that counts its invocations"""
+        calls = tmp_path / "calls"
+        script = tmp_path / "terraform"
+        script.write_text(f"#!/bin/sh\necho x >> {calls}\necho '{json.dumps(outputs)}'\n")
+        script.chmod(0o755)
+        monkeypatch.setenv("TERRAFORM_CMD", str(script))
+        return calls
+    
+    def _write_state(self, terraform_dir, serial):
+        (terraform_dir / "terraform.tfstate").write_text(json.dumps({
+            "version": 4, "terraform_version": "1.5.7", "serial": serial,
+            "lineage": "test-lineage", "outputs": {}, "resources": []
+        }))
+    
+    def test_outputs_read_once_per_state_serial(self, tmp_path, monkeypatch):
+        """Test workers share one terraform read until the state serial changes"""
+        terraform_dir = tmp_path / "stack"
+        terraform_dir.mkdir()
+        calls = self._fake_terraform(tmp_path, monkeypatch, {"vpc_id": {"value": "vpc-123"}})
+        self._write_state(terraform_dir, serial=1)
+        
+        # Two providers stand in for two xdist workers sharing the cache dir
+        worker_a = TerraformOutputs(tmp_path / "cache", terraform_dir)
+        worker_b = TerraformOutputs(tmp_path / "cache", terraform_dir)
+        assert worker_a.load()["vpc_id"]["value"] == "vpc-123"
+        assert worker_b.load()["vpc_id"]["value"] == "vpc-123"
+        assert len(calls.read_text().splitlines()) == 1
+        
+        # A new apply bumps the serial and invalidates the shared cache
+        self._write_state(terraform_dir, serial=2)
+        worker_b.load()
+        assert len(calls.read_text().splitlines()) == 2
+    
+    def test_outputs_streamed_from_state_without_terraform(self, tmp_path, monkeypatch):
+        """Test outputs come from the local state when terraform is not installed"""
+        monkeypatch.setattr("support.terraform.terraform_command", lambda: None)
+        (tmp_path / "terraform.tfstate").write_text(json.dumps(make_state()))
+        
+        outputs = TerraformOutputs(tmp_path / "cache", tmp_path).load()
+        assert outputs == {"vpc_id": {"value": "vpc-0abc", "type": "string"}}
+
+
+class TestS3LogArchival:
+    """Test rotated log archival into the config bucket against moto"""
+    
+    @pytest.fixture
+    def archiver_module(self, role_module):
+        return role_module("monitoring", "s3_log_archive")
+    
+    @pytest.fixture
+    def nginx_logs(self, tmp_path):
+        """access.log with one uncompressed and two compressed generations"""
+        log_dir = tmp_path / "nginx"
+        log_dir.mkdir()
+        log = log_dir / "access.log"
+        
+        def generation(start):
+            return "".join(
+                f'{start + i:.3f}\t198.51.100.{i % 9}\tGET\t/\t200\t10\t200\t0.002\t-\t"curl"\n'
+                for i in range(200)
+            ).encode()
+        
+        log.write_bytes(generation(1_700_010_000))
+        (log_dir / "access.log.1").write_bytes(generation(1_700_006_400))
+        (log_dir / "access.log.2.gz").write_bytes(gzip.compress(generation(1_700_002_800), mtime=0))
+        (log_dir / "access.log.3.gz").write_bytes(gzip.compress(generation(1_699_999_200), mtime=0))
+        return log
+    
+    def _keys(self, s3, bucket):
+        return sorted(o["Key"] for o in s3.list_objects_v2(Bucket=bucket, Prefix="logs/").get("Contents", []))
+    
+    def test_archives_are_partitioned_and_deduplicated(self, aws_client, baseline_topology, archiver_module,
+                                                       nginx_logs, tmp_path):
+        """Test keys are time partitioned and content already shipped is never re-sent"""
+        s3 = aws_client("s3")
+        bucket = baseline_topology.bucket_name
+        store = archiver_module.CheckpointStore(str(tmp_path / "state.json"))
+        archiver = archiver_module.S3LogArchiver(s3, bucket, store, host="web1")
+        
+        counts = archiver.run([str(nginx_logs)])
+        assert (counts["uploaded"], counts["failed"]) == (2, 0)
+        keys = self._keys(s3, bucket)
+        # 1_699_999_200 is 2023-11-14 22:00 UTC; access.log.1 waits for compression
+        assert [k.rsplit("/", 1)[0] for k in keys] == [
+            "logs/nginx-access/dt=2023-11-14/hour=22",
+            "logs/nginx-access/dt=2023-11-14/hour=23",
+        ]
+        assert all(k.rsplit("/", 1)[1].startswith("web1-access.log-") for k in keys)
+        head = s3.head_object(Bucket=bucket, Key=keys[0])
+        assert head["Metadata"]["sha256"] == archiver_module.hashlib.sha256(
+            (nginx_logs.parent / "access.log.3.gz").read_bytes()).hexdigest()
+        
+        # Next rotation: renamed archives are recognised, only the new one ships
+        log_dir = nginx_logs.parent
+        (log_dir / "access.log.3.gz").rename(log_dir / "access.log.4.gz")
+        (log_dir / "access.log.2.gz").rename(log_dir / "access.log.3.gz")
+        (log_dir / "access.log.2.gz").write_bytes(gzip.compress((log_dir / "access.log.1").read_bytes(), mtime=0))
+        counts = archiver.run([str(nginx_logs)])
+        assert counts["uploaded"] == 1
+        assert len(self._keys(s3, bucket)) == 3
         
-        # Check EC2 resource
-        ec2_resource = next(r for r in mock_state["resources"] if r["type"] == "aws_instance")
-        assert ec2_resource["instances"][0]["attributes"]["instance_type"] == "t3.micro"
+        # Lost state: objects already in the bucket are matched by content hash
+        fresh = archiver_module.CheckpointStore(str(tmp_path / "fresh.json"))
+        counts = archiver_module.S3LogArchiver(s3, bucket, fresh, host="web1").run([str(nginx_logs)])
+        assert (counts["uploaded"], counts["deduplicated"]) == (0, 3)
+        
+        # logrotate deletes the oldest generation; its shipped marker goes with it
+        oldest = archiver_module.hashlib.sha256((log_dir / "access.log.4.gz").read_bytes()).hexdigest()
+        (log_dir / "access.log.4.gz").unlink()
+        assert archiver.run([str(nginx_logs)])["uploaded"] == 0
+        assert f"s3:done:{oldest}" not in store.data
+        assert sum(key.startswith("s3:done:") for key in store.data) == 2
+    
+    def test_multipart_upload_resumes_after_interruption(self, aws_client, baseline_topology, archiver_module,
+                                                         tmp_path):
+        """Test an interrupted multipart upload continues from its checkpointed parts"""
+        s3 = aws_client("s3")
+        bucket = baseline_topology.bucket_name
+        part_size = archiver_module.MIN_PART_SIZE
+        (tmp_path / "log").mkdir()
+        log = tmp_path / "log" / "auth.log"
+        log.write_text("")
+        archive = tmp_path / "log" / "auth.log.2.gz"
+        archive.write_bytes(os.urandom(2 * part_size + 1024))
+        os.utime(archive, (1_700_000_000, 1_700_000_000))
+        
+        class RecordingS3:
+            """Client wrapper that counts parts and can drop one"""
+            
+            def __init__(self, fail_part=None):
+                self.fail_part = fail_part
+                self.parts = []
+            
+            def __getattr__(self, name):
+                return getattr(s3, name)
+            
+            def upload_part(self, **kwargs):
+                if kwargs["PartNumber"] == self.fail_part:
+                    raise EndpointConnectionError(endpoint_url="https://s3.amazonaws.com")
+                self.parts.append(kwargs["PartNumber"])
+                return s3.upload_part(**kwargs)
+        
+        state_file = str(tmp_path / "state.json")
+        flaky = RecordingS3(fail_part=3)
+        counts = archiver_module.S3LogArchiver(
+            flaky, bucket, archiver_module.CheckpointStore(state_file), host="web1", part_size=part_size, workers=2,
+        ).run([str(log)])
+        assert counts["failed"] == 1
+        assert sorted(flaky.parts) == [1, 2]
+        assert self._keys(s3, bucket) == []
+        
+        # A new process picks the upload up from the state file
+        recording = RecordingS3()
+        counts = archiver_module.S3LogArchiver(
+            recording, bucket, archiver_module.CheckpointStore(state_file), host="web1", part_size=part_size,
+        ).run([str(log)])
+        assert (counts["resumed"], counts["uploaded"], counts["failed"]) == (1, 1, 0)
+        assert recording.parts == [3]
+        
+        (key,) = self._keys(s3, bucket)
+        assert key.startswith("logs/auth/dt=2023-11-14/hour=22/web1-auth.log-")
+        assert s3.get_object(Bucket=bucket, Key=key)["Body"].read() == archive.read_bytes()
+    
+    def test_instance_role_can_write_logs_prefix_only(self):
+        """Test main.tf grants the instance profile write access to logs/ in the config bucket"""
+        main_tf = (TERRAFORM_DIR / "main.tf").read_text()
+        assert 'iam_instance_profile   = aws_iam_instance_profile.web.name' in main_tf
+        assert 'Resource = "${aws_s3_bucket.config.arn}/logs/*"' in main_tf
+        assert '"s3:DeleteObject"' not in main_tf
+
+
+class TestMetricRollup:
+    """Test per-minute metric pre-aggregation published to moto CloudWatch"""
+    
+    MINUTE = 1_700_000_040
+    
+    @pytest.fixture
+    def rollup_module(self, role_module):
+        return role_module("monitoring", "metric_rollup")
+    
+    @pytest.fixture
+    def proc(self, tmp_path):
+        return fake_proc(tmp_path, loadavg="0.52 0.40 0.31 1/123 4567", tcp=["01", "01", "01", "06", "06"], meminfo={
+            "MemTotal": 1000000, "MemFree": 100000, "MemAvailable": 400000, "SwapTotal": 200000, "SwapFree": 150000,
+        })
+    
+    def _rollup(self, rollup_module, proc, tmp_path, cloudwatch, clock):
+        probe = rollup_module.MetricProbe(str(proc), statvfs=fake_statvfs(reserved_blocks=50))
+        return rollup_module.MetricRollup(
+            probe,
+            rollup_module.MinuteAggregator({"host": "rollup-test"}),
+            rollup_module.CloudWatchPublisher(cloudwatch),
+            access_log=str(tmp_path / "access.log"),
+            state_file=str(tmp_path / "state.json"),
+            clock=clock,
+        )
+    
+    def _stats(self, cloudwatch, name, stats):
+        points = cloudwatch.get_metric_statistics(
+            Namespace="BB-IaC-Pipeline", MetricName=name,
+            Dimensions=[{"Name": "host", "Value": "rollup-test"}],
+            StartTime=datetime.fromtimestamp(self.MINUTE - 60, timezone.utc),
+            EndTime=datetime.fromtimestamp(self.MINUTE + 120, timezone.utc),
+            Period=60, Statistics=stats,
+        )["Datapoints"]
+        return points
+    
+    def test_minute_of_samples_is_one_datapoint_per_metric(self, aws_client, rollup_module, proc, tmp_path):
+        """Test 5 s samples collapse into per-minute statistic sets sent in one call"""
+        cloudwatch = aws_client("cloudwatch")
+        
+        class RecordingCloudWatch:
+            calls = []
+            
+            def put_metric_data(self, **kwargs):
+                self.calls.append(len(kwargs["MetricData"]))
+                return cloudwatch.put_metric_data(**kwargs)
+        
+        now = [self.MINUTE]
+        recording = RecordingCloudWatch()
+        rollup = self._rollup(rollup_module, proc, tmp_path, recording, lambda: now[0])
+        access_log = tmp_path / "access.log"
+        access_log.write_text("")
+        for tick in range(12):
+            # 10 jiffies per tick: user 6 -> 2, system 1, idle 2, iowait 1
+            jiffies = tick * 10
+            (proc / "stat").write_text(
+                f"cpu  {jiffies * 6 // 10} 0 {jiffies // 10} {jiffies * 2 // 10} {jiffies // 10} 0 0 0 0 0\n"
+            )
+            with open(access_log, "a") as f:
+                for i in range(3):
+                    status = 502 if tick == 5 and i == 0 else 200
+                    latency = f"0.0{tick % 5 + 1}0"
+                    f.write(f"{now[0] + i * 0.1:.3f}\t203.0.113.1\tGET\t/\t{status}\t10\t200\t{latency}\t-\t\"curl\"\n")
+            rollup.tick()
+            now[0] += 5
+        
+        # Nothing goes out until the minute is over
+        now[0] = self.MINUTE + 59
+        assert rollup.publish() == 0
+        now[0] = self.MINUTE + 61
+        sent = rollup.publish()
+        assert recording.calls == [sent]
+        
+        (cpu,) = self._stats(cloudwatch, "cpu_usage_user", ["SampleCount", "Average"])
+        assert cpu["SampleCount"] == 11
+        assert cpu["Average"] == pytest.approx(60.0)
+        (mem,) = self._stats(cloudwatch, "mem_used_percent", ["Maximum"])
+        assert mem["Maximum"] == 60
+        (tcp,) = self._stats(cloudwatch, "tcp_established", ["Average"])
+        assert tcp["Average"] == 3
+        (requests,) = self._stats(cloudwatch, "nginx_requests", ["Sum"])
+        assert requests["Sum"] == 36
+        (errors,) = self._stats(cloudwatch, "nginx_5xx", ["Sum"])
+        assert errors["Sum"] == 1
+        (latency,) = self._stats(cloudwatch, "nginx_request_time", ["SampleCount", "Maximum"])
+        assert latency["SampleCount"] == 36
+        assert latency["Maximum"] == pytest.approx(0.05, rel=0.06)
+    
+    def test_publisher_batches_and_retries(self, rollup_module):
+        """Test datums are split at the request limit and kept when a call fails"""
+        class FlakyCloudWatch:
+            def __init__(self):
+                self.calls = []
+                self.down = True
+            
+            def put_metric_data(self, **kwargs):
+                if self.down:
+                    raise EndpointConnectionError(endpoint_url="https://monitoring.us-east-1.amazonaws.com")
+                self.calls.append(len(kwargs["MetricData"]))
+        
+        stamp = datetime.now(timezone.utc)
+        datums = [{"MetricName": f"m{i}", "Value": 1.0, "Timestamp": stamp} for i in range(2500)]
+        flaky = FlakyCloudWatch()
+        publisher = rollup_module.CloudWatchPublisher(flaky)
+        assert publisher.publish(datums) == 0
+        assert len(publisher.pending) == 2500
+        
+        flaky.down = False
+        assert publisher.publish([]) == 2500
+        assert flaky.calls == [1000, 1000, 500]
+        assert publisher.pending == []
+    
+    def test_publisher_drops_rejected_batches(self, rollup_module):
+        """Test a batch CloudWatch rejects as invalid is dropped, while throttling keeps it"""
+        def client_error(code, status):
+            return ClientError({"Error": {"Code": code, "Message": code},
+                                "ResponseMetadata": {"HTTPStatusCode": status}}, "PutMetricData")
+        
+        class StrictCloudWatch:
+            def __init__(self):
+                self.calls = []
+                self.throttled = False
+            
+            def put_metric_data(self, **kwargs):
+                if self.throttled:
+                    raise client_error("Throttling", 400)
+                if any(d["MetricName"] == "bad" for d in kwargs["MetricData"]):
+                    raise client_error("InvalidParameterValue", 400)
+                self.calls.append(len(kwargs["MetricData"]))
+        
+        stamp = datetime.now(timezone.utc)
+        bad = [{"MetricName": "bad", "Value": float("nan"), "Timestamp": stamp}]
+        good = [{"MetricName": f"m{i}", "Value": 1.0, "Timestamp": stamp} for i in range(1000)]
+        cloudwatch = StrictCloudWatch()
+        publisher = rollup_module.CloudWatchPublisher(cloudwatch)
+        assert publisher.publish(bad + good[:999]) == 0
+        assert publisher.dropped == 1000
+        assert publisher.publish(good) == 1000
+        assert cloudwatch.calls == [1000]
+        
+        cloudwatch.throttled = True
+        assert publisher.publish(good) == 0
+        assert len(publisher.pending) == 1000
+        assert publisher.dropped == 1000
+    
+    def test_histogram_respects_value_limit(self, rollup_module):
+        """Test a wide latency spread is split across datums of at most 150 values"""
+        histogram = rollup_module.Histogram()
+        for i in range(1, 20001):
+            histogram.add(i * 1e-5)
+        histogram.add(0.0)
+        datums = histogram.as_datums()
+        assert all(len(d["Values"]) <= rollup_module.MAX_VALUES for d in datums)
+        assert sum(sum(d["Counts"]) for d in datums) == 20001
+        assert datums[0]["Values"][0] == 0.0
 
 
 class TestInfrastructureSecurity: